@@ -2,12 +2,93 @@ import os
 import logging
 import asyncio
 import json
-from google import genai
+import time
 from google.genai import types
 from mcp_client import CortexMCPClient
+from tool_catalog import ToolCatalog
+from tool_results import ToolResultCache
+from tool_shaping import content_payload, shape_responses
+from genai_client import GenAIClientFactory
+from context_cache import ContextCache, generation_config
+from subnet_index import SubnetIndex, LOCAL_SUBNET_TOOL, SUBNET_TOOL_DECLARATION
 
 logger = logging.getLogger(__name__)
 
+# Converted MCP tool declarations, shared across prompts
+TOOL_CATALOG = ToolCatalog(ttl=int(os.environ.get("MCP_TOOL_CACHE_TTL", "300")))
+
+# Results of read-only MCP tool calls, shared across prompts
+TOOL_RESULTS = ToolResultCache(
+    max_entries=int(os.environ.get("MCP_RESULT_CACHE_SIZE", "256")),
+    policies=json.loads(os.environ.get("MCP_RESULT_CACHE_POLICY") or "{}")
+)
+
+# Local longest-prefix-match snapshot of the agentic_subnet_lookup dataset
+SUBNET_INDEX = SubnetIndex(
+    tool_name=os.environ.get("SUBNET_INDEX_TOOL", "run_xql_query"),
+    tool_args=json.loads(os.environ.get("SUBNET_INDEX_TOOL_ARGS") or '{"query": "dataset = agentic_subnet_lookup"}'),
+    ttl=int(os.environ.get("SUBNET_INDEX_TTL", "900")),
+    field=os.environ.get("SUBNET_INDEX_FIELD") or None
+)
+
+# One GenAI client per configuration, shared across prompts
+GENAI_CLIENTS = GenAIClientFactory()
+
+# Gemini cached-content handles for the system prompt + tools prefix
+CONTEXT_CACHE = ContextCache(
+    ttl=int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600")),
+    enabled=os.environ.get("GEMINI_CONTEXT_CACHE", "true").lower() == "true"
+)
+
+SYSTEM_INSTRUCTION = """You are an advanced Security Analyst Agent in the Troy Security Operations Center (SOC).
+Your mission is to protect the Troy network assets from external and internal threats, utilizing a multi-vendor, integrated SOC/NOC architecture.
+
+**The Environment & Topology:**
+The architecture is a centralized SOC/NOC stack where **Palo Alto Networks (Cortex XSIAM)** acts as the "Central Brain" for analytics and response.
+
+**1. Palo Alto Networks (Central Operations):**
+- **Role**: Primary security analytics, threat prevention, file analysis, and orchestration layer.
+- **Capabilities**: Cortex XSIAM (SOC Platform), Strata (Network Security), Advanced Threat Prevention, IoT Security, AIOps.
+- **Flow**: Ingests logs from Cisco, Arista, Coerelight; Orchestrates response actions to Arista.
+
+**2. Arista (Network Fabric & Enforcement):**
+- **Role**: Provides switching/wireless infrastructure, network visibility, and enforcement.
+- **Capabilities**: CV-CUE, CloudVision, AGNI.
+- **Flow**: Sends logs to Palo Alto; **Enforces responses** (e.g., Device Quarantine) triggered by Palo Alto; Mirrors traffic (Taps) to Corelight.
+
+**3. Corelight (Network Detection & Response - NDR):**
+- **Role**: Deep packet inspection and behavioral analytics.
+- **Capabilities**: Zeek, Suricata, Yara, Smart PCAP.
+- **Flow**: Receives raw traffic from Arista Taps; Sends enriched NDR telemetry/logs to Palo Alto.
+
+**4. Cisco (Security Cloud & Telemetry):**
+- **Role**: Identity, endpoint, cloud, and IoT telemetry provider.
+- **Capabilities**: ThousandEyes (Monitoring), Meraki (IoT/Cameras), Duo (Identity), Splunk Attack Analyzer.
+- **Flow**: Sends logs and suspicious file submissions to Palo Alto.
+
+**Data Flow Summary:**
+- **Logs**: Arista/Cisco/Corelight -> Palo Alto (XSIAM).
+- **Response**: Palo Alto -> Arista (Blocking/Quarantine).
+- **Taps**: Arista -> Corelight (Inspection).
+- **Files**: Cisco -> Palo Alto (Analysis).
+
+**Your Persona & Guidelines:**
+- **Team Member**: You are not a robot; you are a valued member of the Troy SOC team. Act like a colleague—be collaborative, encouraging, and clear.
+- **Human-Like**: Use natural language. Avoid overly robotic phrasing. It's okay to show personality (e.g., "Good catch!", "Let's dig into this.").
+- **Vigilant**: Expect hostile traffic from the Training Rooms (Internal) and Registration Servers (External).
+- **Context-Aware**: Understand that an alert from Corelight or Arista isn't isolated—it feeds into XSIAM. Use this context for correlation.
+- **Subnet Lookup**: You MUST use the `agentic_subnet_lookup` dataset to identify the physical location/purpose of an IP (e.g., "Which training room is this?"). When the `lookup_ip_subnet` tool is available, use it first (it answers from a local snapshot of that dataset); query the dataset through MCP only for IPs it reports as unmatched.
+- **Reporting**: Cite specific tools and flows (e.g., "I'm seeing a correlation in XSIAM matching the Corelight NDR hits...").
+"""
+
+# Parallel function call execution limits
+TOOL_CONCURRENCY = int(os.environ.get("MCP_TOOL_CONCURRENCY", "4"))
+TOOL_TIMEOUT = float(os.environ.get("MCP_TOOL_TIMEOUT", "120"))
+
+# Estimated-token budgets for tool results sent back to the model
+RESULT_TOKEN_BUDGET = int(os.environ.get("MCP_RESULT_TOKEN_BUDGET", "8000"))
+TURN_TOKEN_BUDGET = int(os.environ.get("MCP_TURN_TOKEN_BUDGET", "24000"))
+
 def get_tools_schema(tools_list):
     """
     Convert MCP tools list to Gemini function declarations.
@@ -21,32 +102,95 @@ def get_tools_schema(tools_list):
         })
     return gemini_tools
 
-async def run_agent_async(text, history=None, status_callback=None):
+async def execute_tool_calls(mcp_client, function_calls, status_callback=None,
+                             max_concurrency=None, timeout=None):
     """
-    Async implementation of the agent logic with optional status callback.
+    Run the model's function calls concurrently (bounded by max_concurrency),
+    each with its own timeout. A failing call becomes an error response for
+    that call only. Results are then shaped to the per-result and per-turn
+    token budgets. Returned parts are in the same order as function_calls.
+    """
+    max_concurrency = max(1, max_concurrency or TOOL_CONCURRENCY)
+    timeout = timeout or TOOL_TIMEOUT
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_call(call):
+        # Gemini sends args=None for calls without arguments
+        args = call.args or {}
+        async with semaphore:
+            logger.info(f"Agent invoking tool: {call.name} with args: {args}")
+            if status_callback:
+                status_callback("Tool Call", f"Executing **{call.name}**\nArgs: `{args}`", "running")
+
+            try:
+                # Answered from the local subnet index, no MCP round trip
+                if call.name == LOCAL_SUBNET_TOOL:
+                    response = SUBNET_INDEX.lookup_many(args.get("ips"))
+                    logger.info(f"Tool {call.name} answered locally: {str(response)[:500]}")
+                    if status_callback:
+                        status_callback("Tool Result", f"Result from **{call.name}** (local index):\n```\n{str(response)[:500]}\n```", "success")
+                    return {"result": response}
+
+                # Serve repeated read-only calls from the result cache
+                hint = TOOL_CATALOG.read_only_hint(call.name)
+                result = TOOL_RESULTS.get(call.name, args, hint)
+                cached = result is not None
+                if not cached:
+                    # Call MCP tool
+                    result = await asyncio.wait_for(mcp_client.call_tool(call.name, args), timeout)
+                    TOOL_RESULTS.put(call.name, args, result, hint)
+
+                # Convert result content to string if needed for display
+                result_content = result.content
+                source = " (cached)" if cached else ""
+                logger.info(f"Tool {call.name} returned{source}: {str(result_content)[:500]}")
+                if status_callback:
+                    status_callback("Tool Result", f"Result from **{call.name}**{source}:\n```\n{str(result_content)[:500]}...\n```", "success")
+
+                return {"result": content_payload(result.content)}
+            except Exception as e:
+                error = f"Timed out after {timeout:g}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                logger.error(f"Tool {call.name} failed: {error}")
+                if status_callback:
+                    status_callback("Tool Error", f"Tool **{call.name}** failed: {error}", "error")
+                return {"error": error}
+
+    responses = await asyncio.gather(*(run_call(call) for call in function_calls))
+    responses = shape_responses(responses, RESULT_TOKEN_BUDGET, TURN_TOKEN_BUDGET)
+    for call, response in zip(function_calls, responses):
+        if response.get("omitted"):
+            logger.info(f"Tool {call.name} result trimmed: {response['omitted']}")
+    return [
+        types.Part(function_response=types.FunctionResponse(name=call.name, response=response))
+        for call, response in zip(function_calls, responses)
+    ]
+
+def _response_parts(chunk):
+    """
+    Parts of the first candidate of a (streamed) model response, if any.
+    """
+    if not chunk.candidates or not chunk.candidates[0].content:
+        return []
+    return chunk.candidates[0].content.parts or []
+
+async def stream_agent_async(text, history=None, status_callback=None):
+    """
+    Streaming implementation of the agent logic with optional status callback.
+    Async generator of events:
+      {"type": "text", "text": delta}
+      {"type": "tool_call", "name": str, "args": dict}
+      {"type": "tool_result", "name": str, "ok": bool}
     Callback signature: status_callback(step: str, details: str, status: str = "info")
     """
     if status_callback:
         status_callback("Initialization", "Setting up Vertex AI Client...", "running")
     api_key = os.environ.get("GEMINI_API_KEY")
-    creds_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    creds_value = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     
     # Determine model first to decide location
     model_name = os.environ.get("GEMINI_MODEL", "gemini-3-pro-preview")
     location = "us-central1"
     
-    # Handle inline credentials if present
-    if creds_path and not os.path.exists(creds_path) and creds_path.strip().startswith("{"):
-        try:
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as temp:
-                temp.write(creds_path)
-                creds_path = temp.name
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = creds_path
-            logger.info("Converted GOOGLE_APPLICATION_CREDENTIALS content to temporary file")
-        except Exception as e:
-            logger.error(f"Failed to write credentials content to temp file: {e}")
-    
     # Logic from user snippet: Route Gemini 3 to global
     if "gemini-3" in model_name.lower() or "experimental" in model_name.lower():
         location = "global"
@@ -54,136 +198,32 @@ async def run_agent_async(text, history=None, status_callback=None):
         if status_callback:
             status_callback("Config", f"Routing to GLOBAL location for model: {model_name}", "info")
 
-    client = None
-    
-    # Initialize Client
-    if api_key:
-        client = genai.Client(api_key=api_key)
-    elif creds_path and os.path.exists(creds_path):
-        # Vertex AI mode
-        try:
-            with open(creds_path, 'r') as f:
-                creds_data = json.load(f)
-                project_id = creds_data.get("project_id")
-            
-            if project_id:
-                logger.info(f"Using Vertex AI with project: {project_id} and location: {location}")
-                client = genai.Client(vertexai=True, project=project_id, location=location)
-            else:
-                logger.error("project_id not found in credentials.json")
-        except Exception as e:
-            logger.error(f"Failed to load credentials: {e}")
+    # Reuse the client (and its cached OAuth token) built for this configuration
+    client = await GENAI_CLIENTS.get(api_key=api_key, credentials_value=creds_value, location=location)
     
     if not client:
-        return "Error: Neither GEMINI_API_KEY nor valid GOOGLE_APPLICATION_CREDENTIALS found."
+        yield {"type": "text", "text": "Error: Neither GEMINI_API_KEY nor valid GOOGLE_APPLICATION_CREDENTIALS found."}
+        return
     
     
     # 1. Connect to MCP and get tools (Using Context Manager)
     if status_callback:
         status_callback("MCP", "Connecting to MCP Server...", "running")
         
-    async with CortexMCPClient() as mcp_client:
+    async with CortexMCPClient(message_handler=TOOL_CATALOG.message_handler) as mcp_client:
         defined_tools = []
         try:
-            tools_response = await mcp_client.list_tools()
-            
-            # Create a tool definition for Gemini
-            # fastmcp returns a list of Tool objects directly
-            if isinstance(tools_response, list):
-                tools_list = tools_response
-            else:
-                tools_list = tools_response.tools
-
-            # Create a tool definition for Gemini
-            gemini_funcs = []
-            for t in tools_list:
-                # Defensive check for inputSchema vs parameters
-                schema = getattr(t, "parameters", getattr(t, "inputSchema", {}))
-                
-                # Sanitize schema for Gemini compatibility
-                # Gemini SDK (Pydantic models) often rejects $defs/definitions and $ref
-                # We need to perform simple dereferencing or stripping
-                
-                def sanitize_schema(s, defs=None, depth=0, processing=None):
-                    if not isinstance(s, dict):
-                        return s
-                    
-                    if depth > 10:
-                        return {"type": "object", "description": "Complex/Deeply nested object"}
-                        
-                    processing = processing or set()
-                    
-                    # Store definitions found at this level
-                    current_defs = defs or {}
-                    if "$defs" in s:
-                        current_defs.update(s.pop("$defs"))
-                    if "definitions" in s:
-                        current_defs.update(s.pop("definitions"))
-                        
-                    # Handle $ref
-                    if "$ref" in s:
-                        ref = s.pop("$ref")
-                        ref_name = ref.split("/")[-1]
-                        
-                        if ref_name in processing:
-                            return {"type": "object", "description": f"Recursive reference to {ref_name}"}
-
-                        if ref_name in current_defs:
-                            processing.add(ref_name)
-                            try:
-                                resolved = sanitize_schema(
-                                    current_defs[ref_name].copy(), 
-                                    current_defs, 
-                                    depth + 1,
-                                    processing.copy()
-                                )
-                                s.update(resolved)
-                            finally:
-                                processing.discard(ref_name)
-                        else:
-                             s["type"] = "string"
-                             s["description"] = f"Reference to {ref_name}"
-
-                    # SIMPLIFICATION FOR GEMINI: oneOf/anyOf/allOf
-                    # Gemini often rejects these. We replace them with a generic object type.
-                    complex_keys = ["oneOf", "anyOf", "allOf"]
-                    found_complex = False
-                    for key in complex_keys:
-                        if key in s:
-                            found_complex = True
-                            # Remove the complex key
-                            del s[key]
-                            
-                    if found_complex:
-                        # Fallback to loose object
-                        s["type"] = "object"
-                        s["description"] = s.get("description", "Complex variant type") + " (Validation simplified)"
-                        return s
-
-                    # Recursively sanitize properties
-                    if "properties" in s:
-                        for k, v in s["properties"].items():
-                            s["properties"][k] = sanitize_schema(v, current_defs, depth + 1, processing)
-                    
-                    if "items" in s:
-                        # For array items, if it's complex, it will be handled by the recursive call
-                        s["items"] = sanitize_schema(s["items"], current_defs, depth + 1, processing)
-                            
-                    return s
-
-                clean_schema = sanitize_schema(schema.copy())
-
-                gemini_funcs.append(types.FunctionDeclaration(
-                    name=t.name,
-                    description=t.description,
-                    parameters=clean_schema
-                ))
-                logger.info(f"Registered MCP tool: {t.name}")
-
-            defined_tools = [types.Tool(function_declarations=gemini_funcs)]
-            logger.info(f"Loaded {len(gemini_funcs)} tools from MCP total.")
+            # Served from the tool catalog cache unless it is stale
+            defined_tools = await TOOL_CATALOG.get_tools(mcp_client)
+            tool_count = len(TOOL_CATALOG.tool_names)
+            logger.info(f"Loaded {tool_count} tools from MCP total.")
             if status_callback:
-                status_callback("MCP", f"Loaded {len(gemini_funcs)} tools", "success")
+                status_callback("MCP", f"Loaded {tool_count} tools", "success")
+
+            # Expose the local subnet tool once its snapshot is available
+            if await SUBNET_INDEX.ensure_fresh(mcp_client, TOOL_CATALOG.tool_names):
+                declarations = [d for t in defined_tools for d in t.function_declarations]
+                defined_tools = [types.Tool(function_declarations=declarations + [SUBNET_TOOL_DECLARATION])]
         except Exception as e:
             logger.warning(f"Could not connect to MCP server: {e}. Proceeding without tools.")
             if status_callback:
@@ -191,51 +231,11 @@ async def run_agent_async(text, history=None, status_callback=None):
             # Proceed without tools
             defined_tools = None
 
-        # Setup the model
-        config = types.GenerateContentConfig(
-            system_instruction="""You are an advanced Security Analyst Agent in the Troy Security Operations Center (SOC).
-Your mission is to protect the Troy network assets from external and internal threats, utilizing a multi-vendor, integrated SOC/NOC architecture.
-
-**The Environment & Topology:**
-The architecture is a centralized SOC/NOC stack where **Palo Alto Networks (Cortex XSIAM)** acts as the "Central Brain" for analytics and response.
-
-**1. Palo Alto Networks (Central Operations):**
-- **Role**: Primary security analytics, threat prevention, file analysis, and orchestration layer.
-- **Capabilities**: Cortex XSIAM (SOC Platform), Strata (Network Security), Advanced Threat Prevention, IoT Security, AIOps.
-- **Flow**: Ingests logs from Cisco, Arista, Coerelight; Orchestrates response actions to Arista.
-
-**2. Arista (Network Fabric & Enforcement):**
-- **Role**: Provides switching/wireless infrastructure, network visibility, and enforcement.
-- **Capabilities**: CV-CUE, CloudVision, AGNI.
-- **Flow**: Sends logs to Palo Alto; **Enforces responses** (e.g., Device Quarantine) triggered by Palo Alto; Mirrors traffic (Taps) to Corelight.
-
-**3. Corelight (Network Detection & Response - NDR):**
-- **Role**: Deep packet inspection and behavioral analytics.
-- **Capabilities**: Zeek, Suricata, Yara, Smart PCAP.
-- **Flow**: Receives raw traffic from Arista Taps; Sends enriched NDR telemetry/logs to Palo Alto.
-
-**4. Cisco (Security Cloud & Telemetry):**
-- **Role**: Identity, endpoint, cloud, and IoT telemetry provider.
-- **Capabilities**: ThousandEyes (Monitoring), Meraki (IoT/Cameras), Duo (Identity), Splunk Attack Analyzer.
-- **Flow**: Sends logs and suspicious file submissions to Palo Alto.
-
-**Data Flow Summary:**
-- **Logs**: Arista/Cisco/Corelight -> Palo Alto (XSIAM).
-- **Response**: Palo Alto -> Arista (Blocking/Quarantine).
-- **Taps**: Arista -> Corelight (Inspection).
-- **Files**: Cisco -> Palo Alto (Analysis).
-
-**Your Persona & Guidelines:**
-- **Team Member**: You are not a robot; you are a valued member of the Troy SOC team. Act like a colleague—be collaborative, encouraging, and clear.
-- **Human-Like**: Use natural language. Avoid overly robotic phrasing. It's okay to show personality (e.g., "Good catch!", "Let's dig into this.").
-- **Vigilant**: Expect hostile traffic from the Training Rooms (Internal) and Registration Servers (External).
-- **Context-Aware**: Understand that an alert from Corelight or Arista isn't isolated—it feeds into XSIAM. Use this context for correlation.
-- **Subnet Lookup**: You MUST use the `agentic_subnet_lookup` dataset to identify the physical location/purpose of an IP (e.g., "Which training room is this?").
-- **Reporting**: Cite specific tools and flows (e.g., "I'm seeing a correlation in XSIAM matching the Corelight NDR hits...").
-"""
-        )
-        if defined_tools:
-            config.tools = defined_tools
+        # Setup the model, reusing the cached system prompt + tools prefix when available
+        cached_content = await CONTEXT_CACHE.get(client, model_name, SYSTEM_INSTRUCTION, defined_tools)
+        config = generation_config(cached_content, SYSTEM_INSTRUCTION, defined_tools)
+        if status_callback and cached_content:
+            status_callback("Gemini", "Using cached system prompt and tools", "info")
 
         # Prepare history if provided
         full_prompt = text
@@ -243,7 +243,8 @@ The architecture is a centralized SOC/NOC stack where **Palo Alto Networks (Cort
             history_text = "\n".join([f"User {m.get('user', 'Unknown')}: {m.get('text', '')}" for m in history])
             full_prompt = f"Chat History:\n{history_text}\n\nNew Message:\n{text}"
 
-        chat = client.chats.create(
+        # Async chat API so the model round trip does not block the event loop
+        chat = client.aio.chats.create(
             model=model_name,
             config=config
         )
@@ -252,50 +253,82 @@ The architecture is a centralized SOC/NOC stack where **Palo Alto Networks (Cort
             status_callback("Gemini", "Sending message to model...", "running")
             
         logger.info(f"📝 Sending Prompt to Gemini:\n{full_prompt}")
-        response = chat.send_message(full_prompt)
-        
-        # Handle tool calls
-        while response and response.function_calls:
-            # Execute tool calls
-            parts = []
-            for call in response.function_calls:
-                logger.info(f"Agent invoking tool: {call.name} with args: {call.args}")
-                if status_callback:
-                    status_callback("Tool Call", f"Executing **{call.name}**\nArgs: `{call.args}`", "running")
+        message = full_prompt
+        emitted_text = False
 
-                try:
-                    # Call MCP tool
-                    result = await mcp_client.call_tool(call.name, call.args)
+        while message is not None:
+            # Stream the model turn: text is forwarded as it arrives,
+            # function calls are collected until the turn completes
+            function_calls = []
+            separator = "\n\n" if emitted_text else ""
+            async for chunk in await chat.send_message_stream(message):
+                for part in _response_parts(chunk):
+                    if part.function_call:
+                        function_calls.append(part.function_call)
+                    elif part.text and not getattr(part, "thought", False):
+                        yield {"type": "text", "text": separator + part.text}
+                        separator = ""
+                        emitted_text = True
+
+            if not function_calls:
+                break
+
+            # Handle tool calls
+            for call in function_calls:
+                yield {"type": "tool_call", "name": call.name, "args": call.args}
+
+            # Execute tool calls concurrently; results keep the model's call order
+            message = await execute_tool_calls(mcp_client, function_calls, status_callback)
+
+            for call, part in zip(function_calls, message):
+                yield {"type": "tool_result", "name": call.name, "ok": "error" not in part.function_response.response}
 
-                    # Convert result content to string if needed for display
-                    result_content = result.content
-                    logger.info(f"Tool {call.name} returned: {str(result_content)[:500]}")
-                    if status_callback:
-                        status_callback("Tool Result", f"Result from **{call.name}**:\n```\n{str(result_content)[:500]}...\n```", "success")
-
-                    parts.append(types.Part(
-                        function_response=types.FunctionResponse(
-                            name=call.name,
-                            response={"result": result.content}
-                        )
-                    ))
-                except Exception as e:
-                    logger.error(f"Tool {call.name} failed: {e}")
-                    if status_callback:
-                        status_callback("Tool Error", f"Tool **{call.name}** failed: {str(e)}", "error")
-                    parts.append(types.Part(
-                        function_response=types.FunctionResponse(
-                            name=call.name,
-                            response={"error": str(e)}
-                        )
-                    ))
-            
             # Send results back to model
             if status_callback:
                 status_callback("Gemini", "Sending tool results back to model...", "running")
-            response = chat.send_message(parts)
 
-        return response.text
+async def run_agent_async(text, history=None, status_callback=None):
+    """
+    Async implementation of the agent logic with optional status callback.
+    Collects the streamed answer into a single string.
+    Callback signature: status_callback(step: str, details: str, status: str = "info")
+    """
+    chunks = []
+    async for event in stream_agent_async(text, history=history, status_callback=status_callback):
+        if event["type"] == "text":
+            chunks.append(event["text"])
+    return "".join(chunks)
+
+def refresh_tool_catalog():
+    """
+    Force the next prompt to reload the MCP tool list.
+    """
+    TOOL_CATALOG.invalidate()
+
+def get_schema_cache_stats():
+    """
+    Hit/miss counters of the compiled tool schema cache.
+    """
+    return TOOL_CATALOG.declarations.stats()
+
+def get_tool_result_cache_stats():
+    """
+    Hit/miss counters and hit rate of the tool result cache.
+    """
+    return TOOL_RESULTS.stats()
+
+def get_subnet_index_stats():
+    """
+    Size and age of the local subnet index snapshot.
+    """
+    age = time.monotonic() - SUBNET_INDEX.loaded_at if SUBNET_INDEX.loaded else None
+    return {"networks": SUBNET_INDEX.size, "age": age}
+
+def get_context_cache_stats():
+    """
+    Hit/create counters of the Gemini context cache.
+    """
+    return CONTEXT_CACHE.stats()
 
 def process_message(text):
     """
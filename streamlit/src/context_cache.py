@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+
+def prefix_key(model, system_instruction, tools):
+    """
+    Content hash of the static request prefix: model, system prompt and tool declarations.
+    """
+    declarations = [t.model_dump(mode="json", exclude_none=True) for t in tools or []]
+    payload = json.dumps([model, system_instruction, declarations], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ContextCache:
+    """
+    Gemini cached-content handles for the system prompt + tool declarations
+    prefix, keyed by prefix_key(). A handle is extended `refresh_margin`
+    seconds before it expires and replaced when the prompt or catalog
+    changes. When caching is unavailable (unsupported model, prefix below
+    the minimum cacheable size) the prefix is sent inline and creation is
+    not retried for `retry_interval` seconds.
+
+    Only `client.aio.caches.create/update/delete` are used, so any object
+    exposing those coroutines can stand in for the GenAI client.
+    """
+    def __init__(self, ttl=3600, refresh_margin=300, retry_interval=600, enabled=True):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.enabled = enabled
+        self.entries = {}
+        self.current = {}
+        self.failed = {}
+        self.hits = 0
+        self.creates = 0
+        self.refreshes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _expiry(self, cached):
+        expire_time = getattr(cached, "expire_time", None)
+        if expire_time is not None:
+            return expire_time.timestamp()
+        return time.time() + self.ttl
+
+    async def get(self, client, model, system_instruction, tools):
+        """
+        Returns the cached-content name for this prefix, or None to send it inline.
+        """
+        if not self.enabled:
+            return None
+
+        key = prefix_key(model, system_instruction, tools)
+        with self._lock:
+            entry = self.entries.get(key)
+            retry_at = self.failed.get(key, 0)
+        if entry is None and time.time() < retry_at:
+            return None
+
+        if entry and entry["expires_at"] - time.time() > self.refresh_margin:
+            self.hits += 1
+            return entry["name"]
+
+        if entry and entry["expires_at"] > time.time():
+            # Close to expiry: extend the existing handle
+            try:
+                cached = await client.aio.caches.update(
+                    name=entry["name"],
+                    config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+                )
+                with self._lock:
+                    entry["expires_at"] = self._expiry(cached)
+                self.refreshes += 1
+                logger.info(f"Extended context cache {entry['name']}")
+                return entry["name"]
+            except Exception as e:
+                logger.warning(f"Could not extend context cache {entry['name']}: {e}")
+
+        return await self._create(client, model, system_instruction, tools, key)
+
+    async def _create(self, client, model, system_instruction, tools, key):
+        try:
+            cached = await client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"soc-agent-{key[:12]}",
+                    system_instruction=system_instruction,
+                    tools=tools or None,
+                    ttl=f"{self.ttl}s"
+                )
+            )
+        except Exception as e:
+            self.failures += 1
+            with self._lock:
+                self.failed[key] = time.time() + self.retry_interval
+            logger.warning(f"Context caching unavailable for {model}, sending prompt inline: {e}")
+            return None
+
+        self.creates += 1
+        with self._lock:
+            self.entries[key] = {"name": cached.name, "expires_at": self._expiry(cached)}
+            previous = self.current.get(model)
+            self.current[model] = key
+            stale = self.entries.pop(previous, None) if previous and previous != key else None
+        logger.info(f"Created context cache {cached.name} for {model}")
+
+        # The old prefix will not be used again; drop it instead of waiting for its TTL
+        if stale:
+            try:
+                await client.aio.caches.delete(name=stale["name"])
+            except Exception as e:
+                logger.warning(f"Could not delete stale context cache {stale['name']}: {e}")
+        return cached.name
+
+    def invalidate(self):
+        with self._lock:
+            self.entries.clear()
+            self.current.clear()
+            self.failed.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "creates": self.creates,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "entries": len(self.entries),
+        }
+
+
+def generation_config(cached_content, system_instruction, tools, **kwargs):
+    """
+    GenerateContentConfig that references the cached prefix when there is
+    one, and carries the system prompt and tools inline otherwise.
+    """
+    if cached_content:
+        return types.GenerateContentConfig(cached_content=cached_content, **kwargs)
+    return types.GenerateContentConfig(system_instruction=system_instruction, tools=tools or None, **kwargs)
@@ -0,0 +1,127 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import weakref
+from google import genai
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+
+def load_credentials_info(value):
+    """
+    Service account info from GOOGLE_APPLICATION_CREDENTIALS, which holds
+    either the JSON itself or a path to it. Returns None when unusable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        if value.startswith("{"):
+            return json.loads(value)
+        if os.path.exists(value):
+            with open(value, "r") as f:
+                return json.load(f)
+    except Exception as e:
+        logger.error(f"Failed to load credentials: {e}")
+    return None
+
+
+def _fingerprint(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest() if value else None
+
+
+class GenAIClientFactory:
+    """
+    Reuses GenAI clients and service account credentials across prompts.
+
+    Credentials are parsed once per configuration and shared process-wide;
+    their OAuth token is refreshed in a worker thread `refresh_margin`
+    seconds before it expires, so model calls do not wait on a token round
+    trip, and nothing is written to disk. Clients are cached per event loop
+    because their async connection pool is bound to the loop that opened it.
+    """
+    def __init__(self, refresh_margin=300):
+        self.refresh_margin = refresh_margin
+        self.credentials = {}
+        self.clients = weakref.WeakKeyDictionary()
+        self.builds = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def _credentials(self, credentials_value):
+        """
+        (credentials, project_id) for a GOOGLE_APPLICATION_CREDENTIALS value, or (None, None).
+        """
+        key = _fingerprint(credentials_value)
+        with self._lock:
+            if key in self.credentials:
+                return self.credentials[key]
+
+        info = load_credentials_info(credentials_value)
+        project_id = info.get("project_id") if info else None
+        if not project_id:
+            logger.error("project_id not found in credentials.json")
+            return None, None
+        try:
+            credentials = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+        except Exception as e:
+            logger.error(f"Failed to load credentials: {e}")
+            return None, None
+
+        with self._lock:
+            return self.credentials.setdefault(key, (credentials, project_id))
+
+    def _needs_refresh(self, credentials):
+        if credentials is None:
+            return False
+        if not credentials.token or credentials.expiry is None:
+            return True
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (credentials.expiry - now).total_seconds() < self.refresh_margin
+
+    async def get(self, api_key=None, credentials_value=None, location="us-central1"):
+        """
+        Returns the client for this configuration on the running loop, or None.
+        The service account token is refreshed first if it is missing or close to expiry.
+        """
+        credentials, project_id = (None, None) if api_key else self._credentials(credentials_value)
+        if not api_key and credentials is None:
+            return None
+
+        if self._needs_refresh(credentials):
+            try:
+                await asyncio.to_thread(credentials.refresh, Request())
+                self.refreshes += 1
+                logger.info(f"Refreshed Vertex AI access token (expires {credentials.expiry})")
+            except Exception as e:
+                # The client retries the refresh itself on the next request
+                logger.warning(f"Proactive token refresh failed: {e}")
+
+        key = (_fingerprint(api_key), _fingerprint(credentials_value), location)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self.clients.setdefault(loop, {})
+            client = clients.get(key)
+        if client is not None:
+            return client
+
+        if api_key:
+            client = genai.Client(api_key=api_key)
+        else:
+            logger.info(f"Using Vertex AI with project: {project_id} and location: {location}")
+            client = genai.Client(vertexai=True, project=project_id, location=location, credentials=credentials)
+        self.builds += 1
+        with self._lock:
+            clients[key] = client
+        return client
+
+    def stats(self):
+        return {"credentials": len(self.credentials), "builds": self.builds, "refreshes": self.refreshes}
@@ -1,14 +1,17 @@
 import streamlit as st
 import asyncio
+import atexit
 import logging
 import io
 import os
+import queue
+import threading
 from dotenv import load_dotenv
 
 # Load env vars
 load_dotenv()
 
-from agent import run_agent_async
+from agent import stream_agent_async, refresh_tool_catalog, get_schema_cache_stats, get_tool_result_cache_stats, get_subnet_index_stats, get_context_cache_stats
 from PIL import Image
 
 # Configure Logging to capture in UI
@@ -24,6 +27,30 @@ class StreamlitLogHandler(logging.Handler):
     def get_logs(self):
         return self.log_buffer.getvalue()
 
+@st.cache_resource
+def agent_loop():
+    """
+    One event loop for every session and prompt, run on a daemon thread, so
+    GenAI clients and their connection pools are built once and reused.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="agent-loop", daemon=True)
+    thread.start()
+
+    def shutdown():
+        # Same teardown as asyncio.run: finalize async generators and the to_thread executor
+        try:
+            asyncio.run_coroutine_threadsafe(loop.shutdown_asyncgens(), loop).result(timeout=10)
+            asyncio.run_coroutine_threadsafe(loop.shutdown_default_executor(), loop).result(timeout=10)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Agent loop shutdown incomplete: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+
+    atexit.register(shutdown)
+    return loop
+
 # Get the icon path
 icon_path = os.path.join(os.path.dirname(__file__), "..", "icon.png")
 if os.path.exists(icon_path):
@@ -423,6 +450,16 @@ with st.sidebar:
         with col2:
             st.markdown("**MCP Server**")
 
+    schema_stats = get_schema_cache_stats()
+    st.caption(f"Schema cache: {schema_stats['hits']} hits / {schema_stats['misses']} misses ({schema_stats['entries']} tools)")
+    result_stats = get_tool_result_cache_stats()
+    st.caption(f"Tool result cache: {result_stats['hit_rate']:.0%} hit rate ({result_stats['hits']} hits / {result_stats['misses']} misses)")
+    context_stats = get_context_cache_stats()
+    st.caption(f"Context cache: {context_stats['hits']} hits / {context_stats['creates']} created")
+    subnet_stats = get_subnet_index_stats()
+    if subnet_stats["age"] is not None:
+        st.caption(f"Subnet index: {subnet_stats['networks']} networks, refreshed {subnet_stats['age'] / 60:.0f} min ago")
+
     st.markdown("---")
 
     # Actions Section
@@ -432,6 +469,10 @@ with st.sidebar:
         st.session_state.messages = []
         st.rerun()
 
+    if st.button("🔄 Refresh MCP Tools", use_container_width=True):
+        refresh_tool_catalog()
+        st.toast("MCP tool list will be reloaded on the next prompt.")
+
 
 # Initialization
 if "messages" not in st.session_state:
@@ -501,36 +542,60 @@ if prompt := st.chat_input("Type your security query here..."):
 
     # Generate response
     with st.chat_message("assistant"):
-        # Create a status container for the reasoning process
-        with st.status("🧠 ESET Thinking", expanded=True) as status:
-            
-            def status_callback(step, details, state="info"):
-                # Update the status container
-                if state == "running":
-                    status.write(f"🔄 **{step}**: {details}")
-                elif state == "success":
-                    status.write(f"✅ **{step}**: {details}")
-                elif state == "error":
-                    status.update(label=f"❌ Error in {step}", state="error")
-                    status.error(f"**{step}**: {details}")
-                else:
-                    status.write(f"ℹ️ **{step}**: {details}")
-
+        # Create a status container for the reasoning process;
+        # the answer streams in below it
+        status = st.status("🧠 ESET Thinking", expanded=True)
+
+        def status_callback(step, details, state="info"):
+            # Update the status container
+            if state == "running":
+                status.write(f"🔄 **{step}**: {details}")
+            elif state == "success":
+                status.write(f"✅ **{step}**: {details}")
+            elif state == "error":
+                status.update(label=f"❌ Error in {step}", state="error")
+                status.error(f"**{step}**: {details}")
+            else:
+                status.write(f"ℹ️ **{step}**: {details}")
+
+        def stream_response():
+            # The agent runs on the shared loop; status updates and text come back
+            # through a queue so Streamlit is only called from this script thread
+            updates = queue.Queue()
+
+            async def pump():
+                events = stream_agent_async(prompt, status_callback=lambda *args: updates.put(("status", args)))
+                try:
+                    async for event in events:
+                        updates.put(("event", event))
+                finally:
+                    await events.aclose()
+
+            run = asyncio.run_coroutine_threadsafe(pump(), agent_loop())
+            run.add_done_callback(lambda _: updates.put(("done", None)))
             try:
-                # Helper to run async in Streamlit safe manner
-                async def run_wrapper():
-                    return await run_agent_async(prompt, status_callback=status_callback)
-
-                # Run async agent with callback
-                response_text = asyncio.run(run_wrapper())
-                
-                status.update(label="✅ Response Generated", state="complete", expanded=False)
-                
-                st.markdown(response_text)
-                st.session_state.messages.append({"role": "assistant", "content": response_text})
-            except Exception as e:
-                status.update(label="❌ Agent Failed", state="error")
-                st.error(f"Error: {e}")
+                while True:
+                    kind, update = updates.get()
+                    if kind == "done":
+                        run.result()
+                        break
+                    if kind == "status":
+                        status_callback(*update)
+                    elif update["type"] == "text":
+                        yield update["text"]
+            finally:
+                # Stops the run if the page is left mid-answer
+                run.cancel()
+
+        try:
+            response_text = st.write_stream(stream_response())
+
+            status.update(label="✅ Response Generated", state="complete", expanded=False)
+
+            st.session_state.messages.append({"role": "assistant", "content": response_text})
+        except Exception as e:
+            status.update(label="❌ Agent Failed", state="error")
+            st.error(f"Error: {e}")
 
 # Debug Logs Section
 st.markdown("---")
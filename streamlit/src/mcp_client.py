@@ -14,7 +14,7 @@ def unverified_client_factory(**kwargs):
     return httpx.AsyncClient(**kwargs)
 
 class CortexMCPClient:
-    def __init__(self):
+    def __init__(self, message_handler=None):
         # Use MCP_URL or fallback to default
         # Default: https://mcp-xsiam:9010/api/v1/stream/mcp
         default_url = "https://mcp-xsiam:9010/api/v1/stream/mcp"
@@ -35,7 +35,7 @@ class CortexMCPClient:
         )
 
         # Initialize Client with custom transport and auth
-        self.client = Client(transport, auth=self.api_key)
+        self.client = Client(transport, auth=self.api_key, message_handler=message_handler)
 
     async def __aenter__(self):
         await self.client.__aenter__()
@@ -0,0 +1,200 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import time
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+LOCAL_SUBNET_TOOL = "lookup_ip_subnet"
+
+# Column names tried, in order, when the subnet field is not configured
+SUBNET_FIELDS = ("subnet", "cidr", "network", "ip_range", "range", "prefix")
+
+SUBNET_TOOL_DECLARATION = types.FunctionDeclaration(
+    name=LOCAL_SUBNET_TOOL,
+    description=(
+        "Instantly map IP addresses to their entry in the agentic_subnet_lookup dataset "
+        "(training room, purpose, location) using a local snapshot and longest-prefix match. "
+        "Use this before querying the dataset. For IPs returned as unmatched, fall back to "
+        "querying the agentic_subnet_lookup dataset through the MCP tools."
+    ),
+    parameters={
+        "type": "object",
+        "properties": {
+            "ips": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "IPv4 or IPv6 addresses to look up."
+            }
+        },
+        "required": ["ips"]
+    }
+)
+
+
+def _find_rows(obj):
+    """
+    First list of dict rows found in a (possibly nested) tool response.
+    """
+    if isinstance(obj, list):
+        if obj and all(isinstance(r, dict) for r in obj):
+            return obj
+        for item in obj:
+            rows = _find_rows(item)
+            if rows:
+                return rows
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            rows = _find_rows(value)
+            if rows:
+                return rows
+    return []
+
+
+def parse_rows(result):
+    """
+    Extracts dataset rows from an MCP CallToolResult.
+    """
+    structured = getattr(result, "structured_content", None)
+    if structured:
+        rows = _find_rows(structured)
+        if rows:
+            return rows
+
+    for item in getattr(result, "content", None) or []:
+        text = getattr(item, "text", None)
+        if not text:
+            continue
+        try:
+            rows = _find_rows(json.loads(text))
+        except ValueError:
+            continue
+        if rows:
+            return rows
+    return []
+
+
+def _row_network(row, field=None):
+    if field:
+        candidates = [row.get(field)]
+    else:
+        # Known column names first, then any value written in CIDR notation
+        candidates = [row.get(f) for f in SUBNET_FIELDS]
+        candidates += [v for v in row.values() if isinstance(v, str) and "/" in v]
+    for value in candidates:
+        if not isinstance(value, str) or not value.strip():
+            continue
+        try:
+            return ipaddress.ip_network(value.strip(), strict=False)
+        except ValueError:
+            continue
+    return None
+
+
+class SubnetIndex:
+    """
+    In-memory longest-prefix-match index over a snapshot of the
+    agentic_subnet_lookup dataset.
+
+    Networks are bucketed by prefix length; a lookup masks the address
+    once per known prefix length, longest first, so it costs a handful of
+    dict probes. The snapshot is reloaded through an MCP tool call after
+    `ttl` seconds; a failed reload keeps serving the previous snapshot.
+    """
+    def __init__(self, tool_name, tool_args=None, ttl=900, field=None, retry_interval=60):
+        self.tool_name = tool_name
+        self.tool_args = tool_args or {}
+        self.ttl = ttl
+        self.field = field
+        self.retry_interval = retry_interval
+        self.buckets = {4: {}, 6: {}}
+        self.prefix_lengths = {4: [], 6: []}
+        self.size = 0
+        self.loaded_at = 0.0
+        self.attempted_at = 0.0
+
+    @property
+    def loaded(self):
+        return self.size > 0
+
+    def load(self, rows):
+        buckets = {4: {}, 6: {}}
+        skipped = 0
+        for row in rows:
+            network = _row_network(row, self.field)
+            if network is None:
+                skipped += 1
+                continue
+            key = int(network.network_address)
+            buckets[network.version].setdefault(network.prefixlen, {})[key] = (str(network), row)
+
+        self.buckets = buckets
+        self.prefix_lengths = {v: sorted(b, reverse=True) for v, b in buckets.items()}
+        self.size = sum(len(n) for b in buckets.values() for n in b.values())
+        self.loaded_at = time.monotonic()
+        logger.info(f"Subnet index loaded {self.size} networks ({skipped} rows without a subnet)")
+
+    def lookup(self, ip):
+        """
+        Returns (cidr, row) of the most specific network containing `ip`, or None.
+        """
+        address = ipaddress.ip_address(ip.strip())
+        value = int(address)
+        bits = address.max_prefixlen
+        bucket = self.buckets[address.version]
+        for prefixlen in self.prefix_lengths[address.version]:
+            shift = bits - prefixlen
+            match = bucket[prefixlen].get(value >> shift << shift)
+            if match:
+                return match
+        return None
+
+    def lookup_many(self, ips):
+        matches, unmatched, invalid = {}, [], []
+        for ip in ips or []:
+            try:
+                match = self.lookup(str(ip))
+            except ValueError:
+                invalid.append(ip)
+                continue
+            if match:
+                matches[ip] = {"subnet": match[0], **match[1]}
+            else:
+                unmatched.append(ip)
+
+        response = {"matches": matches}
+        if unmatched:
+            response["unmatched"] = unmatched
+            response["note"] = "No local match; query the agentic_subnet_lookup dataset via MCP for these IPs."
+        if invalid:
+            response["invalid"] = invalid
+        return response
+
+    def is_fresh(self):
+        return self.loaded and time.monotonic() - self.loaded_at < self.ttl
+
+    async def ensure_fresh(self, mcp_client, available_tools, timeout=30):
+        """
+        Reloads the snapshot when it is stale and the snapshot tool is advertised.
+        Returns True when the index can answer lookups.
+        """
+        if self.is_fresh():
+            return True
+        if self.tool_name not in available_tools:
+            return self.loaded
+        if time.monotonic() - self.attempted_at < self.retry_interval:
+            return self.loaded
+
+        self.attempted_at = time.monotonic()
+        try:
+            result = await asyncio.wait_for(mcp_client.call_tool(self.tool_name, self.tool_args), timeout)
+            rows = parse_rows(result)
+            if rows:
+                self.load(rows)
+            else:
+                logger.warning(f"Subnet snapshot via {self.tool_name} returned no rows")
+        except Exception as e:
+            logger.warning(f"Subnet snapshot via {self.tool_name} failed: {e}")
+        return self.loaded
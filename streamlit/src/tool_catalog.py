@@ -0,0 +1,216 @@
+import copy
+import hashlib
+import json
+import logging
+import time
+from google.genai import types
+from fastmcp.client.messages import MessageHandler
+
+logger = logging.getLogger(__name__)
+
+def sanitize_schema(s, defs=None, depth=0, processing=None):
+    """
+    Make an MCP input schema acceptable to Gemini.
+    Gemini SDK (Pydantic models) often rejects $defs/definitions and $ref,
+    so we perform simple dereferencing or stripping.
+    """
+    if not isinstance(s, dict):
+        return s
+
+    if depth > 10:
+        return {"type": "object", "description": "Complex/Deeply nested object"}
+
+    processing = processing or set()
+
+    # Store definitions found at this level
+    current_defs = defs or {}
+    if "$defs" in s:
+        current_defs.update(s.pop("$defs"))
+    if "definitions" in s:
+        current_defs.update(s.pop("definitions"))
+
+    # Handle $ref
+    if "$ref" in s:
+        ref = s.pop("$ref")
+        ref_name = ref.split("/")[-1]
+
+        if ref_name in processing:
+            return {"type": "object", "description": f"Recursive reference to {ref_name}"}
+
+        if ref_name in current_defs:
+            processing.add(ref_name)
+            try:
+                resolved = sanitize_schema(
+                    current_defs[ref_name].copy(),
+                    current_defs,
+                    depth + 1,
+                    processing.copy()
+                )
+                s.update(resolved)
+            finally:
+                processing.discard(ref_name)
+        else:
+             s["type"] = "string"
+             s["description"] = f"Reference to {ref_name}"
+
+    # SIMPLIFICATION FOR GEMINI: oneOf/anyOf/allOf
+    # Gemini often rejects these. We replace them with a generic object type.
+    complex_keys = ["oneOf", "anyOf", "allOf"]
+    found_complex = False
+    for key in complex_keys:
+        if key in s:
+            found_complex = True
+            # Remove the complex key
+            del s[key]
+
+    if found_complex:
+        # Fallback to loose object
+        s["type"] = "object"
+        s["description"] = s.get("description", "Complex variant type") + " (Validation simplified)"
+        return s
+
+    # Recursively sanitize properties
+    if "properties" in s:
+        for k, v in s["properties"].items():
+            s["properties"][k] = sanitize_schema(v, current_defs, depth + 1, processing)
+
+    if "items" in s:
+        # For array items, if it's complex, it will be handled by the recursive call
+        s["items"] = sanitize_schema(s["items"], current_defs, depth + 1, processing)
+
+    return s
+
+
+def schema_hash(tool_name, description, schema):
+    """
+    Stable content hash of a tool's declaration inputs.
+    """
+    payload = json.dumps([tool_name, description, schema], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DeclarationCache:
+    """
+    Memoizes compiled FunctionDeclarations keyed by schema content hash,
+    so only tools whose schema changed are sanitized again.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, tool):
+        # Defensive check for inputSchema vs parameters
+        schema = getattr(tool, "parameters", getattr(tool, "inputSchema", {})) or {}
+        key = schema_hash(tool.name, tool.description, schema)
+
+        declaration = self.entries.get(key)
+        if declaration is not None:
+            self.hits += 1
+            return key, declaration
+
+        self.misses += 1
+        # Sanitize a deep copy; the resolver mutates nested dicts in place
+        declaration = types.FunctionDeclaration(
+            name=tool.name,
+            description=tool.description,
+            parameters=sanitize_schema(copy.deepcopy(schema))
+        )
+        self.entries[key] = declaration
+        return key, declaration
+
+    def retain(self, keys):
+        """
+        Drops entries for tools the server no longer advertises.
+        """
+        keys = set(keys)
+        self.entries = {k: v for k, v in self.entries.items() if k in keys}
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class ToolListChangedHandler(MessageHandler):
+    """
+    MCP message handler that invalidates a ToolCatalog on tools/list_changed.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    async def on_tool_list_changed(self, message):
+        logger.info("MCP server reported tools/list_changed; invalidating tool catalog")
+        self.catalog.invalidate()
+
+
+class ToolCatalog:
+    """
+    Cache of the Gemini tool list built from an MCP server's tools.
+    Entries are rebuilt after `ttl` seconds, when the server sends a
+    tools/list_changed notification, or when invalidate() is called.
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.tools = None
+        self.tool_names = []
+        self.read_only_hints = {}
+        self.source_url = None
+        self.loaded_at = 0.0
+        self.declarations = DeclarationCache()
+        self.message_handler = ToolListChangedHandler(self)
+
+    def invalidate(self):
+        self.loaded_at = 0.0
+
+    def read_only_hint(self, tool_name):
+        """
+        The server's readOnlyHint annotation for a tool, or None if it has none.
+        """
+        return self.read_only_hints.get(tool_name)
+
+    def is_fresh(self, source_url=None):
+        if self.tools is None or self.loaded_at == 0.0:
+            return False
+        if source_url and source_url != self.source_url:
+            return False
+        return time.monotonic() - self.loaded_at < self.ttl
+
+    async def get_tools(self, mcp_client, refresh=False):
+        """
+        Returns the cached [types.Tool] list, reloading it from `mcp_client` when stale.
+        """
+        source_url = getattr(mcp_client, "base_url", None)
+        if not refresh and self.is_fresh(source_url):
+            logger.info(f"Using cached MCP tool catalog ({len(self.tool_names)} tools)")
+            return self.tools
+
+        tools_response = await mcp_client.list_tools()
+
+        # fastmcp returns a list of Tool objects directly
+        if isinstance(tools_response, list):
+            tools_list = tools_response
+        else:
+            tools_list = tools_response.tools
+
+        # Create a tool definition for Gemini, reusing compiled schemas that did not change
+        hits, misses = self.declarations.hits, self.declarations.misses
+        gemini_funcs = []
+        live_keys = []
+        for t in tools_list:
+            key, declaration = self.declarations.compile(t)
+            live_keys.append(key)
+            gemini_funcs.append(declaration)
+            logger.info(f"Registered MCP tool: {t.name}")
+        self.declarations.retain(live_keys)
+        logger.info(
+            f"Schema cache: {self.declarations.hits - hits} hits, {self.declarations.misses - misses} misses "
+            f"(totals: {self.declarations.stats()})"
+        )
+
+        self.tools = [types.Tool(function_declarations=gemini_funcs)]
+        self.tool_names = [f.name for f in gemini_funcs]
+        self.read_only_hints = {
+            t.name: getattr(getattr(t, "annotations", None), "readOnlyHint", None) for t in tools_list
+        }
+        self.source_url = source_url
+        self.loaded_at = time.monotonic()
+        return self.tools
@@ -0,0 +1,97 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Tools of the XSIAM MCP server known to be read-only, for servers that do not send
+# readOnlyHint. Any other unannotated tool is not cached unless its policy says "cacheable": true.
+READ_ONLY_TOOLS = {"run_xql_query", "get_cases"}
+
+def canonical_arguments(arguments):
+    """
+    Deterministic string form of tool arguments, independent of key order.
+    """
+    return json.dumps(arguments or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ToolResultCache:
+    """
+    LRU + TTL cache of successful MCP tool results.
+
+    Policies are per tool: {"cacheable": bool, "ttl": seconds, "max_bytes": int}.
+    The "*" policy sets the defaults. Tools without an explicit "cacheable"
+    follow the server's readOnlyHint annotation, and unannotated tools are
+    cached only if they are in READ_ONLY_TOOLS. A tool's name alone never
+    makes it cacheable.
+    """
+    def __init__(self, max_entries=256, policies=None):
+        self.max_entries = max_entries
+        self.policies = policies or {}
+        self.defaults = {"ttl": 300, "max_bytes": 256 * 1024}
+        self.defaults.update(self.policies.get("*", {}))
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+    def policy(self, tool_name, read_only_hint=None):
+        policy = dict(self.defaults)
+        policy.update(self.policies.get(tool_name, {}))
+        if "cacheable" not in policy:
+            policy["cacheable"] = read_only_hint if read_only_hint is not None else tool_name in READ_ONLY_TOOLS
+        return policy
+
+    def get(self, tool_name, arguments, read_only_hint=None):
+        """
+        Returns a cached result, or None on a miss or for non-cacheable tools.
+        """
+        if not self.policy(tool_name, read_only_hint)["cacheable"]:
+            with self._lock:
+                self.bypassed += 1
+            return None
+
+        key = (tool_name, canonical_arguments(arguments))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, tool_name, arguments, result, read_only_hint=None):
+        policy = self.policy(tool_name, read_only_hint)
+        if not policy["cacheable"]:
+            return
+        size = len(str(result.content))
+        if size > policy["max_bytes"]:
+            logger.info(f"Not caching {tool_name} result ({size} bytes > {policy['max_bytes']})")
+            return
+
+        key = (tool_name, canonical_arguments(arguments))
+        with self._lock:
+            self.entries[key] = (time.monotonic() + policy["ttl"], result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "entries": len(self.entries),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
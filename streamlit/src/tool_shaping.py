@@ -0,0 +1,174 @@
+import copy
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio for JSON-heavy tool output
+CHARS_PER_TOKEN = 4
+EMPTY_VALUES = (None, "", [], {})
+
+
+def estimate_tokens(obj):
+    """
+    Cheap token estimate of a JSON-serializable value.
+    """
+    text = obj if isinstance(obj, str) else json.dumps(obj, default=str, separators=(",", ":"))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def content_payload(content):
+    """
+    Plain JSON form of an MCP result's content blocks.
+    Text blocks holding JSON are decoded so rows can be trimmed individually.
+    """
+    values = []
+    for item in content or []:
+        text = getattr(item, "text", None)
+        if text is not None:
+            try:
+                values.append(json.loads(text))
+            except ValueError:
+                values.append(text)
+        elif hasattr(item, "model_dump"):
+            values.append(item.model_dump(mode="json"))
+        else:
+            values.append(str(item))
+    return values[0] if len(values) == 1 else values
+
+
+def allocate_budgets(estimates, per_result, per_turn):
+    """
+    Splits the per-turn budget across results by water-filling: small
+    results keep what they need, the rest share what is left evenly.
+    Independent of completion order, so shaping is deterministic.
+    """
+    caps = [min(e, per_result) for e in estimates]
+    if sum(caps) <= per_turn:
+        return [per_result] * len(caps)
+
+    budgets = [0] * len(caps)
+    remaining = per_turn
+    order = sorted(range(len(caps)), key=lambda i: (caps[i], i))
+    for position, i in enumerate(order):
+        share = remaining // (len(order) - position)
+        budgets[i] = min(caps[i], share)
+        remaining -= budgets[i]
+    return budgets
+
+
+def _row_lists(obj, path="$"):
+    """
+    Yields (path, rows) for every list of dict rows in obj.
+    """
+    if isinstance(obj, list):
+        if len(obj) > 1 and all(isinstance(r, dict) for r in obj):
+            yield path, obj
+            return
+        for i, item in enumerate(obj):
+            yield from _row_lists(item, f"{path}[{i}]")
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _row_lists(value, f"{path}.{key}")
+
+
+def _drop_empty_columns(obj):
+    dropped = set()
+    for _, rows in _row_lists(obj):
+        columns = {k for row in rows for k in row}
+        empty = {k for k in columns if all(row.get(k) in EMPTY_VALUES for row in rows)}
+        for row in rows:
+            for k in empty:
+                row.pop(k, None)
+        dropped |= empty
+    return sorted(dropped)
+
+
+def _truncate_strings(obj, max_chars):
+    """
+    Shortens long strings in place; returns how many were cut.
+    """
+    count = 0
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else []
+    for key, value in list(items):
+        if isinstance(value, str) and len(value) > max_chars:
+            obj[key] = value[:max_chars] + f"...[+{len(value) - max_chars} chars]"
+            count += 1
+        elif isinstance(value, (dict, list)):
+            count += _truncate_strings(value, max_chars)
+    return count
+
+
+def shape_result(payload, budget, max_string_chars=1000):
+    """
+    Fits a tool result into `budget` estimated tokens.
+
+    Steps, applied only while the result is over budget: drop columns that
+    are empty in every row, truncate long strings, keep the leading rows of
+    the largest row lists, and finally cut the serialized JSON. Returns
+    (payload, omitted), where omitted describes what was removed or None.
+    """
+    original = estimate_tokens(payload)
+    if original <= budget:
+        return payload, None
+
+    shaped = copy.deepcopy(payload)
+    omitted = {"original_tokens": original, "budget_tokens": budget}
+
+    dropped = _drop_empty_columns(shaped)
+    if dropped:
+        omitted["empty_fields_dropped"] = dropped
+
+    if estimate_tokens(shaped) > budget:
+        truncated = _truncate_strings(shaped, max_string_chars) if isinstance(shaped, (dict, list)) else 0
+        if truncated:
+            omitted["strings_truncated"] = truncated
+
+    rows_omitted = []
+    for path, rows in sorted(_row_lists(shaped), key=lambda pr: -len(pr[1])):
+        if estimate_tokens(shaped) <= budget:
+            break
+        total = len(rows)
+        full = rows[:]
+        # Largest leading slice that fits, found by bisection
+        low, high = 1, total - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            rows[:] = full[:middle]
+            if estimate_tokens(shaped) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        rows[:] = full[:low]
+        rows_omitted.append({"path": path, "total": total, "kept": low})
+    if rows_omitted:
+        omitted["rows_omitted"] = rows_omitted
+
+    if estimate_tokens(shaped) > budget:
+        text = shaped if isinstance(shaped, str) else json.dumps(shaped, default=str, separators=(",", ":"))
+        keep = max(0, budget * CHARS_PER_TOKEN - 64)
+        shaped = text[:keep]
+        omitted["chars_truncated"] = len(text) - keep
+
+    omitted["note"] = (
+        "Result trimmed to fit the token budget. Omitted rows/fields are listed here; "
+        "narrow the query (filters, fields, limit) to see them."
+    )
+    logger.info(f"Shaped tool result from ~{original} to ~{estimate_tokens(shaped)} tokens")
+    return shaped, omitted
+
+
+def shape_responses(responses, per_result, per_turn):
+    """
+    Applies shape_result to a turn's {"result": ...} responses under the
+    per-result and per-turn budgets. Error responses pass through unchanged.
+    """
+    indexes = [i for i, r in enumerate(responses) if "result" in r]
+    payloads = [responses[i]["result"] for i in indexes]
+    budgets = allocate_budgets([estimate_tokens(p) for p in payloads], per_result, per_turn)
+
+    shaped = list(responses)
+    for i, payload, budget in zip(indexes, payloads, budgets):
+        result, omitted = shape_result(payload, budget)
+        shaped[i] = {"result": result, "omitted": omitted} if omitted else {"result": result}
+    return shaped
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app runs with src/ on PYTHONPATH (see Dockerfile)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
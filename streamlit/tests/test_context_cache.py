@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import time
+
+from google.genai import types
+
+from context_cache import ContextCache
+
+
+class FakeCaches:
+    def __init__(self, error=None):
+        self.error = error
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    @staticmethod
+    def handle(name, ttl=3600):
+        expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+        return types.CachedContent(name=name, expire_time=expire_time)
+
+    async def create(self, model, config):
+        if self.error:
+            raise self.error
+        self.created.append(config)
+        return self.handle(f"cachedContents/{len(self.created)}")
+
+    async def update(self, name, config):
+        self.updated.append(name)
+        return self.handle(name)
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeCacheClient:
+    def __init__(self, **kwargs):
+        self.caches = FakeCaches(**kwargs)
+        self.aio = self
+
+
+def catalog(*names):
+    return [types.Tool(function_declarations=[
+        types.FunctionDeclaration(name=name, description=f"{name} tool") for name in names
+    ])]
+
+
+def test_context_cache_created_and_reused():
+    """The first request creates the cache; later ones within the TTL reuse it."""
+    client = FakeCacheClient()
+    cache = ContextCache(ttl=3600)
+
+    first = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    second = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+
+    assert first == second == "cachedContents/1"
+    assert len(client.caches.created) == 1
+    assert client.caches.created[0].ttl == "3600s"
+    assert cache.stats()["hits"] == 1
+
+
+def test_context_cache_refreshed_near_expiry():
+    """A handle about to expire is extended in place instead of recreated."""
+    client = FakeCacheClient()
+    cache = ContextCache(ttl=3600, refresh_margin=300)
+    asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    entry = next(iter(cache.entries.values()))
+    entry["expires_at"] = time.time() + 60
+
+    name = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+
+    assert name == "cachedContents/1"
+    assert client.caches.updated == ["cachedContents/1"]
+    assert len(client.caches.created) == 1
+    assert entry["expires_at"] > time.time() + 300
+
+
+def test_context_cache_recreated_after_expiry():
+    """An expired handle is replaced by a new one."""
+    client = FakeCacheClient()
+    cache = ContextCache()
+    asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    next(iter(cache.entries.values()))["expires_at"] = time.time() - 1
+
+    name = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+
+    assert name == "cachedContents/2"
+    assert client.caches.updated == []
+
+
+def test_context_cache_replaced_when_catalog_changes():
+    """A new tool catalog gets its own cache and the old one is deleted."""
+    client = FakeCacheClient()
+    cache = ContextCache()
+
+    asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    name = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases", "run_xql_query")))
+
+    assert name == "cachedContents/2"
+    assert client.caches.deleted == ["cachedContents/1"]
+    assert cache.stats()["entries"] == 1
+
+
+def test_context_cache_unavailable_falls_back_inline():
+    """When caching fails the prefix is sent inline and creation is not retried right away."""
+    client = FakeCacheClient(error=RuntimeError("model does not support caching"))
+    cache = ContextCache(retry_interval=600)
+
+    assert asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases"))) is None
+    client.caches.error = None
+    assert asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases"))) is None
+    assert client.caches.created == []
+    assert cache.stats()["failures"] == 1
+
+
+def test_context_cache_disabled():
+    client = FakeCacheClient()
+    cache = ContextCache(enabled=False)
+
+    assert asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases"))) is None
+    assert client.caches.created == []
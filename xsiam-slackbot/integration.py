@@ -8,17 +8,32 @@ import requests
 import time
 import random
 import logging
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from slack_sdk import WebClient
-from slack_sdk.webhook import WebhookClient
+import threading
+import contextlib
+import functools
+import concurrent.futures
+from collections import OrderedDict, namedtuple
+import copy
+import hashlib
+import datetime
+import ipaddress
+import sqlite3
+import tempfile
+import uuid
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt.response import BoltResponse
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.webhook.async_client import AsyncWebhookClient
 from slack_sdk.errors import SlackApiError
 from google import genai
 from google.genai import types
 from google.oauth2 import service_account
+from google.auth.transport.requests import Request as GoogleAuthRequest
 import httpx
 from fastmcp import Client
 from fastmcp.client.transports import StreamableHttpTransport
+from fastmcp.client.messages import MessageHandler
 
 # --- Agent / MCP Integration ---
 
@@ -28,7 +43,7 @@ def unverified_client_factory(**kwargs):
     return httpx.AsyncClient(**kwargs)
 
 class CortexMCPClient:
-    def __init__(self, uri, key):
+    def __init__(self, uri, key, message_handler=None):
         self.base_url = uri
         self.api_key = key
         self.client = None
@@ -40,16 +55,24 @@ class CortexMCPClient:
         )
 
         # Initialize Client with custom transport and auth
-        self.client = Client(transport, auth=self.api_key)
+        self.client = Client(transport, auth=self.api_key, message_handler=message_handler)
+        self.last_checked = 0.0
 
     async def __aenter__(self):
         await self.client.__aenter__()
+        self.last_checked = time.monotonic()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.client:
             await self.client.__aexit__(exc_type, exc_val, exc_tb)
 
+    def is_connected(self):
+        return self.client.is_connected()
+
+    async def ping(self):
+        return await self.client.ping()
+
     async def list_tools(self):
         return await self.client.list_tools()
 
@@ -57,6 +80,99 @@ class CortexMCPClient:
         return await self.client.call_tool(name, arguments)
 
 
+class MCPSessionPool:
+    """
+    Process-wide pool of warm MCP sessions.
+
+    Sessions are bound to the event loop that opened them; the pool is only
+    used from the Slack app loop, where agent runs borrow sessions directly.
+    Idle sessions are pinged before reuse and replaced when they are dead.
+    """
+
+    def __init__(self, uri, key, size=4, health_interval=60, ping_timeout=5, message_handler=None):
+        self.uri = uri
+        self.key = key
+        self.message_handler = message_handler
+        self.size = max(1, int(size))
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self._open = 0
+        self._idle = None
+
+    async def _connect(self):
+        session = CortexMCPClient(self.uri, self.key, message_handler=self.message_handler)
+        await session.__aenter__()
+        demisto.debug(f"Opened MCP session ({self._open}/{self.size})")
+        return session
+
+    async def _discard(self, session):
+        self._open -= 1
+        try:
+            await session.__aexit__(None, None, None)
+        except Exception as e:
+            demisto.debug(f"Error closing MCP session: {e}")
+
+    async def _is_healthy(self, session):
+        if not session.is_connected():
+            return False
+        if time.monotonic() - session.last_checked < self.health_interval:
+            return True
+        try:
+            await asyncio.wait_for(session.ping(), timeout=self.ping_timeout)
+        except Exception as e:
+            demisto.info(f"MCP session health check failed: {e}")
+            return False
+        session.last_checked = time.monotonic()
+        return True
+
+    async def _acquire(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        while True:
+            if self._idle.empty() and self._open < self.size:
+                self._open += 1
+                try:
+                    return await self._connect()
+                except Exception:
+                    self._open -= 1
+                    raise
+            session = await self._idle.get()
+            if await self._is_healthy(session):
+                return session
+            # Dead session: drop it and let the next iteration reconnect
+            await self._discard(session)
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """
+        Borrows a healthy session for the duration of the block.
+        """
+        session = await self._acquire()
+        try:
+            yield session
+        finally:
+            if session.is_connected():
+                self._idle.put_nowait(session)
+            else:
+                await self._discard(session)
+
+
+MCP_POOL = None
+MCP_POOL_LOCK = threading.Lock()
+
+
+def get_mcp_pool(uri, key):
+    """
+    Returns the shared MCP session pool, creating it on first use.
+    """
+    global MCP_POOL
+    with MCP_POOL_LOCK:
+        if MCP_POOL is None:
+            MCP_POOL = MCPSessionPool(uri, key, size=MCP_POOL_SIZE,
+                                      message_handler=TOOL_CATALOG.message_handler)
+        return MCP_POOL
+
+
 
 # Custom logging filter
 class CustomFilter(logging.Filter):
@@ -82,6 +198,40 @@ APP_TOKEN = demisto.params().get('slack_app_token', {}).get('password', '')
 PLATFORM_URL = demisto.params().get('platform_url')
 API_KEY = demisto.params().get('api_key', {}).get('password', '')
 API_KEY_ID = demisto.params().get('api_key_id', {}).get('password', '')
+MCP_POOL_SIZE = int(demisto.params().get('mcp_pool_size') or 4)
+TOOL_CACHE_TTL = int(demisto.params().get('tool_cache_ttl') or 300)
+TOOL_CONCURRENCY = int(demisto.params().get('tool_concurrency') or 4)
+TOOL_TIMEOUT = float(demisto.params().get('tool_timeout') or 120)
+PROGRESS_UPDATE_INTERVAL = float(demisto.params().get('progress_update_interval') or 1.5)
+TOOL_RESULT_CACHE_SIZE = int(demisto.params().get('tool_result_cache_size') or 256)
+TOOL_RESULT_CACHE_POLICY = demisto.params().get('tool_result_cache_policy') or '{}'
+RESULT_TOKEN_BUDGET = int(demisto.params().get('result_token_budget') or 8000)
+TURN_TOKEN_BUDGET = int(demisto.params().get('turn_token_budget') or 24000)
+XSIAM_POOL_SIZE = int(demisto.params().get('xsiam_pool_size') or 10)
+XSIAM_MAX_RETRIES = int(demisto.params().get('xsiam_max_retries') or 3)
+XSIAM_CONNECT_TIMEOUT = float(demisto.params().get('xsiam_connect_timeout') or 5)
+XSIAM_READ_TIMEOUT = float(demisto.params().get('xsiam_read_timeout') or 30)
+USER_CACHE_TTL = int(demisto.params().get('user_cache_ttl') or 21600)
+THREAD_SESSION_MAX = int(demisto.params().get('thread_session_max') or 200)
+THREAD_SESSION_TTL = int(demisto.params().get('thread_session_ttl') or 3600)
+THREAD_SESSION_MAX_MB = float(demisto.params().get('thread_session_max_mb') or 64)
+HISTORY_KEEP_TURNS = int(demisto.params().get('history_keep_turns') or 10)
+HISTORY_TOKEN_BUDGET = int(demisto.params().get('history_token_budget') or 6000)
+EVENT_DEDUP_TTL = int(demisto.params().get('event_dedup_ttl') or 3600)
+EVENT_DEDUP_SIZE = int(demisto.params().get('event_dedup_size') or 10000)
+ALERT_FLUSH_INTERVAL = float(demisto.params().get('alert_flush_interval') or 0.5)
+ALERT_BATCH_SIZE = min(100, int(demisto.params().get('alert_batch_size') or 50))
+ALERT_WRITE_CONCURRENCY = int(demisto.params().get('alert_write_concurrency') or 4)
+OUTBOX_PATH = demisto.params().get('outbox_path') or ''
+OUTBOX_MAX_ATTEMPTS = int(demisto.params().get('outbox_max_attempts') or 8)
+WORKER_POOL_SIZE = int(demisto.params().get('worker_pool_size') or 8)
+WORKER_QUEUE_DEPTH = int(demisto.params().get('worker_queue_depth') or 32)
+CONTEXT_CACHE_ENABLED = str(demisto.params().get('context_cache', True)).lower() != 'false'
+CONTEXT_CACHE_TTL = int(demisto.params().get('context_cache_ttl') or 3600)
+SUBNET_INDEX_TOOL = demisto.params().get('subnet_index_tool') or 'run_xql_query'
+SUBNET_INDEX_TOOL_ARGS = demisto.params().get('subnet_index_tool_args') or '{"query": "dataset = agentic_subnet_lookup"}'
+SUBNET_INDEX_TTL = int(demisto.params().get('subnet_index_ttl') or 900)
+SUBNET_INDEX_FIELD = demisto.params().get('subnet_index_field') or None
 
 os.environ["SLACK_BOT_TOKEN"] = BOT_TOKEN
 os.environ["SLACK_APP_TOKEN"] = APP_TOKEN
@@ -91,7 +241,7 @@ proxy_url = proxies.get('http')  # aiohttp only supports http proxy
 
 
 
-app = App(token=BOT_TOKEN, logger=slack_logger)
+app = AsyncApp(token=BOT_TOKEN, logger=slack_logger)
 
 
 #######################
@@ -100,117 +250,775 @@ app = App(token=BOT_TOKEN, logger=slack_logger)
 
 
 
-class XSIAMClient:
-    def __init__(self, url, api_key, api_key_id):
-        self.url = url
-        self.api_key = api_key
-        self.headers = {
-            "Authorization": api_key,
-            "x-xdr-auth-id": api_key_id,
-            "Content-Type": "application/json"
+def alert_request(incident_type, incident_owner, incident_name, incident_severity, incident_detail, external_id=None):
+    """
+    create_alert request body.
+    A caller-chosen `external_id` becomes the alert's external_id, so a retry can check whether it already exists.
+    """
+    incident_detail = "incident_owner=" + incident_owner+"\nincident_name=" + incident_name + "\nincident_severity=" + str(incident_severity) + "\n" + incident_detail
+    data = {
+        "request_data": {
+            "alert": {
+            "vendor": "Cortex",
+            "product": "TroyBot",
+            "severity": "Medium",
+            "category": incident_type,
+            "mitre_defs": {},
+            "description": incident_detail,
+            }
         }
+    }
+    if external_id:
+        data["request_data"]["alert"]["alert_id"] = external_id
+    return data
 
-    def health(self):
+
+class AsyncXSIAMClient:
+    """
+    XSIAM public API client on one pooled httpx.AsyncClient, for platform
+    calls made from the app loop so they overlap with agent work.
+
+    Idempotent calls are retried on 429/5xx with exponential backoff that
+    honors Retry-After. create_alert is only retried on 429 and failed
+    connects, never after the request may have been processed, so it cannot
+    create the same alert twice.
+    """
+
+    def __init__(self, url, api_key, api_key_id, pool_size=10, max_retries=3, connect_timeout=5, read_timeout=30):
+        self.url = url
+        self.max_retries = max_retries
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            headers={
+                "Authorization": api_key,
+                "x-xdr-auth-id": api_key_id,
+                "Content-Type": "application/json"
+            },
+            verify=SSL_VERIFY,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def _request(self, method, path, retry_statuses=(429, 500, 502, 503, 504), **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.ConnectError:
+                # Nothing reached the server, so any call is safe to repeat
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                continue
+            if response.status_code not in retry_statuses or attempt == self.max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            await asyncio.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 0.5 * 2 ** attempt)
+
+    async def health(self):
         try:
-            response = requests.get(f"{self.url}/public_api/v1/healthcheck", headers=self.headers, verify=SSL_VERIFY)
+            response = await self._request("GET", "/public_api/v1/healthcheck")
             response.raise_for_status()
             return response.text
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             demisto.error(f"Error checking XSIAM health: {e}")
             raise
 
-    def create_incident(self, incident_type, incident_owner, incident_name, incident_severity, incident_detail):
-        incident_detail = "incident_owner=" + incident_owner+"\nincident_name=" + incident_name + "\nincident_severity=" + str(incident_severity) + "\n" + incident_detail
-        data = {
-            "request_data": {
-                "alert": {
-                "vendor": "Cortex",
-                "product": "TroyBot",
-                "severity": "Medium",
-                "category": incident_type,
-                "mitre_defs": {},
-                "description": incident_detail,
-                }
-            }
-        }
+    async def create_incident(self, incident_type, incident_owner, incident_name, incident_severity, incident_detail,
+                              external_id=None):
+        data = alert_request(incident_type, incident_owner, incident_name, incident_severity, incident_detail,
+                             external_id)
         try:
-            response_api = requests.post(self.url + "/public_api/v1/alerts/create_alert", headers=self.headers,
-                                         data=json.dumps(data),
-                                         verify=SSL_VERIFY)
-        except requests.RequestException as e:
+            response_api = await self._request("POST", "/public_api/v1/alerts/create_alert", retry_statuses=(429,),
+                                               content=json.dumps(data))
+        except httpx.HTTPError as e:
             demisto.error(f"Error creating XSIAM incident: {e}")
             raise
         else:
             return response_api.text
 
-    def search_incident(self, filters={}):
-        filters = {
-            "request_data": filters
-        }
+    async def search_incident(self, filters={}):
         try:
-            response = requests.post(f"{self.url}/public_api/v1/alerts/get_alerts/", headers=self.headers,
-                                     json=filters, verify=SSL_VERIFY)
+            response = await self._request("POST", "/public_api/v1/alerts/get_alerts/", json={"request_data": filters})
             response.raise_for_status()
             return response.text
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             demisto.error(f"Error searching XSIAM incidents: {e}")
             raise
 
+    async def update_alert(self, alert_id, comment):
+        try:
+            response = await self._request("POST", "/public_api/v1/alerts/update_alerts", json={"request_data": {
+                "alert_id_list": [int(alert_id)],
+                "update_data": {"comment": comment}
+            }})
+            response.raise_for_status()
+            return response.text
+        except httpx.HTTPError as e:
+            demisto.error(f"Error updating XSIAM alert {alert_id}: {e}")
+            raise
+
+
+# Only used from the app loop, which its httpx pool is bound to
+ASYNC_PLATFORM_CLIENTS = {}
+
+
+def get_async_client(platform, url, api_key, api_key_id):
+    """
+    Returns the shared AsyncXSIAMClient for this configuration. Call from the app loop only.
+    """
+    key = (platform, url, api_key, api_key_id)
+    client = ASYNC_PLATFORM_CLIENTS.get(key)
+    if client is None:
+        client = AsyncXSIAMClient(url, api_key, api_key_id, pool_size=XSIAM_POOL_SIZE, max_retries=XSIAM_MAX_RETRIES,
+                                  connect_timeout=XSIAM_CONNECT_TIMEOUT, read_timeout=XSIAM_READ_TIMEOUT)
+        ASYNC_PLATFORM_CLIENTS[key] = client
+    return client
+
+
+async def check_platform_health():
+    """
+    XSIAM health check for test-module. It runs outside the app loop, so it
+    uses a client of its own instead of the shared one.
+    """
+    client = AsyncXSIAMClient(PLATFORM_URL, API_KEY, API_KEY_ID, pool_size=1, max_retries=XSIAM_MAX_RETRIES,
+                              connect_timeout=XSIAM_CONNECT_TIMEOUT, read_timeout=XSIAM_READ_TIMEOUT)
+    try:
+        return await client.health()
+    finally:
+        await client.client.aclose()
 
-def get_client(platform, url, api_key, api_key_id):
-    return XSIAMClient(url, api_key, api_key_id)
 
+# external_id -> alert_id for alerts this instance already resolved
+# Only touched from the app loop, so no locking is needed
+INCIDENT_ID_CACHE = OrderedDict()
+INCIDENT_ID_CACHE_SIZE = 1024
+INCIDENT_LOOKUP_DEADLINE = 8.0
+INCIDENT_LOOKUP_RECENT = 100
 
-def get_incident_link(platform_client, platform, url, incident_dict):
 
+async def find_alert_ids(platform_client, external_ids):
     """
-    Attempts to find the external ID for an incident, retries up to 5 times with a 1-second delay.
-    Args:
+    Looks up alert_ids for a batch of external_ids in one get_alerts call.
+    The external_id filter is pushed down; tenants that reject that filter
+    get a scan of the most recent alerts instead of the full alert list.
+    Returns {external_id: alert_id} for the ones already indexed.
+    """
+    request_data = {
+        "filters": [{"field": "external_id_list", "operator": "in", "value": list(external_ids)}],
+        "search_from": 0,
+        "search_to": len(external_ids)
+    }
+    try:
+        alerts = return_dict(await platform_client.search_incident(request_data))['reply'].get('alerts') or []
+    except httpx.HTTPStatusError as e:
+        demisto.debug(f"external_id filter rejected ({e}); scanning recent alerts")
+        request_data = {
+            "sort": {"field": "creation_time", "keyword": "desc"},
+            "search_from": 0,
+            "search_to": max(INCIDENT_LOOKUP_RECENT, len(external_ids))
+        }
+        alerts = return_dict(await platform_client.search_incident(request_data))['reply'].get('alerts') or []
+
+    wanted = set(external_ids)
+    return {alert['external_id']: alert['alert_id'] for alert in alerts if alert.get('external_id') in wanted}
+
+
+async def find_alert_id(platform_client, external_id):
+    return (await find_alert_ids(platform_client, [external_id])).get(external_id)
 
-        platform_client: Client instance to interact with the platform.
-        platform (str): Platform name ('xsoar' or 'xsiam').
-        url (str): Base URL for generating the incident link.
-        incident_dict (dict): Incident details dictionary.
-    Returns:
-        str: Generated incident link.
-        str: Case ID (for 'xsiam').
-    Raises:
-        ValueError: If the platform is unsupported or if the external ID cannot be matched.
+
+class PermanentWriteError(Exception):
+    """
+    A platform write that cannot succeed by retrying, such as one for an
+    unsupported platform; the outbox fails it on the first attempt.
     """
 
-    url = url.replace('api-', '')
 
+def alert_link(platform, url, alert_ref):
+    """
+    (incident_link, case_id) for a resolved AlertRef.
+    """
+    url = url.replace('api-', '')
     if platform == 'xsiam':
-        case_uuid = str(incident_dict['reply']).strip()
-        case_id = None
-        for attempt in range(5):  # Retry up to 5 times
-            cases = return_dict(platform_client.search_incident())
-            for case in cases['reply']['alerts']:
-                if case['external_id'] == case_uuid:
-                    case_id = case['alert_id']
-                    break
-            if case_id:
-                break  # Exit loop if case_id is found
+        incident_link = url + "/alerts?action:openAlertDetails=" + str(alert_ref.alert_id) + "-caseinfoid"
+        return incident_link, str(alert_ref.alert_id)
+    raise PermanentWriteError(f"Unsupported platform: {platform}")
+
+
+AlertRef = namedtuple("AlertRef", ["external_id", "alert_id"])
+
+
+class AlertWriter:
+    """
+    Buffered create_alert writer with batched alert id lookups.
+
+    The writes themselves are not batched: create_alert takes one custom
+    alert per call, and XSIAM's multi-alert ingestion (insert_parsed_alerts)
+    neither carries these fields nor sets an external_id to look the alerts
+    up by. What is batched is the id resolution.
+
+    submit() queues an alert and returns a future. When no batch is being
+    written, alerts are flushed on the next loop pass, which groups only
+    the ones submitted together; during a burst (a batch still in flight)
+    they are flushed after `flush_interval` seconds or once `max_batch` are
+    waiting. A flush sends one create_alert call per alert, at most
+    `concurrency` at a time, and then resolves the whole batch's alert ids
+    together with one get_alerts query per poll (jittered exponential
+    backoff up to `deadline`), instead of one lookup loop per alert. Futures resolve to an AlertRef whose
+    alert_id is None if the alert was not indexed in time, and fail with
+    the create error otherwise. Resolved ids are memoized in
+    INCIDENT_ID_CACHE. Only used from the app loop.
+    """
+
+    def __init__(self, flush_interval=0.5, max_batch=50, concurrency=4, deadline=INCIDENT_LOOKUP_DEADLINE):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.batches = 0
+        self.alerts = 0
+        self.lookups = 0
+        self.unresolved = 0
+
+    def submit(self, incident_type, incident_owner, incident_name, incident_severity, incident_detail, external_id=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append(((incident_type, incident_owner, incident_name, incident_severity, incident_detail,
+                              external_id), future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            # Only buffer while a batch is being written; otherwise flush on the next loop pass
+            self.timer = loop.call_later(self.flush_interval if self.tasks else 0, self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _write(self, batch):
+        platform_client = get_async_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+        slots = asyncio.Semaphore(self.concurrency)
+        self.batches += 1
+        self.alerts += len(batch)
+
+        async def create(alert, future):
+            async with slots:
+                try:
+                    return str(return_dict(await platform_client.create_incident(*alert))['reply']).strip()
+                except Exception as e:
+                    future.set_exception(e)
+                    return None
+
+        external_ids = await asyncio.gather(*(create(alert, future) for alert, future in batch))
+        waiting = {external_id: future for external_id, (_, future) in zip(external_ids, batch) if external_id}
+        try:
+            await self._resolve(platform_client, waiting)
+        except Exception as e:
+            demisto.error(f"Alert id lookup failed: {e}")
+        for external_id, future in waiting.items():
+            if not future.done():
+                self.unresolved += 1
+                future.set_result(AlertRef(external_id, None))
+
+    async def _resolve(self, platform_client, waiting):
+        started = time.monotonic()
+        delay = 0.25
+        attempts = 0
+        while True:
+            pending = [e for e, f in waiting.items() if not f.done()]
+            if not pending:
+                return
+            found = {e: INCIDENT_ID_CACHE[e] for e in pending if e in INCIDENT_ID_CACHE}
+            missing = [e for e in pending if e not in found]
+            if missing:
+                attempts += 1
+                self.lookups += 1
+                found.update(await find_alert_ids(platform_client, missing))
+            for external_id, alert_id in found.items():
+                INCIDENT_ID_CACHE[external_id] = alert_id
+                INCIDENT_ID_CACHE.move_to_end(external_id)
+                waiting[external_id].set_result(AlertRef(external_id, alert_id))
+            while len(INCIDENT_ID_CACHE) > INCIDENT_ID_CACHE_SIZE:
+                INCIDENT_ID_CACHE.popitem(last=False)
+
+            remaining = self.deadline - (time.monotonic() - started)
+            if len(found) == len(pending) or remaining <= 0:
+                if len(found) < len(pending):
+                    demisto.error(f"Could not match {len(pending) - len(found)} external_id(s) after {attempts} "
+                                  f"lookups ({self.deadline:g}s).")
+                return
+            # Full jitter keeps concurrent batches from polling in lockstep
+            await asyncio.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, 2.0)
+
+    def stats(self):
+        return {"batches": self.batches, "alerts": self.alerts, "lookups": self.lookups,
+                "unresolved": self.unresolved, "pending": len(self.pending)}
+
+
+ALERT_WRITER = AlertWriter(flush_interval=ALERT_FLUSH_INTERVAL, max_batch=ALERT_BATCH_SIZE,
+                           concurrency=ALERT_WRITE_CONCURRENCY)
+
+
+MONITORED_THREADS_KEY = "monitored_threads"
+MONITORED_THREADS_MAX = 2000
+MONITORED_COMMENT_CHARS = 4000
+
+
+class MonitoredThreadIndex:
+    """
+    One "Troy Monitored Thread" alert per Slack thread.
+
+    Maps channel:thread_ts to the alert created for it, persisted in the
+    integration context so restarts keep updating the same alert. The first
+    mention creates the alert with the thread so far; later mentions only
+    send messages newer than the last one recorded, as the alert comment.
+    queue_delta() picks those messages when the write is queued, so each
+    outbox row carries only its own delta. If the alert id is not
+    resolvable yet, upsert() raises and the outbox retries the row.
+    Only used from the app loop.
+    """
+
+    def __init__(self, max_entries=MONITORED_THREADS_MAX):
+        self.max_entries = max_entries
+        self.entries = None
+        self.queued = OrderedDict()
+        self.locks = {}
+        self.created = 0
+        self.updated = 0
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = OrderedDict((get_integration_context() or {}).get(MONITORED_THREADS_KEY) or {})
+        return self.entries
+
+    def _save(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        ctx = get_integration_context() or {}
+        ctx[MONITORED_THREADS_KEY] = dict(self.entries)
+        set_integration_context(ctx)
+
+    def queue_delta(self, channel_id, thread_ts, messages):
+        """
+        Messages newer than the last one recorded or already queued for this thread.
+        """
+        key = f"{channel_id}:{thread_ts}"
+        entry = self._load().get(key)
+        since = max(float(entry["last_ts"]) if entry else 0.0, self.queued.get(key, 0.0))
+        delta = [m for m in messages if float(m['timestamp']) > since]
+        if delta:
+            self.queued[key] = float(delta[-1]['timestamp'])
+            self.queued.move_to_end(key)
+            while len(self.queued) > self.max_entries:
+                self.queued.popitem(last=False)
+        return delta
+
+    async def upsert(self, platform_client, channel_id, channel_name, thread_ts, messages, external_id=None,
+                     recheck=False):
+        """
+        Records `messages` (a queue_delta() result) on the thread's alert.
+        A new alert is created under `external_id`; with `recheck`, an
+        earlier attempt may already have created it, so it is looked up first.
+        """
+        key = f"{channel_id}:{thread_ts}"
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                await self._upsert(platform_client, key, channel_id, channel_name, thread_ts, messages, external_id,
+                                   recheck)
+        finally:
+            if not lock.locked():
+                self.locks.pop(key, None)
+
+    async def _upsert(self, platform_client, key, channel_id, channel_name, thread_ts, messages, external_id, recheck):
+        entries = self._load()
+        last_ts = messages[-1]['timestamp'] if messages else thread_ts
+        entry = entries.get(key)
+
+        if entry is None:
+            alert_id = None
+            if recheck and external_id:
+                alert_id = await find_alert_id(platform_client, external_id)
+            if alert_id:
+                alert_ref = AlertRef(external_id, alert_id)
             else:
-                time.sleep(1)  # Wait for 1 second before retrying
-        if not case_id:
-            demisto.error(f"Could not match external_id '{case_uuid}' after 5 retries.")
-        incident_link = url + "/alerts?action:openAlertDetails=" + str(case_id) + "-caseinfoid"
-        return incident_link, str(case_id)
-    else:
-        demisto.error(f"Unsupported platform: {platform}")
+                mytext = "thread_id=" + thread_ts + "\nchannel_id=" + channel_id + "\nchannel_name=" + channel_name + "\nthread_messages=" + str(messages)
+                alert_ref = await ALERT_WRITER.submit("Troy Monitored Thread", "",
+                                                      f"Troy Monitored Thread Incident, Thread: {thread_ts}"
+                                                      , SEVERITY_DICT['Low'], mytext, external_id=external_id)
+            entries[key] = {"external_id": alert_ref.external_id, "alert_id": alert_ref.alert_id, "last_ts": last_ts}
+            self.created += 1
+            self._save()
+            return
+
+        if not entry.get("alert_id"):
+            entry["alert_id"] = INCIDENT_ID_CACHE.get(entry["external_id"]) or \
+                await find_alert_id(platform_client, entry["external_id"])
+            if not entry["alert_id"]:
+                raise RuntimeError(f"Monitored thread {key} alert is not indexed yet")
+
+        delta = [m for m in messages if float(m['timestamp']) > float(entry["last_ts"])]
+        if not delta:
+            return
+        comment = f"{len(delta)} new thread message(s) since {entry['last_ts']}:\n{delta}"
+        if len(comment) > MONITORED_COMMENT_CHARS:
+            comment = comment[:MONITORED_COMMENT_CHARS] + "...[truncated]"
+        await platform_client.update_alert(entry["alert_id"], comment)
+        entry["last_ts"] = last_ts
+        entries.move_to_end(key)
+        self.updated += 1
+        self._save()
+
+    def stats(self):
+        return {"threads": len(self.entries or {}), "created": self.created, "updated": self.updated}
+
+
+MONITORED_THREADS = MonitoredThreadIndex()
+
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    external_id TEXT NOT NULL,
+    ordering_key TEXT,
+    response_url TEXT,
+    channel TEXT,
+    thread_ts TEXT,
+    reply TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, id);
+"""
+OUTBOX_TOKEN = re.compile(r"@@outbox:(\d+):(link|id)@@")
+
+
+def outbox_link(outbox_id):
+    """
+    Placeholders for (incident_link, incident_id) of a queued alert; replies
+    built with them are sent once the alert exists.
+    """
+    return f"@@outbox:{outbox_id}:link@@", f"@@outbox:{outbox_id}:id@@"
+
+
+class Outbox:
+    """
+    Durable SQLite outbox for XSIAM writes made by Slack handlers.
+
+    add() commits the write locally and returns at once, so handlers reply
+    to Slack without waiting on XSIAM; run() drains the table in the
+    background. Rows are dispatched in insertion order, and rows sharing
+    an ordering_key (a thread) strictly one after another. Failures are
+    retried with capped exponential backoff up to `max_attempts`, then
+    marked failed; pending rows survive restarts as long as `path` is on
+    persistent storage. Each row gets an external_id when it is added and
+    the alert is created under it, so a retry (or a replay after a crash)
+    first looks that id up and does not create the alert twice.
+
+    Replies that reference outbox_link() placeholders are held on the row
+    and posted to the response_url (or the thread, once that has expired)
+    when the alert is created. Only used from the app loop.
+    """
 
+    def __init__(self, path, max_attempts=8, poll_interval=5.0, retry_base=10.0, max_backoff=300):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.max_backoff = max_backoff
+        self.db = None
+        self.pruned_at = 0.0
+        self.wake = asyncio.Event()
+        self.in_flight = set()
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _conn(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.path, isolation_level=None)
+            self.db.row_factory = sqlite3.Row
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(OUTBOX_SCHEMA)
+        return self.db
+
+    def add(self, kind, payload, body=None, ordering_key=None, channel=None, thread_ts=None):
+        """
+        Records a write and returns its outbox id.
+        """
+        body = body or {}
+        channel = channel or (body.get('channel') or {}).get('id')
+        container = body.get('container') or {}
+        # Ephemeral messages cannot be threaded on; those replies go to the channel
+        if not container.get('is_ephemeral'):
+            thread_ts = thread_ts or container.get('thread_ts') or container.get('message_ts')
+        cursor = self._conn().execute(
+            "INSERT INTO outbox (kind, payload, external_id, ordering_key, response_url, channel, thread_ts, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), f"troybot-{uuid.uuid4().hex}", ordering_key, body.get('response_url'),
+             channel, thread_ts, time.time())
+        )
+        self.wake.set()
+        return cursor.lastrowid
+
+    def add_alert(self, incident_type, incident_owner, incident_name, incident_severity, incident_detail, body=None):
+        """
+        Queues a create_alert and returns outbox_link() placeholders for it.
+        """
+        outbox_id = self.add("create_alert", [incident_type, incident_owner, incident_name, incident_severity,
+                                              incident_detail], body)
+        return outbox_link(outbox_id)
+
+    async def send(self, webhook, blocks):
+        """
+        Sends a handler's reply, holding it back until its queued alert exists.
+        """
+        text = json.dumps(blocks)
+        ids = sorted({int(i) for i, _ in OUTBOX_TOKEN.findall(text)})
+        if not ids:
+            await webhook.send(blocks=blocks)
+            return
+        row = self._conn().execute("SELECT * FROM outbox WHERE id = ?", (ids[0],)).fetchone()
+        if row is None:
+            # Pruned, or recorded in another database: nothing to wait for
+            demisto.error(f"Outbox entry {ids[0]} not found; sending the reply as is")
+            await webhook.send(blocks=blocks)
+            return
+        if row["status"] == "done":
+            await webhook.send(blocks=self._render(text, row))
+            return
+        if row["status"] == "failed":
+            await webhook.send(text=f":x: I couldn't create the incident: {row['error']}")
+            return
+        self._conn().execute("UPDATE outbox SET reply = ? WHERE id = ?", (text, ids[0]))
+        await webhook.send(text=":inbox_tray: Request recorded. I'll post the incident link here as soon as it is created.")
+
+    def _render(self, text, row):
+        result = json.loads(row["result"] or "{}")
+        link, case_id = result.get("incident_link", ""), result.get("incident_id", "")
+        return json.loads(OUTBOX_TOKEN.sub(lambda m: link if m.group(2) == "link" else case_id, text))
+
+    def _due(self):
+        """
+        Pending rows that may be dispatched now: the oldest row per
+        ordering_key, if it is due, and every due unkeyed row.
+        """
+        now = time.time()
+        heads, due = set(), []
+        for row in self._conn().execute("SELECT * FROM outbox WHERE status = 'pending' ORDER BY id"):
+            key = row["ordering_key"]
+            if key is not None:
+                if key in heads:
+                    continue
+                heads.add(key)
+            if row["next_attempt"] <= now and row["id"] not in self.in_flight:
+                due.append(row)
+        return due
+
+    async def _dispatch(self, row):
+        payload = json.loads(row["payload"])
+        platform_client = get_async_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+        # An earlier attempt may have reached XSIAM before it failed
+        recheck = row["attempts"] > 0
+        if row["kind"] == "create_alert":
+            alert_id = await find_alert_id(platform_client, row["external_id"]) if recheck else None
+            if alert_id:
+                alert_ref = AlertRef(row["external_id"], alert_id)
+            else:
+                alert_ref = await ALERT_WRITER.submit(*payload, external_id=row["external_id"])
+            incident_link, incident_id = alert_link(PLATFORM, PLATFORM_URL, alert_ref)
+            return {"incident_link": incident_link, "incident_id": incident_id}
+        if row["kind"] == "monitored_thread":
+            await MONITORED_THREADS.upsert(platform_client, *payload, external_id=row["external_id"], recheck=recheck)
+            return {}
+        raise PermanentWriteError(f"Unknown outbox entry kind {row['kind']}")
+
+    async def _process(self, row):
+        try:
+            result = await self._dispatch(row)
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            permanent = isinstance(e, PermanentWriteError)
+            if permanent or attempts >= self.max_attempts:
+                self.failed += 1
+                self._conn().execute("UPDATE outbox SET status = 'failed', attempts = ?, error = ? WHERE id = ?",
+                                     (attempts, str(e), row["id"]))
+                demisto.error(f"Outbox entry {row['id']} ({row['kind']}) failed after {attempts} attempts: {e}")
+                if row["reply"] is not None:
+                    text = (f":x: I couldn't create the incident: {e}" if permanent
+                            else f":x: I couldn't create the incident after {attempts} attempts: {e}")
+                    await self._notify(row, text=text)
+                return
+            self.retried += 1
+            # The first delay leaves time for an alert the failed attempt did create to be indexed
+            delay = min(self.max_backoff, self.retry_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+            self._conn().execute("UPDATE outbox SET attempts = ?, next_attempt = ?, error = ? WHERE id = ?",
+                                 (attempts, time.time() + delay, str(e), row["id"]))
+            demisto.debug(f"Outbox entry {row['id']} failed ({e}); retrying in {delay:.0f}s")
+            return
+
+        self.delivered += 1
+        self._conn().execute("UPDATE outbox SET status = 'done', result = ?, error = NULL WHERE id = ?",
+                             (json.dumps(result), row["id"]))
+        # Re-read: the handler may have attached its reply while the write was in flight
+        row = self._conn().execute("SELECT * FROM outbox WHERE id = ?", (row["id"],)).fetchone()
+        if row["reply"] is not None:
+            await self._notify(row, blocks=self._render(row["reply"], row))
+
+    async def _notify(self, row, blocks=None, text=None):
+        try:
+            if row["response_url"]:
+                response = await AsyncWebhookClient(row["response_url"]).send(blocks=blocks, text=text)
+                if response.status_code == 200:
+                    return
+            if row["channel"]:
+                await app.client.chat_postMessage(channel=row["channel"], thread_ts=row["thread_ts"],
+                                                  blocks=blocks, text=text or "Incident created")
+        except Exception as e:
+            demisto.error(f"Failed to report outbox entry {row['id']} to Slack: {e}")
+
+    async def _run_row(self, row):
+        self.in_flight.add(row["id"])
+        try:
+            await self._process(row)
+        finally:
+            self.in_flight.discard(row["id"])
+            self.wake.set()
+
+    async def run(self):
+        """
+        Dispatcher loop; runs for the life of the Socket Mode connection.
+        """
+        tasks = set()
+        while True:
+            self.wake.clear()
+            self._prune()
+            for row in self._due():
+                task = asyncio.create_task(self._run_row(row))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _prune(self, retention=86400):
+        """
+        Drops delivered rows after `retention` seconds, at most hourly.
+        """
+        if time.monotonic() - self.pruned_at < 3600:
+            return
+        self.pruned_at = time.monotonic()
+        self._conn().execute("DELETE FROM outbox WHERE status = 'done' AND created < ?", (time.time() - retention,))
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {"pending": counts.get("pending", 0), "done": counts.get("done", 0), "failed": counts.get("failed", 0),
+                "delivered": self.delivered, "retried": self.retried}
+
+
+def outbox_path_warning(path):
+    """
+    Why queued writes at `path` will not survive a container restart, or
+    None when it is set and outside the temp directory. An unset path keeps
+    the outbox in memory.
+    """
+    if not path:
+        return ("Outbox database path (outbox_path) is not set; queued XSIAM writes are kept in memory and lost "
+                "when the integration restarts.")
+    real = os.path.realpath(path)
+    for temp_dir in {"/tmp", "/var/tmp", tempfile.gettempdir()}:
+        temp_dir = os.path.realpath(temp_dir)
+        if real == temp_dir or real.startswith(temp_dir + os.sep):
+            return (f"Outbox database path {path} is under {temp_dir}, which does not survive a container restart. "
+                    "Point outbox_path at persistent storage.")
+    return None
 
 
+OUTBOX = Outbox(OUTBOX_PATH or ':memory:', max_attempts=OUTBOX_MAX_ATTEMPTS)
+
 
 #######################
 # Helper Functions
 #######################
 
-def get_user_name(user_id):
-    try:
-        response = app.client.users_info(user=user_id)
+class SlackUserDirectory:
+    """
+    Cache of Slack user names, bulk-warmed from users.list at startup and
+    kept current by user_change events. Names older than `ttl` seconds, and
+    users not seen during warm-up, are fetched once with users.info.
+    Only used from the app loop.
+    """
+
+    def __init__(self, ttl=21600):
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, user):
+        if user and user.get('id') and user.get('name'):
+            self.entries[user['id']] = (user['name'], time.monotonic())
+
+    async def warm(self, client):
+        """
+        Loads every workspace member via paginated users.list.
+        """
+        cursor = None
+        count = 0
+        try:
+            while True:
+                response = await client.users_list(limit=200, cursor=cursor)
+                for user in response.get('members', []):
+                    self.update(user)
+                    count += 1
+                cursor = (response.get('response_metadata') or {}).get('next_cursor')
+                if not cursor:
+                    break
+            demisto.info(f"User directory warmed with {count} users")
+        except Exception as e:
+            demisto.error(f"User directory warm-up stopped after {count} users: {e}")
+
+    async def get(self, client, user_id):
+        entry = self.entries.get(user_id)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        response = await client.users_info(user=user_id)
+        self.update(response['user'])
         return response['user']['name']
+
+    def stats(self):
+        return {"users": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+USER_DIRECTORY = SlackUserDirectory(ttl=USER_CACHE_TTL)
+
+
+async def get_user_name(user_id):
+    try:
+        return await USER_DIRECTORY.get(app.client, user_id)
     except Exception as e:
         demisto.error(f"The Loop has failed to run {str(e)}")
 
@@ -264,9 +1072,103 @@ def clean_emails(email_str):
 
     return ret_str
 
-def get_gemini_response(text, history=None):
+class ProgressReply:
+    """
+    Placeholder Slack message that is edited in place while the agent works.
+
+    The agent only records tool and text events; get_gemini_response calls
+    flush() alongside the run to push them with chat.update, at most once
+    per `interval` seconds to stay inside Slack's rate limits.
+    """
+
+    def __init__(self, channel, interval=None):
+        self.interval = interval or PROGRESS_UPDATE_INTERVAL
+        self.channel = channel
+        self.ts = None
+        self.steps = {}
+        self.text = ""
+        self._dirty = False
+        self._last_update = 0.0
+
+    @classmethod
+    async def start(cls, channel, thread_ts, interval=None):
+        """
+        Posts the placeholder in the thread and returns the reply.
+        """
+        progress = cls(channel, interval=interval)
+        try:
+            response = await app.client.chat_postMessage(channel=channel, thread_ts=thread_ts,
+                                                         text=":hourglass_flowing_sand: Working on it...")
+            progress.channel = response["channel"]
+            progress.ts = response["ts"]
+        except SlackApiError as e:
+            demisto.error(f"Failed to post progress message: {e}")
+        return progress
+
+    def tool_started(self, name):
+        self.steps[name] = ":gear:"
+        self._dirty = True
+
+    def tool_finished(self, name, ok=True):
+        self.steps[name] = ":white_check_mark:" if ok else ":x:"
+        self._dirty = True
+
+    def append_text(self, delta):
+        self.text += delta
+        self._dirty = True
+
+    def retract_text(self, text):
+        """
+        Removes text streamed by a turn that failed and is being retried.
+        """
+        if text and self.text.endswith(text):
+            self.text = self.text[:-len(text)]
+            self._dirty = True
+
+    def _render(self):
+        lines = [":hourglass_flowing_sand: Working on it..."]
+        lines += [f"{icon} `{name}`" for name, icon in self.steps.items()]
+        if self.text:
+            lines += ["", self.text]
+        return "\n".join(lines)
+
+    async def _update(self, text):
+        try:
+            await app.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+            return True
+        except Exception as e:
+            # Best effort: a failed edit must not end the run; finish() falls back to a new message
+            demisto.debug(f"Failed to update progress message: {e}")
+            return False
+
+    async def flush(self):
+        """
+        Pushes pending progress to Slack unless the last update was too recent.
+        """
+        if not self.ts or time.monotonic() - self._last_update < self.interval:
+            return
+        if not self._dirty:
+            return
+        text = self._render()
+        self._dirty = False
+        self._last_update = time.monotonic()
+        await self._update(text)
+
+    async def finish(self, text, say=None, thread_ts=None):
+        """
+        Replaces the placeholder with the final reply, falling back to a new message.
+        """
+        if self.ts and await self._update(text):
+            return
+        if say:
+            await say(text=text, thread_ts=thread_ts)
+
+
+async def get_gemini_response(text, history=None, progress=None, session_key=None):
     """
     Get response from Gemini for the Slack thread, using MC-enabled Agent loop.
+    When a ProgressReply is given, it is flushed while the agent runs.
+    With a `session_key`, the thread's chat is kept in THREAD_SESSIONS.
     """
     # Retrieve configuration from demisto.params()
     params = demisto.params()
@@ -282,14 +1184,8 @@ def get_gemini_response(text, history=None):
     mcp_key = get_safe_param('mcp_api_key')
     gemini_api_key = get_safe_param('gemini_api_key')
 
-    # Optional JSON creds via param
+    # Optional JSON creds via param, parsed once by the client factory
     google_creds_json = get_safe_param('google_creds_json')
-    google_creds = None
-    if google_creds_json:
-        try:
-            google_creds = json.loads(google_creds_json)
-        except:
-            demisto.error("Failed to parse google_creds_json")
 
     # If parameters not in demisto.params, fallback to Env (legacy support)
     if not mcp_uri:
@@ -304,23 +1200,25 @@ def get_gemini_response(text, history=None):
 
     # Run Async Agent Loop
     try:
-        # Since this might be called from within a sync context in Slack Bolt,
-        # we need to be careful with asyncio.run().
-        # If there is already a running loop, we should use it.
-        # However, integration usually runs as a script.
-        # But Bolt uses asyncio? No, Bolt for Python default adapter is likely sync,
-        # but 'socket_mode' might use async internally or threads.
-
-        # Simple approach: asyncio.run()
-        response = asyncio.run(run_agent_async(
+        # Agent runs share the app loop and borrow warm sessions instead of reconnecting
+        pool = get_mcp_pool(mcp_uri, mcp_key)
+        run = asyncio.create_task(run_agent_async(
             prompt=text,
-            mcp_uri=mcp_uri,
-            mcp_key=mcp_key,
+            pool=pool,
             gemini_api_key=gemini_api_key,
-            google_creds=google_creds,
-            history=history
+            google_creds_json=google_creds_json,
+            history=history,
+            progress=progress,
+            session_key=session_key
         ))
-        return response
+        while progress and not run.done():
+            await asyncio.wait({run}, timeout=progress.interval)
+            try:
+                await progress.flush()
+            except Exception as e:
+                # Progress updates are best effort; the run keeps going and its reply is still posted
+                demisto.error(f"Progress update failed: {e}")
+        return await run
     except Exception as e:
         demisto.error(f"Agent Execution Failed: {e}")
         return f"Agent Error: {str(e)}"
@@ -386,76 +1284,944 @@ def sanitize_schema(s, defs=None, depth=0, processing=None):
 
     return s
 
-async def run_agent_async(prompt, mcp_uri, mcp_key, gemini_api_key=None, google_creds=None, history=None):
+def schema_hash(tool_name, description, schema):
     """
-    Core agent event loop similar to agent-slackx, but returning the response string.
+    Stable content hash of a tool's declaration inputs.
     """
+    payload = json.dumps([tool_name, description, schema], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # Setup Gemini Client
-    client = None
-    model_name = os.environ.get("GEMINI_MODEL", "gemini-3-pro-preview")
-    location = "us-central1"
-    if "gemini-3" in model_name.lower() or "experimental" in model_name.lower():
-        location = "global"
 
-    if gemini_api_key:
-        client = genai.Client(api_key=gemini_api_key)
-    elif google_creds:
+class DeclarationCache:
+    """
+    Memoizes compiled FunctionDeclarations keyed by schema content hash,
+    so only tools whose schema changed are sanitized again.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, tool):
+        schema = getattr(tool, "parameters", getattr(tool, "inputSchema", {})) or {}
+        key = schema_hash(tool.name, tool.description, schema)
+
+        declaration = self.entries.get(key)
+        if declaration is not None:
+            self.hits += 1
+            return key, declaration
+
+        self.misses += 1
+        # Sanitize a deep copy; sanitize_schema mutates nested dicts in place
+        declaration = types.FunctionDeclaration(
+            name=tool.name,
+            description=tool.description,
+            parameters=sanitize_schema(copy.deepcopy(schema))
+        )
+        self.entries[key] = declaration
+        return key, declaration
+
+    def retain(self, keys):
+        """
+        Drops entries for tools the server no longer advertises.
+        """
+        keys = set(keys)
+        self.entries = {k: v for k, v in self.entries.items() if k in keys}
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class ToolListChangedHandler(MessageHandler):
+    """
+    MCP message handler that invalidates a ToolCatalog on tools/list_changed.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    async def on_tool_list_changed(self, message):
+        demisto.info("MCP server reported tools/list_changed; invalidating tool catalog")
+        self.catalog.invalidate()
+
+
+class ToolCatalog:
+    """
+    Cache of the Gemini tool list built from the MCP server's tools.
+    Rebuilt after `ttl` seconds, on a tools/list_changed notification,
+    or when invalidate() is called.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.tools = []
+        self.tool_names = []
+        self.read_only_hints = {}
+        self.loaded_at = 0.0
+        self.declarations = DeclarationCache()
+        self.message_handler = ToolListChangedHandler(self)
+
+    def invalidate(self):
+        self.loaded_at = 0.0
+
+    def is_fresh(self):
+        return self.loaded_at > 0 and time.monotonic() - self.loaded_at < self.ttl
+
+    def read_only_hint(self, tool_name):
+        """
+        The server's readOnlyHint annotation for a tool, or None if it has none.
+        """
+        return self.read_only_hints.get(tool_name)
+
+    async def get_tools(self, mcp_client, refresh=False):
+        """
+        Returns the cached [types.Tool] list, reloading it from `mcp_client` when stale.
+        """
+        if not refresh and self.is_fresh():
+            return self.tools
+
+        raw_tools = await mcp_client.list_tools()
+        tools_data = raw_tools if isinstance(raw_tools, list) else raw_tools.tools
+
+        # Sanitize and convert to Gemini Tool, reusing compiled schemas that did not change
+        hits, misses = self.declarations.hits, self.declarations.misses
+        gemini_funcs = []
+        live_keys = []
+        for t in tools_data:
+            key, declaration = self.declarations.compile(t)
+            live_keys.append(key)
+            gemini_funcs.append(declaration)
+            demisto.debug(f"Registered MCP tool: {t.name}")
+        self.declarations.retain(live_keys)
+        demisto.debug(f"Schema cache: {self.declarations.hits - hits} hits, "
+                      f"{self.declarations.misses - misses} misses (totals: {self.declarations.stats()})")
+
+        self.tools = [types.Tool(function_declarations=gemini_funcs)] if gemini_funcs else []
+        self.tool_names = [f.name for f in gemini_funcs]
+        self.read_only_hints = {
+            t.name: getattr(getattr(t, "annotations", None), "readOnlyHint", None) for t in tools_data
+        }
+        self.loaded_at = time.monotonic()
+        demisto.debug(f"Loaded {len(gemini_funcs)} MCP tools total.")
+        return self.tools
+
+
+TOOL_CATALOG = ToolCatalog(ttl=TOOL_CACHE_TTL)
+
+
+# Tools of the XSIAM MCP server known to be read-only, for servers that do not send
+# readOnlyHint. Any other unannotated tool is not cached unless its policy says "cacheable": true.
+READ_ONLY_TOOLS = {"run_xql_query", "get_cases"}
+
+
+def canonical_arguments(arguments):
+    """
+    Deterministic string form of tool arguments, independent of key order.
+    """
+    return json.dumps(arguments or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ToolResultCache:
+    """
+    LRU + TTL cache of successful MCP tool results.
+
+    Policies are per tool: {"cacheable": bool, "ttl": seconds, "max_bytes": int}.
+    The "*" policy sets the defaults. Tools without an explicit "cacheable"
+    follow the server's readOnlyHint annotation, and unannotated tools are
+    cached only if they are in READ_ONLY_TOOLS. A tool's name alone never
+    makes it cacheable.
+    """
+
+    def __init__(self, max_entries=256, policies=None):
+        self.max_entries = max_entries
+        self.policies = policies or {}
+        self.defaults = {"ttl": 300, "max_bytes": 256 * 1024}
+        self.defaults.update(self.policies.get("*", {}))
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def policy(self, tool_name, read_only_hint=None):
+        policy = dict(self.defaults)
+        policy.update(self.policies.get(tool_name, {}))
+        if "cacheable" not in policy:
+            policy["cacheable"] = read_only_hint if read_only_hint is not None else tool_name in READ_ONLY_TOOLS
+        return policy
+
+    def get(self, tool_name, arguments, read_only_hint=None):
+        """
+        Returns a cached result, or None on a miss or for non-cacheable tools.
+        """
+        if not self.policy(tool_name, read_only_hint)["cacheable"]:
+            self.bypassed += 1
+            return None
+
+        key = (tool_name, canonical_arguments(arguments))
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, tool_name, arguments, result, read_only_hint=None):
+        policy = self.policy(tool_name, read_only_hint)
+        if not policy["cacheable"]:
+            return
+        size = len(str(result.content))
+        if size > policy["max_bytes"]:
+            demisto.debug(f"Not caching {tool_name} result ({size} bytes > {policy['max_bytes']})")
+            return
+
+        key = (tool_name, canonical_arguments(arguments))
+        self.entries[key] = (time.monotonic() + policy["ttl"], result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "entries": len(self.entries),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def load_result_cache_policies(raw):
+    try:
+        return json.loads(raw) if isinstance(raw, str) else dict(raw)
+    except (ValueError, TypeError) as e:
+        demisto.error(f"Invalid tool_result_cache_policy, using defaults: {e}")
+        return {}
+
+
+# Only touched from the app loop, so no locking is needed
+TOOL_RESULTS = ToolResultCache(max_entries=TOOL_RESULT_CACHE_SIZE,
+                               policies=load_result_cache_policies(TOOL_RESULT_CACHE_POLICY))
+
+
+LOCAL_SUBNET_TOOL = "lookup_ip_subnet"
+
+# Column names tried, in order, when the subnet field is not configured
+SUBNET_FIELDS = ("subnet", "cidr", "network", "ip_range", "range", "prefix")
+
+SUBNET_TOOL_DECLARATION = types.FunctionDeclaration(
+    name=LOCAL_SUBNET_TOOL,
+    description=(
+        "Instantly map IP addresses to their entry in the agentic_subnet_lookup dataset "
+        "(training room, purpose, location) using a local snapshot and longest-prefix match. "
+        "Use this before querying the dataset. For IPs returned as unmatched, fall back to "
+        "querying the agentic_subnet_lookup dataset through the MCP tools."
+    ),
+    parameters={
+        "type": "object",
+        "properties": {
+            "ips": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "IPv4 or IPv6 addresses to look up."
+            }
+        },
+        "required": ["ips"]
+    }
+)
+
+
+def find_rows(obj):
+    """
+    First list of dict rows found in a (possibly nested) tool response.
+    """
+    if isinstance(obj, list):
+        if obj and all(isinstance(r, dict) for r in obj):
+            return obj
+        for item in obj:
+            rows = find_rows(item)
+            if rows:
+                return rows
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            rows = find_rows(value)
+            if rows:
+                return rows
+    return []
+
+
+def parse_tool_rows(result):
+    """
+    Extracts dataset rows from an MCP CallToolResult.
+    """
+    structured = getattr(result, "structured_content", None)
+    if structured:
+        rows = find_rows(structured)
+        if rows:
+            return rows
+
+    for item in getattr(result, "content", None) or []:
+        text = getattr(item, "text", None)
+        if not text:
+            continue
         try:
-            # Create credentials logic with explicitly required scope
-            scopes = ['https://www.googleapis.com/auth/cloud-platform']
-            credentials = service_account.Credentials.from_service_account_info(google_creds, scopes=scopes)
-            project_id = google_creds.get("project_id")
+            rows = find_rows(json.loads(text))
+        except ValueError:
+            continue
+        if rows:
+            return rows
+    return []
 
-            if credentials:
-                # Initialize Vertex AI client with explicit credentials
-                client = genai.Client(vertexai=True, project=project_id, location=location, credentials=credentials)
-                demisto.debug("Initialized Gemini Client with Service Account credentials.")
-        except Exception as e:
-            demisto.error(f"Failed to load Google credentials: {e}")
 
-    if not client:
-        # Fallback to env usually set by XSOAR params/docker
+def row_network(row, field=None):
+    if field:
+        candidates = [row.get(field)]
+    else:
+        # Known column names first, then any value written in CIDR notation
+        candidates = [row.get(f) for f in SUBNET_FIELDS]
+        candidates += [v for v in row.values() if isinstance(v, str) and "/" in v]
+    for value in candidates:
+        if not isinstance(value, str) or not value.strip():
+            continue
         try:
-            # If no key passed but creds path logic exists
-             client = genai.Client(vertexai=True, location=location) # Try default
-        except:
-             return "Error: No valid Gemini configuration."
+            return ipaddress.ip_network(value.strip(), strict=False)
+        except ValueError:
+            continue
+    return None
 
-    demisto.debug(f"Agent interacting with model: {model_name} at {location}")
 
-    # Connect to MCP
-    async with CortexMCPClient(mcp_uri, mcp_key) as mcp_client:
-        tools_list = []
-        loaded_tool_names = []
+class SubnetIndex:
+    """
+    In-memory longest-prefix-match index over a snapshot of the
+    agentic_subnet_lookup dataset.
+
+    Networks are bucketed by prefix length; a lookup masks the address
+    once per known prefix length, longest first, so it costs a handful of
+    dict probes. The snapshot is reloaded through an MCP tool call after
+    `ttl` seconds; a failed reload keeps serving the previous snapshot.
+    """
+
+    def __init__(self, tool_name, tool_args=None, ttl=900, field=None, retry_interval=60):
+        self.tool_name = tool_name
+        self.tool_args = tool_args or {}
+        self.ttl = ttl
+        self.field = field
+        self.retry_interval = retry_interval
+        self.buckets = {4: {}, 6: {}}
+        self.prefix_lengths = {4: [], 6: []}
+        self.size = 0
+        self.loaded_at = 0.0
+        self.attempted_at = 0.0
+
+    @property
+    def loaded(self):
+        return self.size > 0
+
+    def load(self, rows):
+        buckets = {4: {}, 6: {}}
+        skipped = 0
+        for row in rows:
+            network = row_network(row, self.field)
+            if network is None:
+                skipped += 1
+                continue
+            key = int(network.network_address)
+            buckets[network.version].setdefault(network.prefixlen, {})[key] = (str(network), row)
+
+        self.buckets = buckets
+        self.prefix_lengths = {v: sorted(b, reverse=True) for v, b in buckets.items()}
+        self.size = sum(len(n) for b in buckets.values() for n in b.values())
+        self.loaded_at = time.monotonic()
+        demisto.info(f"Subnet index loaded {self.size} networks ({skipped} rows without a subnet)")
+
+    def lookup(self, ip):
+        """
+        Returns (cidr, row) of the most specific network containing `ip`, or None.
+        """
+        address = ipaddress.ip_address(ip.strip())
+        value = int(address)
+        bits = address.max_prefixlen
+        bucket = self.buckets[address.version]
+        for prefixlen in self.prefix_lengths[address.version]:
+            shift = bits - prefixlen
+            match = bucket[prefixlen].get(value >> shift << shift)
+            if match:
+                return match
+        return None
+
+    def lookup_many(self, ips):
+        matches, unmatched, invalid = {}, [], []
+        for ip in ips or []:
+            try:
+                match = self.lookup(str(ip))
+            except ValueError:
+                invalid.append(ip)
+                continue
+            if match:
+                matches[ip] = {"subnet": match[0], **match[1]}
+            else:
+                unmatched.append(ip)
+
+        response = {"matches": matches}
+        if unmatched:
+            response["unmatched"] = unmatched
+            response["note"] = "No local match; query the agentic_subnet_lookup dataset via MCP for these IPs."
+        if invalid:
+            response["invalid"] = invalid
+        return response
+
+    def is_fresh(self):
+        return self.loaded and time.monotonic() - self.loaded_at < self.ttl
+
+    async def ensure_fresh(self, mcp_client, available_tools, timeout=30):
+        """
+        Reloads the snapshot when it is stale and the snapshot tool is advertised.
+        Returns True when the index can answer lookups.
+        """
+        if self.is_fresh():
+            return True
+        if self.tool_name not in available_tools:
+            return self.loaded
+        if time.monotonic() - self.attempted_at < self.retry_interval:
+            return self.loaded
+
+        self.attempted_at = time.monotonic()
         try:
-            raw_tools = await mcp_client.list_tools()
-            tools_data = raw_tools if isinstance(raw_tools, list) else raw_tools.tools
-
-            # Sanitize and convert to Gemini Tool
-            gemini_funcs = []
-            for t in tools_data:
-                loaded_tool_names.append(t.name)
-                schema = getattr(t, "parameters", getattr(t, "inputSchema", {}))
-                clean_schema = sanitize_schema(schema.copy())
-                gemini_funcs.append(types.FunctionDeclaration(
-                    name=t.name,
-                    description=t.description,
-                    parameters=clean_schema
-                ))
-                demisto.debug(f"Registered MCP tool: {t.name}")
-
-            if gemini_funcs:
-                tools_list = [types.Tool(function_declarations=gemini_funcs)]
-                demisto.debug(f"Loaded {len(gemini_funcs)} MCP tools total.")
+            result = await asyncio.wait_for(mcp_client.call_tool(self.tool_name, self.tool_args), timeout)
+            rows = parse_tool_rows(result)
+            if rows:
+                self.load(rows)
+            else:
+                demisto.error(f"Subnet snapshot via {self.tool_name} returned no rows")
+        except Exception as e:
+            demisto.error(f"Subnet snapshot via {self.tool_name} failed: {e}")
+        return self.loaded
+
+
+def load_subnet_tool_args(raw):
+    try:
+        return json.loads(raw) if isinstance(raw, str) else dict(raw)
+    except (ValueError, TypeError) as e:
+        demisto.error(f"Invalid subnet_index_tool_args, using no arguments: {e}")
+        return {}
+
+
+# Only touched from the app loop, so no locking is needed
+SUBNET_INDEX = SubnetIndex(tool_name=SUBNET_INDEX_TOOL, tool_args=load_subnet_tool_args(SUBNET_INDEX_TOOL_ARGS),
+                           ttl=SUBNET_INDEX_TTL, field=SUBNET_INDEX_FIELD)
+
+
+# Rough chars-per-token ratio for JSON-heavy tool output
+CHARS_PER_TOKEN = 4
+EMPTY_VALUES = (None, "", [], {})
+
+
+def estimate_tokens(obj):
+    """
+    Cheap token estimate of a JSON-serializable value.
+    """
+    text = obj if isinstance(obj, str) else json.dumps(obj, default=str, separators=(",", ":"))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def content_payload(content):
+    """
+    Plain JSON form of an MCP result's content blocks.
+    Text blocks holding JSON are decoded so rows can be trimmed individually.
+    """
+    values = []
+    for item in content or []:
+        text = getattr(item, "text", None)
+        if text is not None:
+            try:
+                values.append(json.loads(text))
+            except ValueError:
+                values.append(text)
+        elif hasattr(item, "model_dump"):
+            values.append(item.model_dump(mode="json"))
+        else:
+            values.append(str(item))
+    return values[0] if len(values) == 1 else values
+
 
+def allocate_budgets(estimates, per_result, per_turn):
+    """
+    Splits the per-turn budget across results by water-filling: small
+    results keep what they need, the rest share what is left evenly.
+    Independent of completion order, so shaping is deterministic.
+    """
+    caps = [min(e, per_result) for e in estimates]
+    if sum(caps) <= per_turn:
+        return [per_result] * len(caps)
+
+    budgets = [0] * len(caps)
+    remaining = per_turn
+    order = sorted(range(len(caps)), key=lambda i: (caps[i], i))
+    for position, i in enumerate(order):
+        share = remaining // (len(order) - position)
+        budgets[i] = min(caps[i], share)
+        remaining -= budgets[i]
+    return budgets
+
+
+def row_lists(obj, path="$"):
+    """
+    Yields (path, rows) for every list of dict rows in obj.
+    """
+    if isinstance(obj, list):
+        if len(obj) > 1 and all(isinstance(r, dict) for r in obj):
+            yield path, obj
+            return
+        for i, item in enumerate(obj):
+            yield from row_lists(item, f"{path}[{i}]")
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from row_lists(value, f"{path}.{key}")
+
+
+def drop_empty_columns(obj):
+    dropped = set()
+    for _, rows in row_lists(obj):
+        columns = {k for row in rows for k in row}
+        empty = {k for k in columns if all(row.get(k) in EMPTY_VALUES for row in rows)}
+        for row in rows:
+            for k in empty:
+                row.pop(k, None)
+        dropped |= empty
+    return sorted(dropped)
+
+
+def truncate_strings(obj, max_chars):
+    """
+    Shortens long strings in place; returns how many were cut.
+    """
+    count = 0
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else []
+    for key, value in list(items):
+        if isinstance(value, str) and len(value) > max_chars:
+            obj[key] = value[:max_chars] + f"...[+{len(value) - max_chars} chars]"
+            count += 1
+        elif isinstance(value, (dict, list)):
+            count += truncate_strings(value, max_chars)
+    return count
+
+
+def shape_result(payload, budget, max_string_chars=1000):
+    """
+    Fits a tool result into `budget` estimated tokens.
+
+    Steps, applied only while the result is over budget: drop columns that
+    are empty in every row, truncate long strings, keep the leading rows of
+    the largest row lists, and finally cut the serialized JSON. Returns
+    (payload, omitted), where omitted describes what was removed or None.
+    """
+    original = estimate_tokens(payload)
+    if original <= budget:
+        return payload, None
+
+    shaped = copy.deepcopy(payload)
+    omitted = {"original_tokens": original, "budget_tokens": budget}
+
+    dropped = drop_empty_columns(shaped)
+    if dropped:
+        omitted["empty_fields_dropped"] = dropped
+
+    if estimate_tokens(shaped) > budget:
+        truncated = truncate_strings(shaped, max_string_chars) if isinstance(shaped, (dict, list)) else 0
+        if truncated:
+            omitted["strings_truncated"] = truncated
+
+    rows_omitted = []
+    for path, rows in sorted(row_lists(shaped), key=lambda pr: -len(pr[1])):
+        if estimate_tokens(shaped) <= budget:
+            break
+        total = len(rows)
+        full = rows[:]
+        # Largest leading slice that fits, found by bisection
+        low, high = 1, total - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            rows[:] = full[:middle]
+            if estimate_tokens(shaped) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        rows[:] = full[:low]
+        rows_omitted.append({"path": path, "total": total, "kept": low})
+    if rows_omitted:
+        omitted["rows_omitted"] = rows_omitted
+
+    if estimate_tokens(shaped) > budget:
+        text = shaped if isinstance(shaped, str) else json.dumps(shaped, default=str, separators=(",", ":"))
+        keep = max(0, budget * CHARS_PER_TOKEN - 64)
+        shaped = text[:keep]
+        omitted["chars_truncated"] = len(text) - keep
+
+    omitted["note"] = (
+        "Result trimmed to fit the token budget. Omitted rows/fields are listed here; "
+        "narrow the query (filters, fields, limit) to see them."
+    )
+    demisto.debug(f"Shaped tool result from ~{original} to ~{estimate_tokens(shaped)} tokens")
+    return shaped, omitted
+
+
+def shape_responses(responses, per_result, per_turn):
+    """
+    Applies shape_result to a turn's {"result": ...} responses under the
+    per-result and per-turn budgets. Error responses pass through unchanged.
+    """
+    indexes = [i for i, r in enumerate(responses) if "result" in r]
+    payloads = [responses[i]["result"] for i in indexes]
+    budgets = allocate_budgets([estimate_tokens(p) for p in payloads], per_result, per_turn)
+
+    shaped = list(responses)
+    for i, payload, budget in zip(indexes, payloads, budgets):
+        result, omitted = shape_result(payload, budget)
+        shaped[i] = {"result": result, "omitted": omitted} if omitted else {"result": result}
+    return shaped
+
+
+def prefix_key(model, system_instruction, tools):
+    """
+    Content hash of the static request prefix: model, system prompt and tool declarations.
+    """
+    declarations = [t.model_dump(mode="json", exclude_none=True) for t in tools or []]
+    payload = json.dumps([model, system_instruction, declarations], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ContextCache:
+    """
+    Gemini cached-content handles for the system prompt + tool declarations
+    prefix, keyed by prefix_key(). A handle is extended `refresh_margin`
+    seconds before it expires and replaced when the prompt or catalog
+    changes. When caching is unavailable (unsupported model, prefix below
+    the minimum cacheable size) the prefix is sent inline and creation is
+    not retried for `retry_interval` seconds.
+
+    Only `client.aio.caches.create/update/delete` are used, so any object
+    exposing those coroutines can stand in for the GenAI client.
+    """
+
+    def __init__(self, ttl=3600, refresh_margin=300, retry_interval=600, enabled=True):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.enabled = enabled
+        self.entries = {}
+        self.current = {}
+        self.failed = {}
+        self.hits = 0
+        self.creates = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def _expiry(self, cached):
+        expire_time = getattr(cached, "expire_time", None)
+        if expire_time is not None:
+            return expire_time.timestamp()
+        return time.time() + self.ttl
+
+    async def get(self, client, model, system_instruction, tools):
+        """
+        Returns the cached-content name for this prefix, or None to send it inline.
+        """
+        if not self.enabled:
+            return None
+
+        key = prefix_key(model, system_instruction, tools)
+        entry = self.entries.get(key)
+        retry_at = self.failed.get(key, 0)
+        if entry is None and time.time() < retry_at:
+            return None
+
+        if entry and entry["expires_at"] - time.time() > self.refresh_margin:
+            self.hits += 1
+            return entry["name"]
+
+        if entry and entry["expires_at"] > time.time():
+            # Close to expiry: extend the existing handle
+            try:
+                cached = await client.aio.caches.update(
+                    name=entry["name"],
+                    config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+                )
+                entry["expires_at"] = self._expiry(cached)
+                self.refreshes += 1
+                demisto.debug(f"Extended context cache {entry['name']}")
+                return entry["name"]
+            except Exception as e:
+                demisto.error(f"Could not extend context cache {entry['name']}: {e}")
+
+        return await self._create(client, model, system_instruction, tools, key)
+
+    async def _create(self, client, model, system_instruction, tools, key):
+        try:
+            cached = await client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"soc-agent-{key[:12]}",
+                    system_instruction=system_instruction,
+                    tools=tools or None,
+                    ttl=f"{self.ttl}s"
+                )
+            )
         except Exception as e:
-            demisto.error(f"MCP Connection Warning: {e}")
-            # Continue without tools
+            self.failures += 1
+            self.failed[key] = time.time() + self.retry_interval
+            demisto.error(f"Context caching unavailable for {model}, sending prompt inline: {e}")
+            return None
+
+        self.creates += 1
+        self.entries[key] = {"name": cached.name, "expires_at": self._expiry(cached)}
+        previous = self.current.get(model)
+        self.current[model] = key
+        stale = self.entries.pop(previous, None) if previous and previous != key else None
+        demisto.debug(f"Created context cache {cached.name} for {model}")
+
+        # The old prefix will not be used again; drop it instead of waiting for its TTL
+        if stale:
+            try:
+                await client.aio.caches.delete(name=stale["name"])
+            except Exception as e:
+                demisto.error(f"Could not delete stale context cache {stale['name']}: {e}")
+        return cached.name
+
+    def invalidate(self):
+        self.entries.clear()
+        self.current.clear()
+        self.failed.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "creates": self.creates,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "entries": len(self.entries),
+        }
+
+
+def generation_config(cached_content, system_instruction, tools, **kwargs):
+    """
+    GenerateContentConfig that references the cached prefix when there is
+    one, and carries the system prompt and tools inline otherwise.
+    """
+    if cached_content:
+        return types.GenerateContentConfig(cached_content=cached_content, **kwargs)
+    return types.GenerateContentConfig(system_instruction=system_instruction, tools=tools or None, **kwargs)
+
+
+# Only touched from the app loop, so no locking is needed
+CONTEXT_CACHE = ContextCache(ttl=CONTEXT_CACHE_TTL, enabled=CONTEXT_CACHE_ENABLED)
+
+
+class ThreadSessionStore:
+    """
+    Live Gemini chats per Slack thread, keyed by (channel, thread_ts).
+
+    A session remembers which thread messages the model has already seen
+    (a timestamp watermark plus the bot's own replies), so a follow-up
+    mention only sends the messages that arrived since, instead of the
+    whole thread. Sessions are evicted least recently used first, after
+    `idle_ttl` seconds without use, and while the estimated size of all
+    chat histories exceeds `max_bytes`.
+
+    Only used from the app loop; a per-session asyncio.Lock keeps two
+    mentions in one thread from interleaving turns in the same chat.
+    """
+
+    def __init__(self, max_sessions=200, idle_ttl=3600, max_bytes=64 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextlib.asynccontextmanager
+    async def lease(self, key):
+        """
+        Yields the session for key (a fresh one if none), holding its lock.
+        """
+        self._evict()
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = {"key": key, "chat": None, "config_key": None, "watermark": "", "seen": set(), "size": 0,
+                     "last_used": time.monotonic(), "lock": asyncio.Lock()}
+            self.entries[key] = entry
+        else:
+            self.hits += 1
+        async with entry["lock"]:
+            try:
+                yield entry
+            finally:
+                entry["last_used"] = time.monotonic()
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+        self._evict()
+
+    def unseen(self, entry, messages):
+        """
+        Messages the session's chat has not seen yet, oldest first.
+        """
+        return [m for m in messages or []
+                if float(m['timestamp']) > float(entry["watermark"] or 0) and m['timestamp'] not in entry["seen"]]
+
+    def mark_seen(self, entry, messages, *own_ts):
+        """
+        Advances the watermark past `messages` and remembers the bot's own replies.
+        """
+        for m in messages or []:
+            if float(m['timestamp']) > float(entry["watermark"] or 0):
+                entry["watermark"] = m['timestamp']
+        # Only replies newer than the watermark can come back as unseen
+        entry["seen"] = {ts for ts in entry["seen"] if float(ts) > float(entry["watermark"] or 0)}
+        entry["seen"].update(ts for ts in own_ts if ts)
+
+    def record_size(self, entry):
+        history = entry["chat"].get_history(curated=False) if entry["chat"] else []
+        entry["size"] = sum(len(json.dumps(c.model_dump(mode="json", exclude_none=True), default=str)) for c in history)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        total = sum(e["size"] for e in self.entries.values())
+        for key, entry in list(self.entries.items()):
+            if entry["lock"].locked():
+                continue
+            idle = now - entry["last_used"] > self.idle_ttl
+            if idle or len(self.entries) > self.max_sessions or total > self.max_bytes:
+                del self.entries[key]
+                total -= entry["size"]
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "sessions": len(self.entries),
+            "bytes": sum(e["size"] for e in self.entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+THREAD_SESSIONS = ThreadSessionStore(max_sessions=THREAD_SESSION_MAX, idle_ttl=THREAD_SESSION_TTL,
+                                     max_bytes=int(THREAD_SESSION_MAX_MB * 1024 * 1024))
+
 
-        # Chat Config
-        config = types.GenerateContentConfig(
-            system_instruction="""You are an advanced Security Analyst Agent in the Troy Security Operations Center (SOC).
+SUMMARY_INSTRUCTION = """You maintain a rolling summary of a Slack thread for a SOC analyst agent.
+Merge the previous summary (if any) with the new messages into one updated summary.
+Keep every indicator (IPs, hashes, domains, URLs, emails, hosts, users), incident ids and links,
+findings, decisions, actions taken and open questions, with who said what when it matters.
+Drop greetings, raw tool output and pasted logs beyond the facts they establish.
+Write plain concise bullet points."""
+
+
+class HistoryCompactor:
+    """
+    Keeps injected thread history under a token budget.
+
+    The last `keep_turns` messages are passed verbatim; older ones are
+    folded into a rolling summary cached per thread with the timestamp of
+    the last message it covers, so the model is only asked to extend it
+    when messages have left the verbatim window since. If the window alone
+    is over budget, its oldest messages are folded too and long texts are
+    cut. When summarizing fails the folded messages are replaced by a
+    count instead.
+    """
+
+    def __init__(self, keep_turns=10, token_budget=6000, max_threads=200):
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.max_threads = max_threads
+        self.summaries = OrderedDict()
+        self.hits = 0
+        self.updates = 0
+        self.failures = 0
+
+    def _split(self, messages):
+        """
+        (older, recent): recent is the verbatim window within its share of the budget.
+        """
+        window_budget = self.token_budget * 3 // 4
+        recent = [copy.deepcopy(m) for m in messages[-self.keep_turns:]] if self.keep_turns > 0 else []
+        older = messages[:len(messages) - len(recent)]
+        while len(recent) > 1 and estimate_tokens(recent) > window_budget:
+            older = messages[:len(older) + 1]
+            recent.pop(0)
+        if recent and estimate_tokens(recent) > window_budget:
+            truncate_strings(recent, max(200, window_budget * CHARS_PER_TOKEN // len(recent)))
+        return older, recent
+
+    async def _summarize(self, client, model, previous, messages):
+        contents = f"Previous summary:\n{previous or '(none)'}\n\nNew messages:\n{messages}"
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                system_instruction=SUMMARY_INSTRUCTION,
+                max_output_tokens=max(256, self.token_budget // 4)
+            )
+        )
+        return (response.text or "").strip()
+
+    async def compact(self, client, model, key, messages):
+        """
+        Returns messages as a summary entry followed by the verbatim window.
+        """
+        if not messages or estimate_tokens(messages) <= self.token_budget:
+            return messages
+        older, recent = self._split(messages)
+        if not older:
+            return recent
+
+        entry = self.summaries.get(key) if key else None
+        covered = float(entry["upto"]) if entry else 0.0
+        new = [m for m in older if float(m['timestamp']) > covered]
+        if entry and not new:
+            self.hits += 1
+            self.summaries.move_to_end(key)
+            summary = entry["summary"]
+        else:
+            try:
+                summary = await self._summarize(client, model, entry["summary"] if entry else None, new)
+            except Exception as e:
+                summary = None
+                self.failures += 1
+                demisto.error(f"Thread summary failed: {e}")
+            if summary and key:
+                self.updates += 1
+                self.summaries[key] = {"summary": summary, "upto": older[-1]['timestamp']}
+                self.summaries.move_to_end(key)
+                while len(self.summaries) > self.max_threads:
+                    self.summaries.popitem(last=False)
+
+        if not summary:
+            return [{'summary': f"[{len(older)} earlier messages omitted]"}] + recent
+        # The summary gets what the window left over; it is cut rather than pushing the total past the budget
+        room = max(0, self.token_budget - estimate_tokens(recent)) * CHARS_PER_TOKEN
+        if len(summary) > room:
+            summary = summary[:room] + "...[summary truncated]"
+        return [{'summary': summary, 'messages_summarized': len(older)}] + recent
+
+    def stats(self):
+        return {"threads": len(self.summaries), "hits": self.hits, "updates": self.updates,
+                "failures": self.failures}
+
+
+HISTORY_COMPACTOR = HistoryCompactor(keep_turns=HISTORY_KEEP_TURNS, token_budget=HISTORY_TOKEN_BUDGET,
+                                     max_threads=THREAD_SESSION_MAX)
+
+SYSTEM_INSTRUCTION = """You are an advanced Security Analyst Agent in the Troy Security Operations Center (SOC).
 Your mission is to protect the Troy network assets from external and internal threats, utilizing a multi-vendor, integrated SOC/NOC architecture.
 
 **The Environment & Topology:**
@@ -492,25 +2258,264 @@ The architecture is a centralized SOC/NOC stack where **Palo Alto Networks (Cort
 - **Human-Like**: Use natural language. Avoid overly robotic phrasing. It's okay to show personality (e.g., "Good catch!", "Let's dig into this.").
 - **Vigilant**: Expect hostile traffic from the Training Rooms (Internal) and Registration Servers (External).
 - **Context-Aware**: Understand that an alert from Corelight or Arista isn't isolated—it feeds into XSIAM. Use this context for correlation.
-- **Subnet Lookup**: You MUST use the `agentic_subnet_lookup` dataset to identify the physical location/purpose of an IP (e.g., "Which training room is this?").
+- **Subnet Lookup**: You MUST use the `agentic_subnet_lookup` dataset to identify the physical location/purpose of an IP (e.g., "Which training room is this?"). When the `lookup_ip_subnet` tool is available, use it first (it answers from a local snapshot of that dataset); query the dataset through MCP only for IPs it reports as unmatched.
 - **Reporting**: Cite specific tools and flows (e.g., "I'm seeing a correlation in XSIAM matching the Corelight NDR hits...").
 - **Recommendations**: We don't block students or guests at Troy , so don't including blocking in your recommendations if you think the ip is local not external attacker.
 - **Safty**: Defang URL's before sharing them with analysts .
-""",
-            tools=tools_list,
+"""
+
+
+async def execute_tool_calls(mcp_client, function_calls, max_concurrency=None, timeout=None, progress=None):
+    """
+    Runs the model's function calls concurrently (bounded by max_concurrency),
+    each with its own timeout. A failing call becomes an error response for
+    that call only. Results are then shaped to the per-result and per-turn
+    token budgets. Returned parts are in the same order as function_calls.
+    """
+    max_concurrency = max(1, max_concurrency or TOOL_CONCURRENCY)
+    timeout = timeout or TOOL_TIMEOUT
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_call(fc):
+        tool_name = fc.name
+        # Gemini sends args=None for calls without arguments
+        tool_args = fc.args or {}
+        async with semaphore:
+            demisto.debug(f"Agent invoking tool: {tool_name} with args: {tool_args}")
+            if progress:
+                progress.tool_started(tool_name)
+
+            try:
+                # Answered from the local subnet index, no MCP round trip
+                if tool_name == LOCAL_SUBNET_TOOL:
+                    response = SUBNET_INDEX.lookup_many(tool_args.get("ips"))
+                    demisto.debug(f"Tool {tool_name} answered locally: {str(response)[:500]}")
+                    if progress:
+                        progress.tool_finished(tool_name)
+                    return {"result": response}
+
+                # Serve repeated read-only calls from the result cache
+                hint = TOOL_CATALOG.read_only_hint(tool_name)
+                tool_result = TOOL_RESULTS.get(tool_name, tool_args, hint)
+                cached = tool_result is not None
+                if not cached:
+                    # Call MCP Tool
+                    tool_result = await asyncio.wait_for(mcp_client.call_tool(tool_name, tool_args), timeout)
+                    TOOL_RESULTS.put(tool_name, tool_args, tool_result, hint)
+                source = " (cached)" if cached else ""
+                demisto.debug(f"Tool {tool_name} returned{source}: {str(tool_result.content)[:500]}")
+                if progress:
+                    progress.tool_finished(tool_name)
+
+                return {"result": content_payload(tool_result.content)}
+            except Exception as e:
+                error = f"Timed out after {timeout:g}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                demisto.error(f"Tool {tool_name} failed: {error}")
+                if progress:
+                    progress.tool_finished(tool_name, ok=False)
+                return {"error": error}
+
+    responses = await asyncio.gather(*(run_call(fc) for fc in function_calls))
+    demisto.debug(f"Tool result cache: {TOOL_RESULTS.stats()}")
+    responses = shape_responses(responses, RESULT_TOKEN_BUDGET, TURN_TOKEN_BUDGET)
+    for fc, response in zip(function_calls, responses):
+        if response.get("omitted"):
+            demisto.debug(f"Tool {fc.name} result trimmed: {response['omitted']}")
+    return [
+        types.Part.from_function_response(name=fc.name, response=response)
+        for fc, response in zip(function_calls, responses)
+    ]
+
+
+def credentials_fingerprint(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest() if value else None
+
+
+class GenAIClientFactory:
+    """
+    Builds one genai.Client per configuration and reuses it across messages.
+
+    Service account credentials are parsed once and their OAuth token is
+    refreshed in a worker thread `refresh_margin` seconds before it expires,
+    so agent runs do not wait on a token round trip. Clients are created on
+    the app loop, which lives as long as the integration.
+    """
+
+    def __init__(self, refresh_margin=300):
+        self.refresh_margin = refresh_margin
+        self.entries = {}
+        self.builds = 0
+        self.refreshes = 0
+
+    def _build(self, api_key, google_creds_json, location):
+        if api_key:
+            return genai.Client(api_key=api_key), None
+
+        if google_creds_json:
+            try:
+                info = json.loads(google_creds_json)
+                # Create credentials logic with explicitly required scope
+                scopes = ['https://www.googleapis.com/auth/cloud-platform']
+                credentials = service_account.Credentials.from_service_account_info(info, scopes=scopes)
+                # Initialize Vertex AI client with explicit credentials
+                client = genai.Client(vertexai=True, project=info.get("project_id"), location=location,
+                                      credentials=credentials)
+                demisto.debug("Initialized Gemini Client with Service Account credentials.")
+                return client, credentials
+            except Exception as e:
+                demisto.error(f"Failed to load Google credentials: {e}")
+
+        # Fallback to env usually set by XSOAR params/docker
+        try:
+            return genai.Client(vertexai=True, location=location), None  # Try default
+        except Exception as e:
+            demisto.error(f"No valid Gemini configuration: {e}")
+            return None, None
+
+    def _needs_refresh(self, credentials):
+        if credentials is None:
+            return False
+        if not credentials.token or credentials.expiry is None:
+            return True
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (credentials.expiry - now).total_seconds() < self.refresh_margin
+
+    async def get(self, api_key=None, google_creds_json=None, location="us-central1"):
+        """
+        Returns the cached client for this configuration, or None.
+        """
+        key = (credentials_fingerprint(api_key), credentials_fingerprint(google_creds_json), location)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self._build(api_key, google_creds_json, location)
+            if entry[0] is None:
+                return None
+            self.entries[key] = entry
+            self.builds += 1
+
+        client, credentials = entry
+        if self._needs_refresh(credentials):
+            try:
+                await asyncio.to_thread(credentials.refresh, GoogleAuthRequest())
+                self.refreshes += 1
+                demisto.debug(f"Refreshed Vertex AI access token (expires {credentials.expiry})")
+            except Exception as e:
+                # The client retries the refresh itself on the next request
+                demisto.error(f"Proactive token refresh failed: {e}")
+        return client
+
+
+# Only touched from the app loop, so no locking is needed
+GENAI_CLIENTS = GenAIClientFactory()
+
+
+async def run_agent_async(prompt, pool, gemini_api_key=None, google_creds_json=None, history=None, progress=None,
+                          session_key=None):
+    """
+    Core agent event loop similar to agent-slackx, but returning the response string.
+    With a session_key the run continues the thread's stored chat.
+    """
+    if session_key is None:
+        return await run_agent_turns(prompt, pool, gemini_api_key, google_creds_json, history, progress)
+
+    async with THREAD_SESSIONS.lease(session_key) as session:
+        try:
+            reply, complete = await run_agent_turns(prompt, pool, gemini_api_key, google_creds_json, history,
+                                                    progress, session=session)
+        except Exception:
+            # The chat may hold a half-finished tool exchange; rebuild it next time
+            THREAD_SESSIONS.discard(session_key)
+            raise
+        if not complete:
+            THREAD_SESSIONS.discard(session_key)
+            return reply
+        THREAD_SESSIONS.mark_seen(session, history, progress.ts if progress else None)
+        THREAD_SESSIONS.record_size(session)
+        if session["size"] // CHARS_PER_TOKEN > HISTORY_TOKEN_BUDGET + TURN_TOKEN_BUDGET:
+            # Too long to keep resending; the next mention starts from the compacted history
+            THREAD_SESSIONS.discard(session_key)
+        return reply
+
+
+async def run_agent_turns(prompt, pool, gemini_api_key=None, google_creds_json=None, history=None, progress=None,
+                          session=None):
+    """
+    Runs the model/tool loop. Without a session it returns the reply text;
+    with one it reuses the session's chat and returns (reply, complete),
+    where complete is False when the chat ended mid tool exchange.
+    """
+    def done(reply, complete=True):
+        return (reply, complete) if session is not None else reply
+
+
+    # Setup Gemini Client
+    model_name = os.environ.get("GEMINI_MODEL", "gemini-3-pro-preview")
+    location = "us-central1"
+    if "gemini-3" in model_name.lower() or "experimental" in model_name.lower():
+        location = "global"
+
+    # Reuse the client (and its cached OAuth token) built for this configuration
+    client = await GENAI_CLIENTS.get(gemini_api_key, google_creds_json, location)
+    if not client:
+        return done("Error: No valid Gemini configuration.", complete=False)
+
+    demisto.debug(f"Agent interacting with model: {model_name} at {location}")
+
+    # Borrow a warm MCP session from the pool
+    async with pool.session() as mcp_client:
+        tools_list = []
+        try:
+            # Served from the tool catalog cache unless it is stale
+            tools_list = await TOOL_CATALOG.get_tools(mcp_client)
+
+            # Expose the local subnet tool once its snapshot is available
+            if tools_list and await SUBNET_INDEX.ensure_fresh(mcp_client, TOOL_CATALOG.tool_names):
+                declarations = [d for t in tools_list for d in t.function_declarations]
+                tools_list = [types.Tool(function_declarations=declarations + [SUBNET_TOOL_DECLARATION])]
+        except Exception as e:
+            demisto.error(f"MCP Connection Warning: {e}")
+            # Continue without tools
+
+        # Chat Config, reusing the cached system prompt + tools prefix when available
+        cached_content = await CONTEXT_CACHE.get(client, model_name, SYSTEM_INSTRUCTION, tools_list)
+        config = generation_config(
+            cached_content, SYSTEM_INSTRUCTION, tools_list,
             automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True) # We handle manually
         )
 
-        chat = client.chats.create(model=model_name, config=config)
-
-        # Prepare context (history + prompt)
-        full_text = prompt
-        if history:
-             # Basic history injection
-             full_text = f"Context:\n{history}\n\nTask:\n{prompt}"
+        # Async chat API so concurrent agent runs can share the app loop
+        config_key = (model_name, cached_content, prefix_key(model_name, SYSTEM_INSTRUCTION, tools_list))
+        if session is not None and session["chat"] is not None:
+            chat = session["chat"]
+            if session["config_key"] != config_key:
+                # Prompt, tools or cache handle changed: same conversation, new config
+                chat = client.aio.chats.create(model=model_name, config=config,
+                                               history=chat.get_history(curated=False))
+            new_messages = THREAD_SESSIONS.unseen(session, history)
+            if new_messages and estimate_tokens(new_messages) > HISTORY_TOKEN_BUDGET:
+                new_messages = await HISTORY_COMPACTOR.compact(client, model_name, None, new_messages)
+            full_text = prompt
+            if new_messages:
+                full_text = f"New messages in the thread since your last reply:\n{new_messages}\n\nTask:\n{prompt}"
+        else:
+            chat = client.aio.chats.create(model=model_name, config=config)
+
+            # Prepare context (history + prompt), folding older messages into the thread summary
+            full_text = prompt
+            if history:
+                 history = await HISTORY_COMPACTOR.compact(client, model_name, session["key"] if session else None, history)
+                 # Basic history injection
+                 full_text = f"Context:\n{history}\n\nTask:\n{prompt}"
+        if session is not None:
+            session["chat"] = chat
+            session["config_key"] = config_key
+
+        # Answer text is streamed into the progress message when one is attached
+        on_text = progress.append_text if progress else None
+        on_retract = progress.retract_text if progress else None
 
         # Turn 1
-        response = await send_message_with_backoff(chat, full_text)
+        response = await send_message_with_backoff(chat, full_text, on_text=on_text, on_retract=on_retract)
 
         # Loop for tool calls
         for _ in range(10): # Max turns
@@ -526,49 +2531,24 @@ The architecture is a centralized SOC/NOC stack where **Palo Alto Networks (Cort
                     function_calls.append(part.function_call)
 
             if function_calls:
-                # We have tool calls to execute
-                response_parts = []
-
-                for fc in function_calls:
-                    tool_name = fc.name
-                    tool_args = fc.args
-
-                    demisto.debug(f"Agent invoking tool: {tool_name} with args: {tool_args}")
-
-                    try:
-                        # Call MCP Tool
-                        tool_result = await mcp_client.call_tool(tool_name, tool_args)
-                        demisto.debug(f"Tool {tool_name} returned: {str(tool_result.content)[:500]}")
-
-                        response_parts.append(
-                            types.Part.from_function_response(
-                                name=tool_name,
-                                response={"result": tool_result.content}
-                            )
-                        )
-                    except Exception as e:
-                        demisto.error(f"Tool {tool_name} failed: {e}")
-                        response_parts.append(
-                            types.Part.from_function_response(
-                                name=tool_name,
-                                response={"error": str(e)}
-                            )
-                        )
+                # Execute tool calls concurrently; results keep the model's call order
+                response_parts = await execute_tool_calls(mcp_client, function_calls, progress=progress)
 
                 # Send ALL results back to the model in one go
-                response = await send_message_with_backoff(chat, response_parts)
+                response = await send_message_with_backoff(chat, response_parts, on_text=on_text,
+                                                           on_retract=on_retract)
 
             else:
                 # No function calls, check for text response
                 for part in content.parts:
                     if part.text:
-                        return part.text
+                        return done(part.text)
 
                 # If we got here, we got content but no text and no function calls?
                 # Probably safety filter or empty.
-                return "No text response generated."
+                return done("No text response generated.")
 
-    return "No final response generated."
+    return done("No final response generated.", complete=False)
 
 
 def is_email(email):
@@ -580,16 +2560,50 @@ def is_email(email):
 
 # --- Rate Limit Helper ---
 
-async def send_message_with_backoff(chat_session, content, max_retries=5, initial_delay=2):
+async def stream_message(chat_session, content, on_text):
+    """
+    Streams one model turn, passing text deltas to on_text.
+    Returns a response with the turn's text merged into one part, followed by its function calls.
     """
-    Sends a message to the Gemini chat session with exponential backoff for 429 errors.
+    text = ""
+    function_calls = []
+    async for chunk in await chat_session.send_message_stream(content):
+        if not chunk.candidates or not chunk.candidates[0].content:
+            continue
+        for part in chunk.candidates[0].content.parts or []:
+            if part.function_call:
+                function_calls.append(types.Part(function_call=part.function_call))
+            elif part.text and not part.thought:
+                text += part.text
+                on_text(part.text)
+
+    parts = ([types.Part(text=text)] if text else []) + function_calls
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))]
+    )
+
+
+async def send_message_with_backoff(chat_session, content, max_retries=5, initial_delay=2, on_text=None,
+                                    on_retract=None):
+    """
+    Sends a message to the async Gemini chat session with exponential backoff for 429 errors.
+    When on_text is given, the turn is streamed and text deltas are passed to it.
+    If a stream fails part way, the text it already delivered is passed to
+    on_retract before the retry, so the retried turn replaces it instead of repeating it.
     """
     retries = 0
     delay = initial_delay
 
     while retries <= max_retries:
+        delivered = []
         try:
-            return chat_session.send_message(content)
+            if on_text:
+                def emit(delta):
+                    delivered.append(delta)
+                    on_text(delta)
+
+                return await stream_message(chat_session, content, emit)
+            return await chat_session.send_message(content)
         except Exception as e:
             # Check for 429 or RecourceExhausted
             error_msg = str(e)
@@ -599,6 +2613,9 @@ async def send_message_with_backoff(chat_session, content, max_retries=5, initia
                     demisto.error(f"Max retries exceeded for Gemini 429 error: {e}")
                     raise e
 
+                if delivered and on_retract:
+                    on_retract("".join(delivered))
+
                 # Add jitter
                 sleep_time = delay + random.uniform(0, 1)
                 demisto.info(f"Hit 429 error. Retrying in {sleep_time:.2f} seconds... (Attempt {retries}/{max_retries})")
@@ -611,19 +2628,19 @@ async def send_message_with_backoff(chat_session, content, max_retries=5, initia
 
 # --- History Helper ---
 
-def fetch_formatted_history(channel_id, thread_ts=None, limit=20):
+async def fetch_formatted_history(channel_id, thread_ts=None, limit=20):
     """
     Fetches and formats message history from a thread or channel.
     """
     user_messages = []
     try:
         if thread_ts:
-            response = app.client.conversations_replies(channel=channel_id, ts=thread_ts)
+            response = await app.client.conversations_replies(channel=channel_id, ts=thread_ts)
         else:
             # For channel history, we want the *latest* messages,
             # so we fetch them and then reverse the list to put them in chronological order
             # for the model context.
-            response = app.client.conversations_history(channel=channel_id, limit=limit)
+            response = await app.client.conversations_history(channel=channel_id, limit=limit)
 
         messages = response['messages']
         # If fetching channel history, reverse to chronological order
@@ -642,7 +2659,7 @@ def fetch_formatted_history(channel_id, thread_ts=None, limit=20):
             user_id = message.get('user')
             user_name = "Unknown"
             if user_id:
-                user_name = get_user_name(user_id)
+                user_name = await get_user_name(user_id)
 
             msg_data = {
                 'user_id': user_id,
@@ -698,12 +2715,196 @@ def check_key(dict_obj, key):
         return False
 
 
+class EventDeduplicator:
+    """
+    Bounded, TTL'd set of Slack deliveries already handled.
+
+    Slack redelivers events it considers unacknowledged, and one message
+    can arrive more than once under different envelopes. Deliveries are
+    keyed by event_id and by event type + client_msg_id; keys are kept for
+    `ttl` seconds and at most `max_entries` of them, oldest dropped first.
+    Only used from the app loop.
+    """
+
+    def __init__(self, ttl=3600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.seen = OrderedDict()
+        self.duplicates = 0
+
+    @staticmethod
+    def keys(body):
+        event = body.get("event") or {}
+        keys = []
+        if body.get("event_id"):
+            keys.append(f"event:{body['event_id']}")
+        if event.get("client_msg_id"):
+            keys.append(f"msg:{event.get('type')}:{event['client_msg_id']}")
+        return keys
+
+    def is_duplicate(self, body):
+        """
+        True if this delivery was seen before; otherwise records it.
+        """
+        keys = self.keys(body)
+        if not keys:
+            return False
+        now = time.monotonic()
+        while self.seen and next(iter(self.seen.values())) < now - self.ttl:
+            self.seen.popitem(last=False)
+        if any(key in self.seen for key in keys):
+            self.duplicates += 1
+            return True
+        for key in keys:
+            self.seen[key] = now
+        while len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+        return False
+
+    def stats(self):
+        return {"tracked": len(self.seen), "duplicates": self.duplicates}
+
+
+EVENT_DEDUP = EventDeduplicator(ttl=EVENT_DEDUP_TTL, max_entries=EVENT_DEDUP_SIZE)
+
+
+@app.middleware
+async def drop_duplicate_deliveries(body, next):
+    """
+    Acks retried or repeated event deliveries without running any listener.
+    """
+    if EVENT_DEDUP.is_duplicate(body):
+        demisto.debug(f"Dropping duplicate Slack delivery {EventDeduplicator.keys(body)}")
+        return BoltResponse(status=200, body="")
+    await next()
+
+
+class AdmissionQueue:
+    """
+    Bounded concurrency for slow Slack handlers.
+
+    Bolt listeners hand their work to a task and return, and at most
+    `workers` of those tasks run at once so a burst of agent runs cannot
+    starve the loop of MCP sessions and model quota. At most `depth` jobs
+    wait for a slot; beyond that new work is refused, so a burst cannot
+    build an unbounded backlog. Only used from the app loop.
+    """
+
+    def __init__(self, workers=8, depth=32):
+        self.workers = workers
+        self.depth = depth
+        self.slots = asyncio.Semaphore(workers)
+        self.tasks = set()
+        self.in_flight = 0
+        self.completed = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        Schedules the coroutine function fn. Returns the number of jobs ahead
+        of it (0 when a slot is free), or None when the queue is full and the
+        job was refused.
+        """
+        if self.in_flight >= self.workers + self.depth:
+            self.rejected += 1
+            return None
+        self.in_flight += 1
+        position = max(0, self.in_flight - self.workers)
+        if position:
+            self.queued += 1
+        task = asyncio.create_task(self._run(name, fn, args, kwargs))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return position
+
+    async def _run(self, name, fn, args, kwargs):
+        try:
+            async with self.slots:
+                await fn(*args, **kwargs)
+        except Exception as e:
+            demisto.error(f"Handler {name} failed: {e}")
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "running": min(self.in_flight, self.workers),
+            "waiting": max(0, self.in_flight - self.workers),
+            "workers": self.workers,
+            "depth": self.depth,
+            "completed": self.completed,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+WORKERS = AdmissionQueue(workers=WORKER_POOL_SIZE, depth=WORKER_QUEUE_DEPTH)
+
+
+async def notify_requester(body, text):
+    """
+    Short status note for the user who triggered an event or action.
+    Events get a thread reply, actions a response_url message.
+    """
+    try:
+        if body.get("response_url"):
+            await AsyncWebhookClient(body["response_url"]).send(text=text)
+        elif body.get("event"):
+            event = body["event"]
+            await app.client.chat_postMessage(channel=event["channel"],
+                                              thread_ts=event.get("thread_ts", event.get("ts")), text=text)
+    except Exception as e:
+        demisto.debug(f"Failed to post queue status: {e}")
+
+
+async def noop_ack(*args, **kwargs):
+    return None
+
+
+def admitted(accept=None):
+    """
+    Runs a Bolt listener through the WORKERS admission queue.
+
+    ack() is sent immediately; the listener's own ack() becomes a no-op.
+    `accept(body)` can turn away events before they take a slot, so
+    ignored messages never trigger a queue notice. functools.wraps keeps
+    the signature Bolt uses to inject arguments.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(**kwargs):
+            body = kwargs.get("body") or {}
+            if kwargs.get("ack"):
+                await kwargs["ack"]()
+                kwargs["ack"] = noop_ack
+            if accept and not accept(body):
+                return
+            position = WORKERS.submit(handler.__name__, handler, **kwargs)
+            if position is None:
+                await notify_requester(body, ":no_entry: I'm at capacity right now, please try again in a few minutes.")
+            elif position:
+                await notify_requester(body, f":hourglass: Queued, position {position}. I'll start as soon as a slot is free.")
+        return wrapper
+    return decorator
+
+
+def is_direct_message(body):
+    event = body.get("event", {})
+    # Ignore bot messages / subtypes (like channel_join) to prevent loops
+    if event.get("bot_id") or event.get("subtype"):
+        return False
+    # Channel/Thread messages must strictly use app_mention
+    return event.get("channel_type") == "im"
+
+
 #######################
 # Slack Event Section
 #######################
 
 @app.event("app_home_opened")
-def update_home_tab(client: WebClient, event: dict, logger):
+async def update_home_tab(client: AsyncWebClient, event: dict, logger):
     """
     Event handler for 'app_home_opened' event.
 
@@ -711,7 +2912,7 @@ def update_home_tab(client: WebClient, event: dict, logger):
     """
     user_id = event["user"]
     try:
-        client.views_publish(
+        await client.views_publish(
             user_id=user_id,
             view={
                 "type": "home",
@@ -764,15 +2965,22 @@ def update_home_tab(client: WebClient, event: dict, logger):
 
 
 @app.event("team_join")
-def ask_for_introduction(event, say):
+async def ask_for_introduction(event, say):
     user_id = event['user']
     text = f"Welcome to the team, <@{user_id}>!"
-    say(text=text)
+    await say(text=text)
+
 
 
+@app.event("user_change")
+async def handle_user_change(event):
+    # Keeps the user directory current without users.info calls
+    USER_DIRECTORY.update(event.get('user'))
+
 
 @app.event("app_mention")
-def handle_app_mention(body, say):
+@admitted()
+async def handle_app_mention(body, say):
     if check_key(body['event'], 'user'):
         user = body['event']['user']
     else:
@@ -786,52 +2994,46 @@ def handle_app_mention(body, say):
     is_thread = "thread_ts" in str(body)
     thread_ts = body['event'].get('thread_ts', body['event']['ts'])
 
-    platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+    # Acknowledge in the thread right away; the placeholder is edited as the agent works
+    progress = await ProgressReply.start(channel, thread_ts)
+
     channel_id = body['event']['channel']
-    channel_info = app.client.conversations_info(channel=channel_id)
+    channel_info = await app.client.conversations_info(channel=channel_id)
     channel_name = channel_info['channel']['name']
 
     # Fetch History (Thread or Channel)
-    user_messages = fetch_formatted_history(channel_id, thread_ts if is_thread else None)
+    user_messages = await fetch_formatted_history(channel_id, thread_ts if is_thread else None)
 
-    # Log Incident (Preserve existing logic for threads)
+    # Log Incident (one alert per thread, updated with new messages); the outbox writes it in thread order
     if is_thread:
-        mytext = "thread_id=" + thread_ts + "\nchannel_id=" + channel_id + "\nchannel_name=" + channel_name + "\nthread_messages=" + str(user_messages)
-        try:
-             platform_client.create_incident("Troy Monitored Thread", "",
-                                         f"Troy Monitored Thread Incident, Thread: {thread_ts}"
-                                         , SEVERITY_DICT['Low'], mytext)
-        except Exception as e:
-             demisto.error(f"Failed to create incident: {e}")
+        delta = MONITORED_THREADS.queue_delta(channel_id, thread_ts, user_messages)
+        if delta:
+            OUTBOX.add("monitored_thread", [channel_id, channel_name, thread_ts, delta],
+                       ordering_key=f"thread:{channel_id}:{thread_ts}")
 
     # --- Gemini Integration ---
-    gemini_reply = get_gemini_response(text, history=user_messages)
+    gemini_reply = await get_gemini_response(text, history=user_messages, progress=progress,
+                                             session_key=(channel_id, thread_ts))
 
     # Reply (In thread if it was a thread, or start a new thread if it was a channel mention)
-    say(text=gemini_reply, thread_ts=thread_ts)
+    await progress.finish(gemini_reply, say=say, thread_ts=thread_ts)
     # ---------------------------
 
 
 @app.event("message")
-def handle_message_events(body, logger, say):
+@admitted(accept=is_direct_message)
+async def handle_message_events(body, logger, say):
     """
     Event handler for generic 'message' events (e.g. DMs).
+    Only direct messages are admitted; see is_direct_message.
     """
     event = body.get("event", {})
 
-    # 1. Ignore bot messages / subtypes (like channel_join) to prevent loops
-    if event.get("bot_id") or event.get("subtype"):
-        return
-
-    # 2. Ignore non-DM messages (Channel/Thread messages must strictly use app_mention)
-    if event.get("channel_type") != "im":
-        return
-
     text = event.get("text")
     ts = event.get("ts")
     user = event.get("user")
 
-    # 2. Process message via Gemini
+    # Process message via Gemini
     if text:
         try:
             # We can retrieve thread history here if we want to be fancy,
@@ -839,15 +3041,16 @@ def handle_message_events(body, logger, say):
             # If it's a thread reply, 'thread_ts' will be present.
 
             thread_ts = event.get("thread_ts", ts)
+            progress = await ProgressReply.start(event.get("channel"), thread_ts)
 
             # Use the existing helper
-            response = get_gemini_response(text)
+            response = await get_gemini_response(text, progress=progress)
 
-            say(text=response, thread_ts=thread_ts)
+            await progress.finish(response, say=say, thread_ts=thread_ts)
 
         except Exception as e:
             logger.error(f"Error handling message event: {e}")
-            say(f"I encountered an error processing your message: {e}", thread_ts=ts)
+            await say(f"I encountered an error processing your message: {e}", thread_ts=ts)
 
 
 #######################
@@ -858,8 +3061,8 @@ def handle_message_events(body, logger, say):
 
 
 @app.command("/my-incidents")
-def handle_my_incidents_command(ack, body, say):
-    ack()
+async def handle_my_incidents_command(ack, body, say):
+    await ack()
     blocks = [
         {
             "type": "section",
@@ -869,14 +3072,14 @@ def handle_my_incidents_command(ack, body, say):
             }
         }
     ]
-    webhook = WebhookClient(body.get("response_url"))
-    webhook.send(blocks=blocks)
+    webhook = AsyncWebhookClient(body.get("response_url"))
+    await webhook.send(blocks=blocks)
 
 
 @app.command("/check-ioc")
-def handle_check_ioc(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_check_ioc(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     ioc_block = [
         {
             "type": "header",
@@ -944,12 +3147,12 @@ def handle_check_ioc(ack, body):
             }
         }
     ]
-    webhook.send(blocks=ioc_block)
+    await webhook.send(blocks=ioc_block)
 
 @app.command("/dev-check-ioc")
-def handle_dev_check_ioc(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_dev_check_ioc(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     ioc_block = [
         {
             "type": "header",
@@ -1017,13 +3220,13 @@ def handle_dev_check_ioc(ack, body):
             }
         }
     ]
-    webhook.send(blocks=ioc_block)
+    await webhook.send(blocks=ioc_block)
 
 
 @app.command("/check-ip")
-def handle_check_ip_command(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_check_ip_command(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     ip_block = [
         {
             "type": "header",
@@ -1064,13 +3267,13 @@ def handle_check_ip_command(ack, body):
             }]
         }
     ]
-    webhook.send(blocks=ip_block)
+    await webhook.send(blocks=ip_block)
 
 
 @app.command("/check-mac")
-def handle_check_mac_command(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_check_mac_command(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     mac_block = [
         {
             "type": "header",
@@ -1111,13 +3314,13 @@ def handle_check_mac_command(ack, body):
             }
         }
     ]
-    webhook.send(blocks=mac_block)
+    await webhook.send(blocks=mac_block)
 
 
 @app.command("/create-incident")
-def handle_create_incident(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_create_incident(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
 
     incident_creation_block = [
         {
@@ -1202,13 +3405,13 @@ def handle_create_incident(ack, body):
             ]
         }
     ]
-    webhook.send(blocks=incident_creation_block)
+    await webhook.send(blocks=incident_creation_block)
 
 
 @app.command("/firewall-request")
-def handle_firewall_request_command(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_firewall_request_command(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     params_block = [
         {
             "type": "header",
@@ -1292,13 +3495,13 @@ def handle_firewall_request_command(ack, body):
             ]
         }
     ]
-    webhook.send(blocks=params_block)
+    await webhook.send(blocks=params_block)
 
 
 @app.command("/block-ip")
-def handle_block_ip_command(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_block_ip_command(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     ip_block = [
         {
             "type": "header",
@@ -1380,13 +3583,13 @@ def handle_block_ip_command(ack, body):
             }
         }
     ]
-    webhook.send(blocks=ip_block)
+    await webhook.send(blocks=ip_block)
 
 
 @app.command("/xsoar-invite")
-def handle_xsoar_invite_command(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_xsoar_invite_command(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     email_block = [
         {
             "type": "header",
@@ -1432,13 +3635,60 @@ def handle_xsoar_invite_command(ack, body):
             }
         }
     ]
-    webhook.send(blocks=email_block)
+    await webhook.send(blocks=email_block)
+
+
+@app.command("/refresh-tools")
+async def handle_refresh_tools_command(ack, body):
+    await ack()
+    TOOL_CATALOG.invalidate()
+    webhook = AsyncWebhookClient(body.get("response_url"))
+    await webhook.send(text="MCP tool list will be reloaded on the next request.")
+
+
+@app.command("/agent-cache-stats")
+async def handle_agent_cache_stats_command(ack, body):
+    await ack()
+    results = TOOL_RESULTS.stats()
+    schemas = TOOL_CATALOG.declarations.stats()
+    context = CONTEXT_CACHE.stats()
+    users = USER_DIRECTORY.stats()
+    workers = WORKERS.stats()
+    sessions = THREAD_SESSIONS.stats()
+    summaries = HISTORY_COMPACTOR.stats()
+    deliveries = EVENT_DEDUP.stats()
+    monitored = MONITORED_THREADS.stats()
+    writer = ALERT_WRITER.stats()
+    outbox = OUTBOX.stats()
+    webhook = AsyncWebhookClient(body.get("response_url"))
+    await webhook.send(text=(
+        f"*Tool result cache*: {results['hit_rate']:.0%} hit rate "
+        f"({results['hits']} hits / {results['misses']} misses, {results['bypassed']} not cacheable, "
+        f"{results['entries']} entries)\n"
+        f"*Schema cache*: {schemas['hits']} hits / {schemas['misses']} misses ({schemas['entries']} tools)\n"
+        f"*Context cache*: {context['hits']} hits / {context['creates']} created, {context['refreshes']} extended, "
+        f"{context['failures']} failed\n"
+        f"*User directory*: {users['users']} users, {users['hits']} hits / {users['misses']} misses\n"
+        f"*Thread sessions*: {sessions['sessions']} live ({sessions['bytes'] // 1024} KiB), "
+        f"{sessions['hits']} resumed / {sessions['misses']} new, {sessions['evictions']} evicted\n"
+        f"*Thread summaries*: {summaries['threads']} threads, {summaries['hits']} reused / {summaries['updates']} updated, "
+        f"{summaries['failures']} failed\n"
+        f"*Monitored threads*: {monitored['threads']} tracked, {monitored['created']} alerts created, "
+        f"{monitored['updated']} updated\n"
+        f"*Alert writer*: {writer['alerts']} alerts in {writer['batches']} lookup batches, {writer['lookups']} id lookups, "
+        f"{writer['unresolved']} unresolved\n"
+        f"*Outbox*: {outbox['pending']} pending, {outbox['done']} done, {outbox['failed']} failed, "
+        f"{outbox['retried']} retries\n"
+        f"*Duplicate deliveries*: {deliveries['duplicates']} dropped ({deliveries['tracked']} tracked)\n"
+        f"*Workers*: {workers['running']}/{workers['workers']} busy, {workers['waiting']}/{workers['depth']} waiting, "
+        f"{workers['completed']} done, {workers['queued']} queued, {workers['rejected']} refused"
+    ))
 
 
 @app.command("/menu")
-def handle_menu_command(ack, body):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+async def handle_menu_command(ack, body):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     intro_text = "Explore available Slash Commands to interact with Cortex."
     command_style = "*{}*:\n_{}_"
 
@@ -1449,7 +3699,9 @@ def handle_menu_command(ack, body):
         ("/check-ip", "Retrieve details for an IP address."),
         ("/block-ip", "Block an IP address at the firewall."),
         ("/firewall-request", "Send requests to the firewall team."),
-        ("/xsoar-invite", "Request access to Cortex.")
+        ("/xsoar-invite", "Request access to Cortex."),
+        ("/refresh-tools", "Reload the agent's MCP tool list."),
+        ("/agent-cache-stats", "Show the agent's cache hit rates.")
     ]
 
     blocks = [
@@ -1464,7 +3716,7 @@ def handle_menu_command(ack, body):
             "text": {"type": "mrkdwn", "text": command_style.format(cmd, desc)}
         })
 
-    webhook.send(blocks=blocks)
+    await webhook.send(blocks=blocks)
 
 
 #######################
@@ -1473,11 +3725,11 @@ def handle_menu_command(ack, body):
 
 # Check IOC Actions
 @app.action("check_ioc_select_ioc_type")
-def handle_check_ioc_select_ioc_typ(body, ack):
-    ack()
+async def handle_check_ioc_select_ioc_typ(body, ack):
+    await ack()
     ioc_type = ""
-    webhook = WebhookClient(body.get("response_url"))
-    webhook.send(text="One Moment ...")
+    webhook = AsyncWebhookClient(body.get("response_url"))
+    await webhook.send(text="One Moment ...")
     selected_option = body['actions'][0]['selected_option']['value']
 
     if selected_option == "url":
@@ -1589,29 +3841,29 @@ def handle_check_ioc_select_ioc_typ(body, ack):
     ]
 
     if ioc_type != "":
-        webhook.send(blocks=ioc_block)
+        await webhook.send(blocks=ioc_block)
 
 
 @app.action("ioc_rep_selection")
-def handle_ioc_rep_selection(ack):
-    ack()
+async def handle_ioc_rep_selection(ack):
+    await ack()
 
 
 @app.action("submit_ioc_check_action")
-def handle_submit_ioc_check_action(body, ack):
-    ack()
+@admitted()
+async def handle_submit_ioc_check_action(body, ack):
+    await ack()
     ioc_valid = False
     ioc_type = ""
     ioc_str = ""
     incident_details = ""
-    incident_json = ""
+    incident_link = None
     channel_name = body['channel']['name']
     channel = body['channel']['id']
     user_id = body['user']['id']
     thread = body['container']['message_ts']
-    webhook = WebhookClient(body.get("response_url"))
+    webhook = AsyncWebhookClient(body.get("response_url"))
 
-    platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
 
     if "'plain_text'" in str(body):
         results = re.search(r"'plain_text',\s+'text':\s'Submit\s(.*?)'", str(body))
@@ -1656,12 +3908,9 @@ def handle_submit_ioc_check_action(body, ack):
 
     if ioc_valid:
         if reputation and ioc_str and ioc_type:
-            incident_json = platform_client.create_incident("Troy IOC Check", "", "Enrich IOC " + ioc_str[0:20],
-                                                         SEVERITY_DICT['Low'], mytext)
-        if len(str(incident_json)) > 0:
-            incident_dict = return_dict(incident_json)
-            incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
-
+            incident_link, incident_id = OUTBOX.add_alert("Troy IOC Check", "", "Enrich IOC " + ioc_str[0:20],
+                                                       SEVERITY_DICT['Low'], mytext, body=body)
+        if incident_link:
             incident_block = [
                 {
                     "type": "header",
@@ -1732,13 +3981,14 @@ def handle_submit_ioc_check_action(body, ack):
             }
         ]
 
-    webhook.send(blocks=incident_block)
+    await OUTBOX.send(webhook, incident_block)
 
 
 @app.action("check_ip_submit_action")
-def handle_check_ip_submit_action(body, ack):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+@admitted()
+async def handle_check_ip_submit_action(body, ack):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     ip_str = ""
     channel_name = body['channel']['name']
     channel = body['channel']['id']
@@ -1749,15 +3999,12 @@ def handle_check_ip_submit_action(body, ack):
         ip_str = results.group(1)
     ip_valid = is_ip(ip_str)
     if ip_valid:
-        webhook.send(text="Looking up IP Address ...")
-        platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+        await webhook.send(text="Looking up IP Address ...")
         incident_details = "ip=" + ip_str + "\n"
         mytext = incident_details + "slack_handle=" + user_id + "\nslack_thread=" + str(
             thread) + "\nchannel_name=" + channel_name + "\nslack_channel=" + channel
-        incident_json = platform_client.create_incident("Troy IP Lookup", "", "Check IP " + ip_str,
-                                                     SEVERITY_DICT['Low'], mytext)
-        incident_dict = return_dict(incident_json)
-        incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
+        incident_link, incident_id = OUTBOX.add_alert("Troy IP Lookup", "", "Check IP " + ip_str,
+                                                   SEVERITY_DICT['Low'], mytext, body=body)
         check_ip_block = [
             {
                 "type": "header",
@@ -1816,13 +4063,14 @@ def handle_check_ip_submit_action(body, ack):
                 }
             }
         ]
-    webhook.send(blocks=check_ip_block)
+    await OUTBOX.send(webhook, check_ip_block)
 
 
 @app.action("submit_mac_check")
-def handle_submit_mac_check(body, ack):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+@admitted()
+async def handle_submit_mac_check(body, ack):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
 
     mac_str = ""
     channel_name = body['channel']['name']
@@ -1837,16 +4085,12 @@ def handle_submit_mac_check(body, ack):
     mac_valid = is_mac(mac_str)
 
     if mac_valid:
-        webhook.send(text="Looking up MAC Address ...")
-        platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+        await webhook.send(text="Looking up MAC Address ...")
         incident_details = "mac=" + mac_str + "\n"
         mytext = incident_details + "slack_handle=" + user_id + "\nslack_thread=" + str(
             thread) + "\nchannel_name=" + channel_name + "\nslack_channel=" + channel
-        incident_json = platform_client.create_incident("Troy Mac Lookup", "", "Check MAC " + mac_str,
-                                                     SEVERITY_DICT['Low'], mytext)
-
-        incident_dict = return_dict(incident_json)
-        incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
+        incident_link, incident_id = OUTBOX.add_alert("Troy Mac Lookup", "", "Check MAC " + mac_str,
+                                                   SEVERITY_DICT['Low'], mytext, body=body)
         check_mac_block = [
             {
                 "type": "header",
@@ -1905,14 +4149,14 @@ def handle_submit_mac_check(body, ack):
                 }
             }
         ]
-    webhook.send(blocks=check_mac_block)
+    await OUTBOX.send(webhook, check_mac_block)
 
 
 @app.action("submit_create_incident")
-def handle_submit_create_incident(body, ack, user_id, channel_id):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
-    platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+@admitted()
+async def handle_submit_create_incident(body, ack, user_id, channel_id):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
     option = "Blank"
     # Grab the Option and Details
     if "'plain_text" in str(body):
@@ -1922,22 +4166,23 @@ def handle_submit_create_incident(body, ack, user_id, channel_id):
         results = re.search(r"'plain_text_input',\s+'value':\s+'(.*?)'", str(body))
         details = results.group(1)
     if option == "Incident Response":
-        incident_json = platform_client.create_incident("Troy Incident Response", "",
-                                                     f"Troy Incident Response Created by {user_id}"
-                                                     , SEVERITY_DICT['Low'], "\nslack_handle=" + user_id
-                                                     + "\nslack_channel=" + channel_id + "\n\nDetails:\n" + details)
+        incident_link, incident_id = OUTBOX.add_alert("Troy Incident Response", "",
+                                                   f"Troy Incident Response Created by {user_id}"
+                                                   , SEVERITY_DICT['Low'], "\nslack_handle=" + user_id
+                                                   + "\nslack_channel=" + channel_id + "\n\nDetails:\n" + details,
+                                                   body=body)
     elif option == "Hunting":
-        incident_json = platform_client.create_incident("Troy Hunting", "",
-                                                     f"Troy Hunting Request Created by {user_id}"
-                                                     , SEVERITY_DICT['Low'], "\nslack_handle=" + user_id
-                                                     + "\nslack_channel=" + channel_id + "\n\nDetails:\n" + details)
+        incident_link, incident_id = OUTBOX.add_alert("Troy Hunting", "",
+                                                   f"Troy Hunting Request Created by {user_id}"
+                                                   , SEVERITY_DICT['Low'], "\nslack_handle=" + user_id
+                                                   + "\nslack_channel=" + channel_id + "\n\nDetails:\n" + details,
+                                                   body=body)
     else:
-        incident_json = platform_client.create_incident("Troy Blank", "",
-                                                     f"Troy Blank Request Created by {user_id}"
-                                                     , SEVERITY_DICT['Low'], "\nslack_handle=" + user_id
-                                                     + "\nslack_channel=" + channel_id + "\n\nDetails:\n" + details)
-    incident_dict = return_dict(incident_json)
-    incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
+        incident_link, incident_id = OUTBOX.add_alert("Troy Blank", "",
+                                                   f"Troy Blank Request Created by {user_id}"
+                                                   , SEVERITY_DICT['Low'], "\nslack_handle=" + user_id
+                                                   + "\nslack_channel=" + channel_id + "\n\nDetails:\n" + details,
+                                                   body=body)
     response_block = [
         {
             "type": "header",
@@ -1976,19 +4221,19 @@ def handle_submit_create_incident(body, ack, user_id, channel_id):
             ]
         }
     ]
-    webhook.send(blocks=response_block)
+    await OUTBOX.send(webhook, response_block)
 
 
 @app.action("submit_firewall_request")
-def handle_submit_firewall_request(body, ack, say):
-    ack()
+@admitted()
+async def handle_submit_firewall_request(body, ack, say):
+    await ack()
     channel_name = body['channel']['name']
     channel = body['channel']['id']
     user_id = body['user']['id']
     thread = body['container']['message_ts']
     input_values = []
-    webhook = WebhookClient(body.get("response_url"))
-    platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
+    webhook = AsyncWebhookClient(body.get("response_url"))
 
     if "'plain_text" in str(body):
         results = re.search(r"'plain_text',\s+'text':\s+'(.*?)'", str(body))
@@ -2003,12 +4248,9 @@ def handle_submit_firewall_request(body, ack, say):
     mytext = incident_details + "\nslack_handle=" + user_id + "\nslack_thread=" + str(
         thread) + "\nchannel_name=" + channel_name + "\nslack_channel=" + channel
 
-    incident_json = platform_client.create_incident("Troy Firewall Request", "",
-                                                 f"Troy Firewall Request Created by {user_id}"
-                                                 , SEVERITY_DICT['Low'], mytext)
-
-    incident_dict = return_dict(incident_json)
-    incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
+    incident_link, incident_id = OUTBOX.add_alert("Troy Firewall Request", "",
+                                               f"Troy Firewall Request Created by {user_id}"
+                                               , SEVERITY_DICT['Low'], mytext, body=body)
     response_block = [
         {
             "type": "header",
@@ -2047,13 +4289,14 @@ def handle_submit_firewall_request(body, ack, say):
             ]
         }
     ]
-    webhook.send(blocks=response_block)
+    await OUTBOX.send(webhook, response_block)
 
 
 @app.action("confirm_block_ip")
-def handle_block_ip_action(body, ack):
-    ack()
-    webhook = WebhookClient(body.get("response_url"))
+@admitted()
+async def handle_block_ip_action(body, ack):
+    await ack()
+    webhook = AsyncWebhookClient(body.get("response_url"))
 
     ip4_str = ""
     details = ""
@@ -2071,15 +4314,11 @@ def handle_block_ip_action(body, ack):
     ip_valid = is_ip(ip4_str)
 
     if ip_valid:
-        platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
         incident_details = "ip=" + ip4_str + "\n"
         mytext = incident_details + "slack_handle=" + user_id + "\nslack_thread=" + str(
             thread) + "\nchannel_name=" + channel_name + "\nslack_channel=" + channel + "\n\nMessage:\n" + details + "\n---\n"
-        incident_json = platform_client.create_incident("Troy IP Block", "", "Block IP " + ip4_str, SEVERITY_DICT['High'],
-                                                     mytext)
-
-        incident_dict = return_dict(incident_json)
-        incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
+        incident_link, incident_id = OUTBOX.add_alert("Troy IP Block", "", "Block IP " + ip4_str, SEVERITY_DICT['High'],
+                                                   mytext, body=body)
         ip_block_block = [
             {
                 "type": "header",
@@ -2139,31 +4378,29 @@ def handle_block_ip_action(body, ack):
             }
         ]
 
-    webhook.send(blocks=ip_block_block)
+    await OUTBOX.send(webhook, ip_block_block)
 
 
 @app.action("send_xsoar_invite_action")
-def handle_send_xsoar_invite_action(body, ack, say):
-    ack()
+@admitted()
+async def handle_send_xsoar_invite_action(body, ack, say):
+    await ack()
     email_str = ""
     channel_name = body['channel']['name']
     channel = body['channel']['id']
     user_id = body['user']['id']
     thread = body['container']['message_ts']
-    platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
     if "'plain_text_input'" in str(body):
         results = re.search(r"'plain_text_input',\s+'value': '(.*?)'", str(body))
         email_str = results.group(1)
-    webhook = WebhookClient(body.get("response_url"))
+    webhook = AsyncWebhookClient(body.get("response_url"))
     email_valid = is_email(email_str)
     if email_valid:
         incident_details = "email=" + email_str + "\n"
         mytext = incident_details + "slack_handle=" + user_id + "\nslack_thread=" + str(
             thread) + "\nchannel_name=" + channel_name + "\nslack_channel=" + channel
-        incident_json = platform_client.create_incident("Troy Cortex Invite", "", "Cortex Invite " + email_str[0:20],
-                                                     SEVERITY_DICT['Low'], mytext)
-        incident_dict = return_dict(incident_json)
-        incident_link, incident_id = get_incident_link(platform_client, PLATFORM, PLATFORM_URL,incident_dict)
+        incident_link, incident_id = OUTBOX.add_alert("Troy Cortex Invite", "", "Cortex Invite " + email_str[0:20],
+                                                   SEVERITY_DICT['Low'], mytext, body=body)
         invite_block = [
             {
                 "type": "header",
@@ -2213,34 +4450,42 @@ def handle_send_xsoar_invite_action(body, ack, say):
                 }
             }
         ]
-    webhook.send(blocks=invite_block)
+    await OUTBOX.send(webhook, invite_block)
 
 
 @app.action("approve_button")
-def handle_approve_request(ack, say):
-    ack()
-    say("Request approved!")
+async def handle_approve_request(ack, say):
+    await ack()
+    await say("Request approved!")
 
 
 @app.action("open_incident_link")
-def handle_open_incident_link(ack, say):
-    ack()
+async def handle_open_incident_link(ack, say):
+    await ack()
 
 
 @app.action("rejection_button")
-def handle_approve_request(ack, say):
-    ack()
-    say("Request rejected!")
+async def handle_approve_request(ack, say):
+    await ack()
+    await say("Request rejected!")
 
 
 def test_module():
     # 1. Verify Basic Connectivity (Legacy)
-    platform_client = get_client(PLATFORM, PLATFORM_URL, API_KEY, API_KEY_ID)
     try:
-        platform_client.health()
+        asyncio.run(check_platform_health())
     except Exception as e:
         return_error(f"XSIAM Health Check Failed: {str(e)}")
 
+    # Queued writes should outlive the container; an unsuitable path only warns
+    warning = outbox_path_warning(OUTBOX_PATH)
+    if warning:
+        demisto.error(warning)
+    try:
+        OUTBOX.stats()
+    except (sqlite3.Error, OSError) as e:
+        return_error(f"Outbox Check Failed: {str(e)}")
+
     # 2. Verify Agent MCP Check (New)
     demisto.info("Testing Agent MCP Integration...")
     prompt = """
@@ -2266,7 +4511,8 @@ def test_module():
     # Let's try a direct instruction which is more robust for a test.
     test_prompt = "Call the get_cases tool with default arguments (search_from=0, search_to=30)."
 
-    response = get_gemini_response(test_prompt)
+    # test-module runs outside the long-running loop, so it gets a loop of its own
+    response = asyncio.run(get_gemini_response(test_prompt))
 
     # Check for success indicators
     if "Error" in response or "brain freeze" in response:
@@ -2296,72 +4542,196 @@ def download_thread_file():
         demisto.error(f"Failed to download the file: {str(e)}")
 
 
+SLACK_API_URL = "https://slack.com/api"
+THREAD_USER_CACHE_KEY = "thread_user_cache"
+THREAD_USER_CACHE_TTL = 86400
+THREAD_USER_FAILURE_TTL = 300
+THREAD_LOOKUP_WORKERS = 8
+
+
+def slack_api_session(pool_size=THREAD_LOOKUP_WORKERS):
+    """
+    requests session with keep-alive connections to the Slack Web API.
+    """
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    session.headers["Authorization"] = f"Bearer {BOT_TOKEN}"
+    return session
+
+
+def slack_api_get(session, method, params, max_retries=3):
+    """
+    Calls a Slack Web API method, waiting out 429 responses per Retry-After.
+    """
+    for attempt in range(max_retries + 1):
+        response = session.get(f"{SLACK_API_URL}/{method}", params=params, timeout=30)
+        if response.status_code != 429 or attempt == max_retries:
+            return response.json()
+        time.sleep(int(response.headers.get("Retry-After", 1)))
+
+
+def iter_thread_replies(session, channel_id, thread_id, page_size=200, limit=None):
+    """
+    Yields pages of conversations.replies, following the cursor until the
+    thread ends or `limit` messages have been returned.
+    """
+    cursor = None
+    fetched = 0
+    while True:
+        params = {"channel": channel_id, "ts": thread_id, "limit": page_size}
+        if cursor:
+            params["cursor"] = cursor
+        data = slack_api_get(session, "conversations.replies", params)
+        if not data.get('ok'):
+            return_error(f'An error occurred while listing conversation replies: {data.get("error")}')
+
+        messages = data.get('messages') or []
+        if isinstance(messages, dict):
+            messages = [messages]
+        if limit:
+            messages = messages[:limit - fetched]
+        fetched += len(messages)
+        yield messages
+
+        cursor = (data.get('response_metadata') or {}).get('next_cursor')
+        if not cursor or (limit and fetched >= limit):
+            break
+
+
+def resolve_thread_users(session, user_ids, known):
+    """
+    Fills `known` ({user_id: {"name", "real_name", "ts"}}) for the given ids.
+    Ids not cached in the integration context are looked up once each,
+    concurrently, over the pooled session. Failed lookups (including rate
+    limits that outlast the retries) are marked "failed" and retried after
+    THREAD_USER_FAILURE_TTL instead of THREAD_USER_CACHE_TTL; a name
+    resolved earlier is kept rather than replaced by 'N/A'.
+    """
+    now = time.time()
+
+    def stale(details):
+        ttl = THREAD_USER_FAILURE_TTL if details.get("failed") else THREAD_USER_CACHE_TTL
+        return now - details.get("ts", 0) > ttl
+
+    missing = {u for u in user_ids if u and (u not in known or stale(known[u]))}
+    if not missing:
+        return 0
+
+    def lookup(user_id):
+        try:
+            data = slack_api_get(session, "users.info", {"user": user_id})
+        except requests.RequestException as e:
+            data = {"ok": False, "error": str(e)}
+        user = data.get('user') if data.get('ok') else None
+        if not user:
+            demisto.debug(f"users.info failed for {user_id}: {data.get('error')}")
+            return user_id, {"name": 'N/A', "real_name": 'N/A', "ts": now, "failed": True}
+        return user_id, {"name": user.get('name', 'N/A'), "real_name": user.get('real_name', 'N/A'), "ts": now}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(THREAD_LOOKUP_WORKERS, len(missing))) as executor:
+        for user_id, details in executor.map(lookup, sorted(missing)):
+            if details.get("failed") and user_id in known and not known[user_id].get("failed"):
+                continue
+            known[user_id] = details
+    return len(missing)
+
+
 def get_thread_messages():
     channel_id = demisto.args().get("channel_id")
     thread_id = demisto.args().get("thread_id")
+    limit = int(demisto.args().get("limit") or 1000)
+    page_size = int(demisto.args().get("page_size") or 200)
+    results_per_page = str(demisto.args().get("results_per_page", "false")).lower() == "true"
+
+    session = slack_api_session()
+    known = dict((get_integration_context() or {}).get(THREAD_USER_CACHE_KEY) or {})
+    looked_up = 0
     updated_messages = []
     warroom_entries = []
-    messages_url = f"https://slack.com/api/conversations.replies?channel={channel_id}&ts={thread_id}"
-    headers = {
-        "Authorization": f"Bearer {BOT_TOKEN}"
-    }
-    raw_response = requests.get(messages_url, headers=headers)
-    if not raw_response.json().get('ok'):
-        error = raw_response.get('error')
-        return_error(f'An error occurred while listing conversation replies: {error}')
-
-    messages = raw_response.json().get('messages', '')
-    if isinstance(messages, dict):
-        messages = [messages]
-    if not isinstance(messages, list):
-        demisto.error(f'An error occurred while listing conversation replies: {raw_response.get("error")}')
-    for message in messages:
-        name = 'N/A'
-        full_name = 'N/A'
-        if 'subtype' not in message:
-            user_id = message.get('user')
-            user_url = f"https://slack.com/api/users.info?user={user_id}"
-            user_details_response = requests.get(user_url, headers=headers)
-            user_details = user_details_response.json().get('user')
-            name = user_details.get('name')
-            full_name = user_details.get('real_name')
-        message['user_name'] = name
-        message['full_name'] = full_name
-        updated_messages.append(message)
-
-        warroom_entry = {
-            'Type': message.get('type'),
-            'Text': message.get('text'),
-            'UserId': message.get('user'),
-            'Name': name,
-            'FullName': full_name,
-            'TimeStamp': message.get('ts'),
-            'ThreadTimeStamp': message.get('thread_ts')
-        }
-        warroom_entries.append(warroom_entry)
-    readable_output = tableToMarkdown(f'Thread Messages of thread - {thread_id}', warroom_entries)
-    return_results(CommandResults(
-        outputs_prefix='Slack.Thread.Messages',
-        outputs_key_field='',
-        outputs=updated_messages,
-        readable_output=readable_output
-    ))
+    page_number = 0
+
+    for messages in iter_thread_replies(session, channel_id, thread_id, page_size=page_size, limit=limit):
+        page_number += 1
+        looked_up += resolve_thread_users(
+            session, {m.get('user') for m in messages if 'subtype' not in m}, known
+        )
+        page_messages = []
+        page_entries = []
+        for message in messages:
+            name = 'N/A'
+            full_name = 'N/A'
+            if 'subtype' not in message and message.get('user') in known:
+                name = known[message['user']]['name']
+                full_name = known[message['user']]['real_name']
+            message['user_name'] = name
+            message['full_name'] = full_name
+            page_messages.append(message)
+
+            warroom_entry = {
+                'Type': message.get('type'),
+                'Text': message.get('text'),
+                'UserId': message.get('user'),
+                'Name': name,
+                'FullName': full_name,
+                'TimeStamp': message.get('ts'),
+                'ThreadTimeStamp': message.get('thread_ts')
+            }
+            page_entries.append(warroom_entry)
+
+        # Large threads can be emitted page by page instead of as one entry
+        if results_per_page:
+            return_results(CommandResults(
+                outputs_prefix='Slack.Thread.Messages',
+                outputs_key_field='',
+                outputs=page_messages,
+                readable_output=tableToMarkdown(f'Thread Messages of thread - {thread_id} (page {page_number})', page_entries)
+            ))
+        else:
+            updated_messages.extend(page_messages)
+            warroom_entries.extend(page_entries)
+
+    if looked_up:
+        ctx = get_integration_context() or {}
+        ctx[THREAD_USER_CACHE_KEY] = known
+        set_integration_context(ctx)
+    demisto.debug(f"Thread {thread_id}: {page_number} pages, {looked_up} user lookups")
+
+    if not results_per_page:
+        readable_output = tableToMarkdown(f'Thread Messages of thread - {thread_id}', warroom_entries)
+        return_results(CommandResults(
+            outputs_prefix='Slack.Thread.Messages',
+            outputs_key_field='',
+            outputs=updated_messages,
+            readable_output=readable_output
+        ))
 
 def long_running_main():
     """
     Starts the long running thread.
     """
     try:
-        asyncio.run(SocketModeHandler(app, APP_TOKEN).start(), debug=True)
+        asyncio.run(run_socket_mode())
     except Exception as e:
         demisto.error(f"The Loop has failed to run {str(e)}")
+
+
+async def run_socket_mode():
+    """
+    Serves Slack over Socket Mode. Every handler, agent run, MCP session and
+    platform call shares this one event loop.
+    """
+    warning = outbox_path_warning(OUTBOX_PATH)
+    if warning:
+        demisto.error(warning)
+    # Warm the user directory in the background so startup is not delayed
+    warm = asyncio.create_task(USER_DIRECTORY.warm(app.client))
+    # Platform writes recorded in the outbox (including ones left over from a restart)
+    dispatcher = asyncio.create_task(OUTBOX.run())
+    try:
+        await AsyncSocketModeHandler(app, APP_TOKEN).start_async()
     finally:
-        loop = asyncio.get_running_loop()
-        try:
-            loop.stop()
-            loop.close()
-        except Exception as e_:
-            demisto.error(f'Failed to gracefully close the loop - {e_}')
+        warm.cancel()
+        dispatcher.cancel()
 
 
 
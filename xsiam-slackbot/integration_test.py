@@ -0,0 +1,721 @@
+import asyncio
+import datetime
+import importlib.util
+import os
+from unittest.mock import patch
+
+import pytest
+
+import CommonServerPython
+import demistomock as demisto
+
+PARAMS = {
+    "slack_bot_token": {"password": "xoxb-test"},
+    "slack_app_token": {"password": "xapp-test"},
+    "platform": "XSIAM",
+    "platform_url": "https://api-tenant.xdr.example.com",
+    "outbox_path": "/var/lib/troybot/outbox.db",
+}
+
+
+def load_integration():
+    """
+    Imports integration.py the way XSOAR runs it: with demisto and the
+    CommonServerPython helpers already in its globals, configured with PARAMS.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "integration.py")
+    spec = importlib.util.spec_from_file_location("integration", path)
+    module = importlib.util.module_from_spec(spec)
+    module.__dict__.update({k: v for k, v in vars(CommonServerPython).items() if not k.startswith("__")})
+    module.demisto = demisto
+    with patch.object(demisto, "params", return_value=PARAMS):
+        spec.loader.exec_module(module)
+    return module
+
+
+integration = load_integration()
+
+
+# --- ContextCache ---
+
+class FakeCaches:
+    def __init__(self, error=None):
+        self.error = error
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    @staticmethod
+    def handle(name, ttl=3600):
+        expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+        return integration.types.CachedContent(name=name, expire_time=expire_time)
+
+    async def create(self, model, config):
+        if self.error:
+            raise self.error
+        self.created.append(config)
+        return self.handle(f"cachedContents/{len(self.created)}")
+
+    async def update(self, name, config):
+        self.updated.append(name)
+        return self.handle(name)
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeCacheClient:
+    def __init__(self, **kwargs):
+        self.caches = FakeCaches(**kwargs)
+        self.aio = self
+
+
+def catalog(*names):
+    return [integration.types.Tool(function_declarations=[
+        integration.types.FunctionDeclaration(name=name, description=f"{name} tool") for name in names
+    ])]
+
+
+def test_context_cache_created_and_reused():
+    """The first request creates the cache; later ones within the TTL reuse it."""
+    client = FakeCacheClient()
+    cache = integration.ContextCache(ttl=3600)
+
+    first = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    second = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+
+    assert first == second == "cachedContents/1"
+    assert len(client.caches.created) == 1
+    assert client.caches.created[0].ttl == "3600s"
+    assert cache.stats()["hits"] == 1
+
+
+def test_context_cache_refreshed_near_expiry():
+    """A handle about to expire is extended in place instead of recreated."""
+    client = FakeCacheClient()
+    cache = integration.ContextCache(ttl=3600, refresh_margin=300)
+    asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    entry = next(iter(cache.entries.values()))
+    entry["expires_at"] = integration.time.time() + 60
+
+    name = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+
+    assert name == "cachedContents/1"
+    assert client.caches.updated == ["cachedContents/1"]
+    assert len(client.caches.created) == 1
+    assert entry["expires_at"] > integration.time.time() + 300
+
+
+def test_context_cache_recreated_after_expiry():
+    """An expired handle is replaced by a new one."""
+    client = FakeCacheClient()
+    cache = integration.ContextCache()
+    asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    next(iter(cache.entries.values()))["expires_at"] = integration.time.time() - 1
+
+    name = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+
+    assert name == "cachedContents/2"
+    assert client.caches.updated == []
+
+
+def test_context_cache_replaced_when_catalog_changes():
+    """A new tool catalog gets its own cache and the old one is deleted."""
+    client = FakeCacheClient()
+    cache = integration.ContextCache()
+
+    asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases")))
+    name = asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases", "run_xql_query")))
+
+    assert name == "cachedContents/2"
+    assert client.caches.deleted == ["cachedContents/1"]
+    assert cache.stats()["entries"] == 1
+
+
+def test_context_cache_unavailable_falls_back_inline():
+    """When caching fails the prefix is sent inline and creation is not retried right away."""
+    client = FakeCacheClient(error=RuntimeError("model does not support caching"))
+    cache = integration.ContextCache(retry_interval=600)
+
+    assert asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases"))) is None
+    client.caches.error = None
+    assert asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases"))) is None
+    assert client.caches.created == []
+    assert cache.stats()["failures"] == 1
+
+
+def test_context_cache_disabled():
+    client = FakeCacheClient()
+    cache = integration.ContextCache(enabled=False)
+
+    assert asyncio.run(cache.get(client, "model", "prompt", catalog("get_cases"))) is None
+    assert client.caches.created == []
+
+
+# --- ThreadSessionStore ---
+
+def message(ts, text="hello"):
+    return {"timestamp": ts, "user": "analyst", "text": text}
+
+
+async def lease_keys(store, *keys):
+    for key in keys:
+        async with store.lease(key):
+            pass
+
+
+def test_thread_session_reused_per_key():
+    """A second lease of the same thread gets the same session back."""
+    store = integration.ThreadSessionStore(max_sessions=10)
+
+    async def run():
+        async with store.lease(("C1", "1.0")) as entry:
+            entry["chat"] = "chat"
+        async with store.lease(("C1", "1.0")) as entry:
+            return entry["chat"]
+
+    assert asyncio.run(run()) == "chat"
+    assert store.stats()["hits"] == 1
+    assert store.stats()["misses"] == 1
+
+
+def test_thread_session_lru_eviction():
+    """Past max_sessions, the least recently used session is dropped first."""
+    store = integration.ThreadSessionStore(max_sessions=2)
+    asyncio.run(lease_keys(store, "a", "b", "a", "c"))
+
+    assert list(store.entries) == ["a", "c"]
+    assert store.stats()["evictions"] == 1
+
+
+def test_thread_session_idle_ttl():
+    """A session unused for longer than idle_ttl is evicted on the next lease."""
+    store = integration.ThreadSessionStore(idle_ttl=60)
+    asyncio.run(lease_keys(store, "a", "b"))
+    store.entries["a"]["last_used"] -= 61
+
+    asyncio.run(lease_keys(store, "b"))
+
+    assert list(store.entries) == ["b"]
+
+
+def test_thread_session_byte_budget():
+    """Sessions are evicted oldest first while their total size is over max_bytes."""
+    store = integration.ThreadSessionStore(max_bytes=100)
+
+    async def run():
+        async with store.lease("a") as entry:
+            entry["size"] = 80
+        async with store.lease("b") as entry:
+            entry["size"] = 50
+
+    asyncio.run(run())
+
+    assert list(store.entries) == ["b"]
+
+
+def test_thread_session_leased_entry_not_evicted():
+    """A session in use is never evicted, even when over the limits."""
+    store = integration.ThreadSessionStore(max_sessions=1)
+
+    async def run():
+        async with store.lease("a"):
+            await lease_keys(store, "b")
+            return "a" in store.entries
+
+    assert asyncio.run(run())
+    assert list(store.entries) == ["a"]
+
+
+def test_thread_session_unseen_messages():
+    """Only messages past the watermark, and not the bot's own replies, are unseen."""
+    store = integration.ThreadSessionStore()
+    entry = {"watermark": "", "seen": set()}
+    store.mark_seen(entry, [message("1.0"), message("2.0")], "3.0")
+
+    unseen = store.unseen(entry, [message("1.0"), message("2.0"), message("3.0"), message("4.0")])
+
+    assert [m["timestamp"] for m in unseen] == ["4.0"]
+
+
+# --- HistoryCompactor ---
+
+class FakeModels:
+    def __init__(self, text="summary", error=None):
+        self.text = text
+        self.error = error
+        self.calls = []
+
+    async def generate_content(self, model, contents, config):
+        self.calls.append(contents)
+        if self.error:
+            raise self.error
+        return type("Response", (), {"text": self.text})()
+
+
+class FakeGenAIClient:
+    def __init__(self, **kwargs):
+        self.models = FakeModels(**kwargs)
+        self.aio = self
+
+
+def thread(count):
+    return [message(f"{i}.0") for i in range(1, count + 1)]
+
+
+def test_compactor_under_budget_unchanged():
+    """History within the token budget is passed through without a model call."""
+    client = FakeGenAIClient()
+    compactor = integration.HistoryCompactor(keep_turns=3, token_budget=10000)
+    messages = thread(10)
+
+    assert asyncio.run(compactor.compact(client, "model", "key", messages)) == messages
+    assert client.models.calls == []
+
+
+def test_compactor_over_budget_summarizes_older():
+    """Over the budget, older messages become a summary and the last keep_turns stay verbatim."""
+    client = FakeGenAIClient()
+    compactor = integration.HistoryCompactor(keep_turns=3, token_budget=100)
+
+    compacted = asyncio.run(compactor.compact(client, "model", "key", thread(10)))
+
+    assert compacted[0] == {"summary": "summary", "messages_summarized": 7}
+    assert [m["timestamp"] for m in compacted[1:]] == ["8.0", "9.0", "10.0"]
+    assert len(client.models.calls) == 1
+
+
+def test_compactor_reuses_cached_summary():
+    """The same history compacted twice only calls the model once."""
+    client = FakeGenAIClient()
+    compactor = integration.HistoryCompactor(keep_turns=3, token_budget=100)
+
+    asyncio.run(compactor.compact(client, "model", "key", thread(10)))
+    compacted = asyncio.run(compactor.compact(client, "model", "key", thread(10)))
+
+    assert compacted[0]["summary"] == "summary"
+    assert len(client.models.calls) == 1
+    assert compactor.stats()["hits"] == 1
+
+
+def test_compactor_extends_summary_with_new_messages_only():
+    """When the window moves on, only the messages that left it are sent with the previous summary."""
+    client = FakeGenAIClient()
+    compactor = integration.HistoryCompactor(keep_turns=3, token_budget=100)
+
+    asyncio.run(compactor.compact(client, "model", "key", thread(10)))
+    asyncio.run(compactor.compact(client, "model", "key", thread(12)))
+
+    contents = client.models.calls[1]
+    assert "Previous summary:\nsummary" in contents
+    assert "'8.0'" in contents and "'9.0'" in contents
+    assert "'7.0'" not in contents
+    assert compactor.summaries["key"]["upto"] == "9.0"
+
+
+def test_compactor_failure_placeholder():
+    """A failed summary call replaces the older messages with a count and is not cached."""
+    client = FakeGenAIClient(error=RuntimeError("quota"))
+    compactor = integration.HistoryCompactor(keep_turns=3, token_budget=100)
+
+    compacted = asyncio.run(compactor.compact(client, "model", "key", thread(10)))
+
+    assert compacted[0] == {"summary": "[7 earlier messages omitted]"}
+    assert len(compacted) == 4
+    assert "key" not in compactor.summaries
+    assert compactor.stats()["failures"] == 1
+
+
+# --- EventDeduplicator ---
+
+def delivery(event_id=None, client_msg_id=None, event_type="app_mention"):
+    body = {"event": {"type": event_type}}
+    if event_id:
+        body["event_id"] = event_id
+    if client_msg_id:
+        body["event"]["client_msg_id"] = client_msg_id
+    return body
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_dedup_redelivered_event():
+    """A redelivery with the same event_id is a duplicate."""
+    dedup = integration.EventDeduplicator()
+
+    assert not dedup.is_duplicate(delivery("Ev1"))
+    assert dedup.is_duplicate(delivery("Ev1"))
+    assert dedup.stats() == {"tracked": 1, "duplicates": 1}
+
+
+def test_dedup_same_message_other_envelope():
+    """The same message under a new event_id is caught by client_msg_id."""
+    dedup = integration.EventDeduplicator()
+
+    assert not dedup.is_duplicate(delivery("Ev1", "msg-1"))
+    assert dedup.is_duplicate(delivery("Ev2", "msg-1"))
+    assert not dedup.is_duplicate(delivery("Ev3", "msg-1", event_type="message"))
+
+
+def test_dedup_ttl_expiry(monkeypatch):
+    """Keys older than the TTL are forgotten, so the event is handled again."""
+    clock = Clock()
+    monkeypatch.setattr(integration.time, "monotonic", clock)
+    dedup = integration.EventDeduplicator(ttl=60)
+
+    assert not dedup.is_duplicate(delivery("Ev1"))
+    clock.now += 59
+    assert dedup.is_duplicate(delivery("Ev1"))
+    clock.now += 2
+    assert not dedup.is_duplicate(delivery("Ev1"))
+
+
+def test_dedup_bounded_entries():
+    """Past max_entries the oldest keys are dropped first."""
+    dedup = integration.EventDeduplicator(max_entries=2)
+    for event_id in ("Ev1", "Ev2", "Ev3", "Ev4"):
+        dedup.is_duplicate(delivery(event_id))
+
+    assert list(dedup.seen) == ["event:Ev3", "event:Ev4"]
+    assert dedup.is_duplicate(delivery("Ev4"))
+    assert not dedup.is_duplicate(delivery("Ev1"))
+    assert len(dedup.seen) == 2
+
+
+def test_dedup_without_keys():
+    """Bodies with nothing to key on are never treated as duplicates."""
+    dedup = integration.EventDeduplicator()
+
+    assert not dedup.is_duplicate(delivery())
+    assert not dedup.is_duplicate(delivery())
+    assert dedup.stats()["tracked"] == 0
+
+
+# --- Outbox ---
+
+ALERT = ["Phishing", "analyst", "Suspicious email", "high", "details"]
+
+
+class FakeAlertWriter:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    async def submit(self, *alert, external_id=None):
+        self.calls.append(external_id)
+        if len(self.calls) <= self.failures:
+            raise RuntimeError("XSIAM unavailable")
+        return integration.AlertRef(external_id, 42)
+
+
+class FakeWebhook:
+    def __init__(self, url=None):
+        self.sent = []
+
+    async def send(self, blocks=None, text=None):
+        self.sent.append({"blocks": blocks, "text": text})
+        return type("Response", (), {"status_code": 200})()
+
+
+def setup_outbox(monkeypatch, tmp_path, writer=None, existing_alert=None, **kwargs):
+    monkeypatch.setattr(integration, "PLATFORM", "xsiam")
+    monkeypatch.setattr(integration, "PLATFORM_URL", "https://api-tenant.xdr.example.com")
+    monkeypatch.setattr(integration, "get_async_client", lambda *args: None)
+    monkeypatch.setattr(integration.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(integration, "ALERT_WRITER", writer or FakeAlertWriter())
+
+    async def find_alert_id(client, external_id):
+        return existing_alert
+
+    monkeypatch.setattr(integration, "find_alert_id", find_alert_id)
+    webhook = FakeWebhook()
+    monkeypatch.setattr(integration, "AsyncWebhookClient", lambda url: webhook)
+    return integration.Outbox(str(tmp_path / "outbox.db"), **kwargs), webhook
+
+
+def fetch(outbox, outbox_id):
+    return outbox._conn().execute("SELECT * FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+
+
+def test_outbox_delivers_alert(monkeypatch, tmp_path):
+    """A queued alert is created under the row's external_id and its result stored."""
+    writer = FakeAlertWriter()
+    outbox, _ = setup_outbox(monkeypatch, tmp_path, writer)
+    outbox_id = outbox.add("create_alert", ALERT)
+
+    asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+
+    row = fetch(outbox, outbox_id)
+    assert row["status"] == "done"
+    assert writer.calls == [row["external_id"]]
+    assert row["external_id"].startswith("troybot-")
+    assert integration.json.loads(row["result"])["incident_id"] == "42"
+    assert outbox.stats()["delivered"] == 1
+
+
+def test_outbox_retry_backoff(monkeypatch, tmp_path):
+    """Failures stay pending with an exponentially growing delay capped at max_backoff."""
+    monkeypatch.setattr(integration.time, "time", lambda: 1000.0)
+    outbox, _ = setup_outbox(monkeypatch, tmp_path, FakeAlertWriter(failures=10), retry_base=10, max_backoff=50)
+    outbox_id = outbox.add("create_alert", ALERT)
+
+    delays = []
+    for _ in range(4):
+        asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+        delays.append(fetch(outbox, outbox_id)["next_attempt"] - 1000.0)
+
+    row = fetch(outbox, outbox_id)
+    assert delays == [10, 20, 40, 50]
+    assert row["status"] == "pending"
+    assert row["attempts"] == 4
+    assert row["error"] == "XSIAM unavailable"
+    assert outbox.stats()["retried"] == 4
+
+
+def test_outbox_not_due_before_backoff(monkeypatch, tmp_path):
+    """A row waiting out its backoff is not dispatched."""
+    outbox, _ = setup_outbox(monkeypatch, tmp_path, FakeAlertWriter(failures=1))
+    outbox_id = outbox.add("create_alert", ALERT)
+
+    asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+
+    assert outbox._due() == []
+
+
+def test_outbox_retry_reuses_created_alert(monkeypatch, tmp_path):
+    """A retry finds the alert an earlier attempt created instead of creating it again."""
+    writer = FakeAlertWriter()
+    outbox, _ = setup_outbox(monkeypatch, tmp_path, writer, existing_alert=7)
+    outbox_id = outbox.add("create_alert", ALERT)
+    outbox._conn().execute("UPDATE outbox SET attempts = 1 WHERE id = ?", (outbox_id,))
+
+    asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+
+    assert writer.calls == []
+    assert integration.json.loads(fetch(outbox, outbox_id)["result"])["incident_id"] == "7"
+
+
+def test_outbox_dead_letter(monkeypatch, tmp_path):
+    """After max_attempts the row is marked failed and a waiting reply is told so."""
+    outbox, webhook = setup_outbox(monkeypatch, tmp_path, FakeAlertWriter(failures=10), max_attempts=3)
+    outbox_id = outbox.add("create_alert", ALERT, body={"response_url": "https://hooks.slack.example/1"})
+    outbox._conn().execute("UPDATE outbox SET reply = '[]' WHERE id = ?", (outbox_id,))
+
+    for _ in range(3):
+        asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+
+    row = fetch(outbox, outbox_id)
+    assert row["status"] == "failed"
+    assert row["attempts"] == 3
+    assert outbox.stats()["failed"] == 1
+    assert webhook.sent == [{"blocks": None,
+                             "text": ":x: I couldn't create the incident after 3 attempts: XSIAM unavailable"}]
+    assert outbox._due() == []
+
+
+def test_outbox_unsupported_platform_fails_at_once(monkeypatch, tmp_path):
+    """A write that cannot succeed is failed on the first attempt instead of retried."""
+    outbox, webhook = setup_outbox(monkeypatch, tmp_path, max_attempts=8)
+    monkeypatch.setattr(integration, "PLATFORM", "xsoar")
+    outbox_id = outbox.add("create_alert", ALERT, body={"response_url": "https://hooks.slack.example/1"})
+    outbox._conn().execute("UPDATE outbox SET reply = '[]' WHERE id = ?", (outbox_id,))
+
+    asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+
+    row = fetch(outbox, outbox_id)
+    assert row["status"] == "failed"
+    assert row["attempts"] == 1
+    assert row["error"] == "Unsupported platform: xsoar"
+    assert webhook.sent == [{"blocks": None, "text": ":x: I couldn't create the incident: Unsupported platform: xsoar"}]
+
+def test_outbox_orders_rows_per_key(monkeypatch, tmp_path):
+    """Only the oldest pending row of an ordering_key is due; unkeyed rows are not held back."""
+    outbox, _ = setup_outbox(monkeypatch, tmp_path)
+    first = outbox.add("monitored_thread", [], ordering_key="C1:1.0")
+    outbox.add("monitored_thread", [], ordering_key="C1:1.0")
+    other = outbox.add("monitored_thread", [], ordering_key="C2:1.0")
+    unkeyed = outbox.add("create_alert", ALERT)
+
+    assert [row["id"] for row in outbox._due()] == [first, other, unkeyed]
+
+
+def test_outbox_holds_reply_until_created(monkeypatch, tmp_path):
+    """A reply with placeholders is held, then sent with the incident link filled in."""
+    outbox, webhook = setup_outbox(monkeypatch, tmp_path)
+    link, case_id = outbox.add_alert(*ALERT, body={"response_url": "https://hooks.slack.example/1"})
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": f"<{link}|Case {case_id}>"}}]
+
+    asyncio.run(outbox.send(webhook, blocks))
+    assert "Request recorded" in webhook.sent[0]["text"]
+
+    asyncio.run(outbox._process(outbox._due()[0]))
+
+    text = webhook.sent[1]["blocks"][0]["text"]["text"]
+    assert text == "<https://tenant.xdr.example.com/alerts?action:openAlertDetails=42-caseinfoid|Case 42>"
+
+
+def test_outbox_send_without_row(monkeypatch, tmp_path):
+    """A reply whose outbox row is gone is sent unchanged instead of failing."""
+    outbox, webhook = setup_outbox(monkeypatch, tmp_path)
+    link, case_id = integration.outbox_link(99)
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": f"<{link}|Case {case_id}>"}}]
+
+    asyncio.run(outbox.send(webhook, blocks))
+
+    assert webhook.sent == [{"blocks": blocks, "text": None}]
+
+def test_outbox_ephemeral_reply_not_threaded(monkeypatch, tmp_path):
+    """Rows added from an ephemeral message keep the channel but no thread."""
+    outbox, _ = setup_outbox(monkeypatch, tmp_path)
+    body = {"channel": {"id": "C1"}, "container": {"is_ephemeral": True, "message_ts": "1.0"}}
+
+    row = fetch(outbox, outbox.add("create_alert", ALERT, body=body))
+
+    assert row["channel"] == "C1"
+    assert row["thread_ts"] is None
+
+
+@pytest.mark.parametrize("path", ["", "/tmp/outbox.db", "/var/tmp/troybot/outbox.db"])
+def test_outbox_path_warning(path):
+    """An unset or temporary outbox path is reported, not rejected."""
+    assert integration.outbox_path_warning(path)
+
+
+def test_outbox_path_persistent():
+    assert integration.outbox_path_warning("/var/lib/troybot/outbox.db") is None
+
+
+def test_outbox_in_memory(monkeypatch, tmp_path):
+    """Without a path the outbox still queues and delivers, in memory."""
+    setup_outbox(monkeypatch, tmp_path)
+    outbox = integration.Outbox(":memory:")
+    outbox_id = outbox.add("create_alert", ALERT)
+
+    asyncio.run(outbox._process(fetch(outbox, outbox_id)))
+
+    assert fetch(outbox, outbox_id)["status"] == "done"
+
+
+# --- AlertWriter ---
+
+class FakePlatformClient:
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.created = []
+        self.lookups = 0
+
+    async def create_incident(self, *alert):
+        if self.gate:
+            await self.gate.wait()
+        external_id = alert[-1]
+        self.created.append(external_id)
+        return integration.json.dumps({"reply": external_id})
+
+    async def search_incident(self, request_data):
+        self.lookups += 1
+        wanted = request_data["filters"][0]["value"]
+        alerts = [{"external_id": e, "alert_id": 100 + self.created.index(e)} for e in wanted]
+        return integration.json.dumps({"reply": {"alerts": alerts}})
+
+
+def setup_alert_writer(monkeypatch, client):
+    monkeypatch.setattr(integration, "get_async_client", lambda *args: client)
+    monkeypatch.setattr(integration, "return_dict", integration.json.loads, raising=False)
+    monkeypatch.setattr(integration, "INCIDENT_ID_CACHE", integration.OrderedDict())
+    return integration.AlertWriter(flush_interval=30)
+
+
+def test_alert_writer_resolves_batch_with_one_lookup(monkeypatch):
+    """Alerts submitted together are created one by one and resolved with a single get_alerts call."""
+    client = FakePlatformClient()
+    writer = setup_alert_writer(monkeypatch, client)
+
+    async def run():
+        futures = [writer.submit(*ALERT, external_id=f"troybot-{i}") for i in range(5)]
+        # An idle writer does not wait out flush_interval
+        return await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+
+    refs = asyncio.run(run())
+
+    assert [(ref.external_id, ref.alert_id) for ref in refs] == [(f"troybot-{i}", 100 + i) for i in range(5)]
+    assert len(client.created) == 5
+    assert client.lookups == 1
+    assert writer.stats()["batches"] == 1
+
+
+def test_alert_writer_buffers_during_burst(monkeypatch):
+    """While a batch is being written, new alerts wait for flush_interval."""
+    client = FakePlatformClient(gate=asyncio.Event())
+    writer = setup_alert_writer(monkeypatch, client)
+
+    async def run():
+        first = writer.submit(*ALERT, external_id="troybot-1")
+        await asyncio.sleep(0.01)
+        assert len(writer.tasks) == 1
+        second = writer.submit(*ALERT, external_id="troybot-2")
+        await asyncio.sleep(0.01)
+        assert len(writer.pending) == 1
+        assert writer.timer.when() - asyncio.get_running_loop().time() > 20
+        client.gate.set()
+        writer.flush()
+        return await asyncio.wait_for(asyncio.gather(first, second), timeout=5)
+
+    refs = asyncio.run(run())
+
+    assert [ref.alert_id for ref in refs] == [100, 101]
+    assert writer.stats()["batches"] == 2
+
+
+# --- get_thread_messages ---
+
+class FakeSlackResponse:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def json(self):
+        return self.data
+
+
+def test_get_thread_messages(monkeypatch):
+    """The thread is read page by page and each message is tagged with its author's names."""
+    pages = {
+        None: {"ok": True, "messages": [{"type": "message", "user": "U1", "text": "first", "ts": "1.0"}],
+               "response_metadata": {"next_cursor": "page2"}},
+        "page2": {"ok": True, "messages": [
+            {"type": "message", "user": "U2", "text": "second", "ts": "2.0", "thread_ts": "1.0"},
+            {"type": "message", "subtype": "bot_message", "text": "bot", "ts": "3.0", "thread_ts": "1.0"},
+        ]},
+    }
+    users = {"U1": {"name": "alice", "real_name": "Alice A"}, "U2": {"name": "bob", "real_name": "Bob B"}}
+    calls = []
+
+    def get(session, url, params=None, timeout=None):
+        method = url.rsplit("/", 1)[1]
+        calls.append((method, session.headers["Authorization"]))
+        if method == "conversations.replies":
+            return FakeSlackResponse(pages[params.get("cursor")])
+        return FakeSlackResponse({"ok": True, "user": users[params["user"]]})
+
+    context, results = {}, []
+    monkeypatch.setattr(integration.requests.Session, "get", get)
+    monkeypatch.setattr(integration.demisto, "args", lambda: {"channel_id": "C1", "thread_id": "1.0"})
+    monkeypatch.setattr(integration, "get_integration_context", lambda: dict(context))
+    monkeypatch.setattr(integration, "set_integration_context", context.update)
+    monkeypatch.setattr(integration, "return_results", results.append)
+
+    integration.get_thread_messages()
+
+    [result] = results
+    assert [(m["user_name"], m["full_name"]) for m in result.outputs] == [
+        ("alice", "Alice A"), ("bob", "Bob B"), ("N/A", "N/A")]
+    assert [method for method, _ in calls].count("conversations.replies") == 2
+    assert {auth for _, auth in calls} == {"Bearer xoxb-test"}
+    assert context[integration.THREAD_USER_CACHE_KEY]["U2"]["name"] == "bob"
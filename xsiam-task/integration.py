@@ -1,17 +1,41 @@
 import asyncio
+import copy
+import datetime
+import hashlib
 import json
 import logging
 import os
-import tempfile
+import time
 
 from fastmcp import Client
 from fastmcp.client.transports import StreamableHttpTransport
+from fastmcp.client.messages import MessageHandler
 import httpx
 from google import genai
 from google.genai import types
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.oauth2 import service_account
 
 logger = logging.getLogger(__name__)
 
+TOOL_CATALOG_KEY = "tool_catalog"
+DEFAULT_TOOL_CACHE_TTL = 300
+DEFAULT_TOOL_CONCURRENCY = 4
+DEFAULT_TOOL_TIMEOUT = 120
+DEFAULT_RESULT_TOKEN_BUDGET = 8000
+DEFAULT_TURN_TOKEN_BUDGET = 24000
+CONTEXT_CACHE_KEY = "context_cache"
+GENAI_TOKEN_REFRESH_MARGIN = 300
+GENAI_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+DEFAULT_CONTEXT_CACHE_TTL = 3600
+CONTEXT_CACHE_REFRESH_MARGIN = 300
+CONTEXT_CACHE_RETRY_INTERVAL = 600
+
+SYSTEM_INSTRUCTION = (
+    "You are an advanced Security Analyst Agent for Cortex XSIAM. "
+    "Use MCP tools when needed and provide clear, actionable responses."
+)
+
 
 def _httpx_client_factory(insecure: bool):
     def factory(**kwargs):
@@ -21,12 +45,12 @@ def _httpx_client_factory(insecure: bool):
 
 
 class CortexMCPClient:
-    def __init__(self, base_url: str, api_key: str | None, insecure: bool):
+    def __init__(self, base_url: str, api_key: str | None, insecure: bool, message_handler=None):
         transport = StreamableHttpTransport(
             url=base_url,
             httpx_client_factory=_httpx_client_factory(insecure)
         )
-        self.client = Client(transport, auth=api_key)
+        self.client = Client(transport, auth=api_key, message_handler=message_handler)
 
     async def __aenter__(self):
         await self.client.__aenter__()
@@ -90,108 +114,501 @@ def _sanitize_schema(schema, defs=None, depth=0, processing=None):
     return s
 
 
-def _resolve_credentials_path(creds_value: str | None) -> str | None:
+class _ToolListChangedHandler(MessageHandler):
+    async def on_tool_list_changed(self, message):
+        logger.info("MCP server reported tools/list_changed; invalidating tool catalog")
+        _invalidate_tool_catalog()
+
+
+def _tool_catalog_state() -> dict:
+    return (get_integration_context() or {}).get(TOOL_CATALOG_KEY) or {}
+
+
+def _save_tool_catalog_state(state: dict):
+    ctx = get_integration_context() or {}
+    ctx[TOOL_CATALOG_KEY] = state
+    set_integration_context(ctx)
+
+
+def _invalidate_tool_catalog():
+    # Keep compiled schemas so the next refresh only recompiles what changed
+    state = _tool_catalog_state()
+    if state.get("loaded_at"):
+        state["loaded_at"] = 0
+        _save_tool_catalog_state(state)
+
+
+def _schema_hash(name: str, description: str | None, schema: dict) -> str:
+    payload = json.dumps([name, description, schema], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_cached_declarations(mcp_url: str, ttl: int) -> list[dict] | None:
+    state = _tool_catalog_state()
+    if state.get("mcp_url") != mcp_url:
+        return None
+    if time.time() - state.get("loaded_at", 0) >= ttl:
+        return None
+    compiled = state.get("compiled") or {}
+    return [compiled[key] for key in state.get("order", []) if key in compiled]
+
+
+def _compile_declarations(mcp_url: str, tools_list) -> tuple[list[dict], int, int]:
+    """
+    Sanitizes tool schemas, reusing compiled declarations whose content hash is unchanged.
+    """
+    state = _tool_catalog_state()
+    previous = (state.get("compiled") or {}) if state.get("mcp_url") == mcp_url else {}
+    compiled: dict[str, dict] = {}
+    order: list[str] = []
+    hits = misses = 0
+    for tool in tools_list:
+        schema = getattr(tool, "parameters", getattr(tool, "inputSchema", {})) or {}
+        key = _schema_hash(tool.name, tool.description, schema)
+        if key in previous:
+            compiled[key] = previous[key]
+            hits += 1
+        else:
+            compiled[key] = {
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": _sanitize_schema(copy.deepcopy(schema)),
+            }
+            misses += 1
+        order.append(key)
+
+    _save_tool_catalog_state({
+        "mcp_url": mcp_url,
+        "loaded_at": time.time(),
+        "order": order,
+        "compiled": compiled,
+        "hits": state.get("hits", 0) + hits,
+        "misses": state.get("misses", 0) + misses,
+    })
+    return [compiled[key] for key in order], hits, misses
+
+
+def get_schema_cache_stats() -> dict:
+    state = _tool_catalog_state()
+    return {"hits": state.get("hits", 0), "misses": state.get("misses", 0), "entries": len(state.get("compiled") or {})}
+
+
+async def _get_function_declarations(mcp_client, mcp_url: str, ttl: int, refresh: bool = False):
+    """
+    Returns Gemini function declarations for the MCP tools and a short cache status.
+
+    Compiled declarations are kept in the integration context so repeated
+    command runs skip list_tools() until the TTL expires or the server
+    reports tools/list_changed, and only changed schemas are recompiled.
+    """
+    declarations = None if refresh else _load_cached_declarations(mcp_url, ttl)
+    if declarations is not None:
+        status = "catalog cached"
+    else:
+        tools_response = await mcp_client.list_tools()
+        tools_list = tools_response if isinstance(tools_response, list) else tools_response.tools
+        declarations, hits, misses = _compile_declarations(mcp_url, tools_list)
+        status = f"schema cache: {hits} hits, {misses} misses"
+
+    function_declarations = [types.FunctionDeclaration(**d) for d in declarations]
+    return function_declarations, status
+
+
+def _load_credentials_info(creds_value: str | None) -> dict | None:
+    """
+    Service account info from the param, which holds the JSON itself or a path to it.
+    """
     if not creds_value:
         return None
     trimmed = creds_value.strip()
-    if trimmed.startswith("{"):
-        fd, path = tempfile.mkstemp(suffix=".json")
-        with os.fdopen(fd, "w") as f:
-            f.write(trimmed)
-        return path
-    return trimmed
+    try:
+        if trimmed.startswith("{"):
+            return json.loads(trimmed)
+        if os.path.exists(trimmed):
+            with open(trimmed, "r") as f:
+                return json.load(f)
+    except Exception as e:
+        logger.warning(f"Failed to load Vertex credentials: {e}")
+    return None
+
+
+# fingerprint -> service account credentials; their OAuth tokens never leave process memory
+GENAI_CREDENTIALS: dict = {}
+
+
+async def _cached_service_account_credentials(info: dict):
+    """
+    Service account credentials built once per key and kept in process
+    memory. The OAuth token is reused while it has more than
+    GENAI_TOKEN_REFRESH_MARGIN seconds left, and refreshed (off the event
+    loop) otherwise. Tokens are never written to the integration context.
+    """
+    fingerprint = hashlib.sha256(f"{info.get('client_email')}:{info.get('private_key_id')}".encode("utf-8")).hexdigest()
+    credentials = GENAI_CREDENTIALS.get(fingerprint)
+    if credentials is None:
+        credentials = service_account.Credentials.from_service_account_info(info, scopes=GENAI_SCOPES)
+        GENAI_CREDENTIALS[fingerprint] = credentials
 
+    if credentials.token and credentials.expiry:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if (credentials.expiry - now).total_seconds() > GENAI_TOKEN_REFRESH_MARGIN:
+            return credentials
 
-def _create_genai_client(api_key: str | None, creds_path: str | None, project_id: str | None, model_name: str):
+    try:
+        await asyncio.to_thread(credentials.refresh, GoogleAuthRequest())
+    except Exception as e:
+        # The GenAI client retries the refresh on its first request
+        logger.warning(f"Vertex token refresh failed: {e}")
+    return credentials
+
+
+async def _create_genai_client(api_key: str | None, creds_value: str | None, project_id: str | None, model_name: str):
     # Ignore placeholder API key
     if api_key and api_key.strip().lower() not in {"your_gemini_key", "changeme", "placeholder"}:
         return genai.Client(api_key=api_key)
 
-    if creds_path and os.path.exists(creds_path):
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = creds_path
-        if not project_id:
-            try:
-                with open(creds_path, "r") as f:
-                    project_id = json.load(f).get("project_id")
-            except Exception:
-                project_id = None
-        # ensure project is exported for ADC
-        if project_id:
-            os.environ["GOOGLE_CLOUD_PROJECT"] = project_id
-            os.environ["GCLOUD_PROJECT"] = project_id
+    info = _load_credentials_info(creds_value)
+    if info:
+        project_id = project_id or info.get("project_id")
         location = "global" if "gemini-3" in model_name.lower() or "experimental" in model_name.lower() else "us-central1"
         if project_id:
-            return genai.Client(vertexai=True, project=project_id, location=location)
+            credentials = await _cached_service_account_credentials(info)
+            return genai.Client(vertexai=True, project=project_id, location=location, credentials=credentials)
 
     return None
 
 
+# Rough chars-per-token ratio for JSON-heavy tool output
+_CHARS_PER_TOKEN = 4
+_EMPTY_VALUES = (None, "", [], {})
+
+
+def _estimate_tokens(obj) -> int:
+    text = obj if isinstance(obj, str) else json.dumps(obj, default=str, separators=(",", ":"))
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def _content_payload(content):
+    """
+    Plain JSON form of an MCP result's content blocks; JSON text is decoded
+    so rows can be trimmed individually.
+    """
+    values = []
+    for item in content or []:
+        text = getattr(item, "text", None)
+        if text is not None:
+            try:
+                values.append(json.loads(text))
+            except ValueError:
+                values.append(text)
+        elif hasattr(item, "model_dump"):
+            values.append(item.model_dump(mode="json"))
+        else:
+            values.append(str(item))
+    return values[0] if len(values) == 1 else values
+
+
+def _allocate_budgets(estimates: list[int], per_result: int, per_turn: int) -> list[int]:
+    """
+    Water-fills the per-turn budget: small results keep what they need and
+    the rest share what is left evenly, independent of completion order.
+    """
+    caps = [min(e, per_result) for e in estimates]
+    if sum(caps) <= per_turn:
+        return [per_result] * len(caps)
+
+    budgets = [0] * len(caps)
+    remaining = per_turn
+    order = sorted(range(len(caps)), key=lambda i: (caps[i], i))
+    for position, i in enumerate(order):
+        budgets[i] = min(caps[i], remaining // (len(order) - position))
+        remaining -= budgets[i]
+    return budgets
+
+
+def _row_lists(obj, path: str = "$"):
+    if isinstance(obj, list):
+        if len(obj) > 1 and all(isinstance(r, dict) for r in obj):
+            yield path, obj
+            return
+        for i, item in enumerate(obj):
+            yield from _row_lists(item, f"{path}[{i}]")
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _row_lists(value, f"{path}.{key}")
+
+
+def _drop_empty_columns(obj) -> list[str]:
+    dropped = set()
+    for _, rows in _row_lists(obj):
+        columns = {k for row in rows for k in row}
+        empty = {k for k in columns if all(row.get(k) in _EMPTY_VALUES for row in rows)}
+        for row in rows:
+            for k in empty:
+                row.pop(k, None)
+        dropped |= empty
+    return sorted(dropped)
+
+
+def _truncate_strings(obj, max_chars: int) -> int:
+    count = 0
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else []
+    for key, value in list(items):
+        if isinstance(value, str) and len(value) > max_chars:
+            obj[key] = value[:max_chars] + f"...[+{len(value) - max_chars} chars]"
+            count += 1
+        elif isinstance(value, (dict, list)):
+            count += _truncate_strings(value, max_chars)
+    return count
+
+
+def _shape_result(payload, budget: int, max_string_chars: int = 1000) -> tuple:
+    """
+    Fits a tool result into `budget` estimated tokens by dropping all-empty
+    columns, truncating long strings, keeping the leading rows of the largest
+    row lists, and finally cutting the serialized JSON. Returns
+    (payload, omitted), where omitted describes what was removed or None.
+    """
+    original = _estimate_tokens(payload)
+    if original <= budget:
+        return payload, None
+
+    shaped = copy.deepcopy(payload)
+    omitted = {"original_tokens": original, "budget_tokens": budget}
+
+    dropped = _drop_empty_columns(shaped)
+    if dropped:
+        omitted["empty_fields_dropped"] = dropped
+
+    if _estimate_tokens(shaped) > budget:
+        truncated = _truncate_strings(shaped, max_string_chars) if isinstance(shaped, (dict, list)) else 0
+        if truncated:
+            omitted["strings_truncated"] = truncated
+
+    rows_omitted = []
+    for path, rows in sorted(_row_lists(shaped), key=lambda pr: -len(pr[1])):
+        if _estimate_tokens(shaped) <= budget:
+            break
+        total = len(rows)
+        full = rows[:]
+        # Largest leading slice that fits, found by bisection
+        low, high = 1, total - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            rows[:] = full[:middle]
+            if _estimate_tokens(shaped) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        rows[:] = full[:low]
+        rows_omitted.append({"path": path, "total": total, "kept": low})
+    if rows_omitted:
+        omitted["rows_omitted"] = rows_omitted
+
+    if _estimate_tokens(shaped) > budget:
+        text = shaped if isinstance(shaped, str) else json.dumps(shaped, default=str, separators=(",", ":"))
+        keep = max(0, budget * _CHARS_PER_TOKEN - 64)
+        shaped = text[:keep]
+        omitted["chars_truncated"] = len(text) - keep
+
+    omitted["note"] = (
+        "Result trimmed to fit the token budget. Omitted rows/fields are listed here; "
+        "narrow the query (filters, fields, limit) to see them."
+    )
+    return shaped, omitted
+
+
+def _shape_responses(responses: list[dict], per_result: int, per_turn: int) -> list[dict]:
+    indexes = [i for i, r in enumerate(responses) if "result" in r]
+    payloads = [responses[i]["result"] for i in indexes]
+    budgets = _allocate_budgets([_estimate_tokens(p) for p in payloads], per_result, per_turn)
+
+    shaped = list(responses)
+    for i, payload, budget in zip(indexes, payloads, budgets):
+        result, omitted = _shape_result(payload, budget)
+        shaped[i] = {"result": result, "omitted": omitted} if omitted else {"result": result}
+    return shaped
+
+
+async def _execute_tool_calls(mcp_client, function_calls, debug_log: list[str],
+                              max_concurrency: int, timeout: float,
+                              result_budget: int = DEFAULT_RESULT_TOKEN_BUDGET,
+                              turn_budget: int = DEFAULT_TURN_TOKEN_BUDGET) -> list:
+    """
+    Runs the model's function calls concurrently with a per-call timeout.
+
+    Parts are returned in call order; a failed call is reported to the model
+    as an error response instead of aborting the whole turn. Results are
+    shaped to the per-result and per-turn token budgets.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_call(call):
+        async with semaphore:
+            try:
+                # Gemini sends args=None for calls without arguments
+                result = await asyncio.wait_for(mcp_client.call_tool(call.name, call.args or {}), timeout)
+            except Exception as e:
+                error = f"Timed out after {timeout:g}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                return {"error": error}, f"Tool Error: {call.name} -> {error}"
+            result_preview = str(result.content)
+            if len(result_preview) > 500:
+                result_preview = result_preview[:500] + "... (truncated)"
+            return {"result": _content_payload(result.content)}, f"Tool Result: {call.name} -> {result_preview}"
+
+    for call in function_calls:
+        debug_log.append(f"Tool Call: {call.name} args={call.args or {}}")
+    outcomes = await asyncio.gather(*(run_call(call) for call in function_calls))
+    responses = _shape_responses([response for response, _ in outcomes], result_budget, turn_budget)
+
+    parts = []
+    for call, (_, log_line), response in zip(function_calls, outcomes, responses):
+        debug_log.append(log_line)
+        if response.get("omitted"):
+            debug_log.append(f"Tool Result Trimmed: {call.name} -> {response['omitted']}")
+        parts.append(
+            types.Part(
+                function_response=types.FunctionResponse(
+                    name=call.name,
+                    response=response
+                )
+            )
+        )
+    return parts
+
+
+def _prefix_key(model: str, system_instruction: str, tools) -> str:
+    declarations = [t.model_dump(mode="json", exclude_none=True) for t in tools or []]
+    payload = json.dumps([model, system_instruction, declarations], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_expiry(cached, ttl: int) -> float:
+    expire_time = getattr(cached, "expire_time", None)
+    return expire_time.timestamp() if expire_time is not None else time.time() + ttl
+
+
+async def _get_cached_content(client, model: str, system_instruction: str, tools, ttl: int) -> tuple[str | None, str]:
+    """
+    Returns (cached-content name or None, status) for the system prompt + tools
+    prefix. The handle lives in the integration context so later commands
+    reuse it; it is extended before expiry and replaced when the prefix hash
+    changes. Only client.aio.caches.create/update/delete are used.
+    """
+    ctx = get_integration_context() or {}
+    state = ctx.get(CONTEXT_CACHE_KEY) or {}
+    key = _prefix_key(model, system_instruction, tools)
+    now = time.time()
+
+    def save(new_state: dict):
+        ctx[CONTEXT_CACHE_KEY] = new_state
+        set_integration_context(ctx)
+
+    if state.get("key") == key:
+        if state.get("name") and state.get("expires_at", 0) - now > CONTEXT_CACHE_REFRESH_MARGIN:
+            return state["name"], "cache hit"
+        if state.get("name") and state.get("expires_at", 0) > now:
+            try:
+                cached = await client.aio.caches.update(
+                    name=state["name"], config=types.UpdateCachedContentConfig(ttl=f"{ttl}s")
+                )
+                state["expires_at"] = _cache_expiry(cached, ttl)
+                save(state)
+                return state["name"], "extended"
+            except Exception as e:
+                logger.warning(f"Could not extend context cache {state['name']}: {e}")
+        elif not state.get("name") and state.get("retry_at", 0) > now:
+            return None, "unavailable"
+
+    try:
+        cached = await client.aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"soc-agent-{key[:12]}",
+                system_instruction=system_instruction,
+                tools=tools or None,
+                ttl=f"{ttl}s",
+            ),
+        )
+    except Exception as e:
+        save({"key": key, "retry_at": now + CONTEXT_CACHE_RETRY_INTERVAL})
+        logger.warning(f"Context caching unavailable for {model}, sending prompt inline: {e}")
+        return None, "unavailable"
+
+    # The previous prefix will not be used again; drop it instead of waiting for its TTL
+    if state.get("name") and state.get("key") != key:
+        try:
+            await client.aio.caches.delete(name=state["name"])
+        except Exception as e:
+            logger.warning(f"Could not delete stale context cache {state['name']}: {e}")
+
+    save({"key": key, "name": cached.name, "expires_at": _cache_expiry(cached, ttl)})
+    return cached.name, "created"
+
+
 async def run_agent(prompt: str, params: dict):
     mcp_url = params.get("mcp_url") or "https://mcp-xsiam:9010/api/v1/stream/mcp"
     mcp_token = params.get("mcp_auth_token")
     mcp_insecure = bool(params.get("mcp_insecure", False))
     model_name = params.get("gemini_model") or "gemini-2.0-flash-exp"
+    tool_cache_ttl = int(params.get("tool_cache_ttl") or DEFAULT_TOOL_CACHE_TTL)
+    tool_concurrency = int(params.get("tool_concurrency") or DEFAULT_TOOL_CONCURRENCY)
+    tool_timeout = float(params.get("tool_timeout") or DEFAULT_TOOL_TIMEOUT)
+    result_budget = int(params.get("result_token_budget") or DEFAULT_RESULT_TOKEN_BUDGET)
+    turn_budget = int(params.get("turn_token_budget") or DEFAULT_TURN_TOKEN_BUDGET)
+    context_cache = str(params.get("context_cache", True)).lower() != "false"
+    context_cache_ttl = int(params.get("context_cache_ttl") or DEFAULT_CONTEXT_CACHE_TTL)
     debug_log: list[str] = []
 
     api_key = params.get("gemini_api_key")
-    creds_path = _resolve_credentials_path(params.get("vertex_credentials_json"))
+    creds_value = params.get("vertex_credentials_json")
     project_id = params.get("vertex_project") or params.get("google_cloud_project")
 
-    client = _create_genai_client(api_key, creds_path, project_id, model_name)
+    client = await _create_genai_client(api_key, creds_value, project_id, model_name)
     if not client:
         return "Error: Neither GEMINI_API_KEY nor valid Vertex credentials/project were provided."
 
     debug_log.append(f"MCP URL: {mcp_url} (insecure TLS: {mcp_insecure})")
-    async with CortexMCPClient(mcp_url, mcp_token, mcp_insecure) as mcp_client:
-        tools_response = await mcp_client.list_tools()
-        tools_list = tools_response if isinstance(tools_response, list) else tools_response.tools
-        debug_log.append(f"Loaded {len(tools_list)} tools from MCP")
-
-        function_declarations = []
-        for tool in tools_list:
-            schema = getattr(tool, "parameters", getattr(tool, "inputSchema", {}))
-            clean_schema = _sanitize_schema(schema.copy())
-            function_declarations.append(
-                types.FunctionDeclaration(
-                    name=tool.name,
-                    description=tool.description,
-                    parameters=clean_schema
-                )
-            )
+    async with CortexMCPClient(mcp_url, mcp_token, mcp_insecure, _ToolListChangedHandler()) as mcp_client:
+        function_declarations, cache_status = await _get_function_declarations(mcp_client, mcp_url, tool_cache_ttl)
+        debug_log.append(f"Loaded {len(function_declarations)} tools from MCP ({cache_status})")
 
-        config = types.GenerateContentConfig(
-            system_instruction=(
-                "You are an advanced Security Analyst Agent for Cortex XSIAM. "
-                "Use MCP tools when needed and provide clear, actionable responses."
-            ),
-            tools=[types.Tool(function_declarations=function_declarations)] if function_declarations else None,
-        )
+        tools = [types.Tool(function_declarations=function_declarations)] if function_declarations else None
 
-        chat = client.chats.create(model=model_name, config=config)
-        response = chat.send_message(prompt)
+        # Reference the cached system prompt + tools prefix instead of re-sending it
+        cached_content = None
+        if context_cache:
+            cached_content, context_status = await _get_cached_content(
+                client, model_name, SYSTEM_INSTRUCTION, tools, context_cache_ttl
+            )
+            debug_log.append(f"Context cache: {context_status}")
+        if cached_content:
+            config = types.GenerateContentConfig(cached_content=cached_content)
+        else:
+            config = types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION, tools=tools)
+
+        chat = client.aio.chats.create(model=model_name, config=config)
+        response = await chat.send_message(prompt)
 
         while response and response.function_calls:
-            parts = []
-            for call in response.function_calls:
-                debug_log.append(f"Tool Call: {call.name} args={call.args}")
-                result = await mcp_client.call_tool(call.name, call.args)
-                result_preview = str(result.content)
-                if len(result_preview) > 500:
-                    result_preview = result_preview[:500] + "... (truncated)"
-                debug_log.append(f"Tool Result: {call.name} -> {result_preview}")
-                parts.append(
-                    types.Part(
-                        function_response=types.FunctionResponse(
-                            name=call.name,
-                            response={"result": result.content}
-                        )
-                    )
-                )
-            response = chat.send_message(parts)
+            parts = await _execute_tool_calls(mcp_client, response.function_calls, debug_log,
+                                              tool_concurrency, tool_timeout, result_budget, turn_budget)
+            response = await chat.send_message(parts)
 
         return response.text, "\n".join(debug_log)
 
 
+async def refresh_tools(params: dict):
+    mcp_url = params.get("mcp_url") or "https://mcp-xsiam:9010/api/v1/stream/mcp"
+    mcp_token = params.get("mcp_auth_token")
+    mcp_insecure = bool(params.get("mcp_insecure", False))
+    tool_cache_ttl = int(params.get("tool_cache_ttl") or DEFAULT_TOOL_CACHE_TTL)
+
+    async with CortexMCPClient(mcp_url, mcp_token, mcp_insecure) as mcp_client:
+        function_declarations, _ = await _get_function_declarations(mcp_client, mcp_url, tool_cache_ttl, refresh=True)
+    return [declaration.name for declaration in function_declarations]
+
+
 def main():
     params = demisto.params()
     command = demisto.command()
@@ -200,6 +617,19 @@ def main():
         return_results("ok")
         return
 
+    if command == "eset-agent-refresh-tools":
+        tool_names = asyncio.run(refresh_tools(params))
+        stats = get_schema_cache_stats()
+        return_results(CommandResults(
+            readable_output=(
+                f"### MCP Tool Catalog Refreshed\nLoaded {len(tool_names)} tools: {', '.join(tool_names)}\n\n"
+                f"Schema cache: {stats['hits']} hits, {stats['misses']} misses ({stats['entries']} compiled)"
+            ),
+            outputs={"Tools": tool_names, "SchemaCache": stats},
+            outputs_prefix="ESET.Agent",
+        ))
+        return
+
     if command != "eset-agent-run":
         return_error(f"Command '{command}' is not supported.")
 